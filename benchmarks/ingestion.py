@@ -0,0 +1,255 @@
+"""
+Benchmarks of the ingestion and partitioning hot paths.
+
+Generates a synthetic raw_data tree (benchmarks/synthetic.py) and times, per stage:
+
+    geo_parse            parse_geo_column + grid snapping of one S2 month
+    read_sensor_csv      every raw time-series CSV
+    merge                outer join of the sources of one month (join_sources)
+    full_build           create_partitioned_dataset, in memory, from scratch
+    streaming_build      create_partitioned_dataset(streaming=True), from scratch
+    incremental_noop     incremental run with nothing changed
+    incremental_month    incremental run after touching one S2 month
+    missing_partitions   get_missing_partitions over the built dataset
+    missing_months       get_missing_sensor_months over the raw tree
+
+Each stage reports the best time of --repeat runs, rows/s and MB/s of raw CSV, and the
+Python heap peak (tracemalloc, one extra and much slower run; Arrow buffers are not
+tracked). Results are compared with a stored baseline and the run fails when a stage is
+slower or peaks higher than the baseline by more than --tolerance. Baselines are machine specific: refresh them
+with --save-baseline on the machine the comparison runs on.
+
+Usage (from the repository root):
+    python -m benchmarks.ingestion --scenario small
+    python -m benchmarks.ingestion --scenario medium --save-baseline
+    python -m benchmarks.ingestion --pixels 5000 --years 2 --sensors sentinel_2 landsat
+"""
+
+import os
+import sys
+import json
+import time
+import shutil
+import argparse
+import platform
+import resource
+import tempfile
+import tracemalloc
+import contextlib
+import pandas as pd
+
+from pathlib import Path
+from datetime import datetime
+from benchmarks.synthetic import write_raw_tree, SENSORS
+from utils import (parse_geo_column, assign_pixel_ids, read_sensor_csv, join_sources, create_partitioned_dataset,
+                   get_missing_partitions, get_missing_sensor_months, grid_from_csv_files)
+
+BASELINE_FILE = Path(__file__).with_name('baseline.json')
+
+# pixels x years; the medium one matches the size of the SRTM fixture parcel
+SCENARIOS = {
+    'small': {'pixels': 2000, 'years': 1},
+    'medium': {'pixels': 19166, 'years': 1},
+    'large': {'pixels': 50000, 'years': 2},
+}
+
+# Stages shorter than this are not compared on time, the noise is larger than any regression
+MIN_COMPARABLE_S = 0.05
+
+
+def measure(fn, repeat):
+    """Best wall time of repeat runs of fn, then tracemalloc peak (MB) of one more run."""
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        times.append(time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        fn()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+
+    return min(times), peak / 1024 ** 2
+
+
+def quiet(fn):
+    """fn with its stdout (pipeline progress prints) discarded."""
+    def run():
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            return fn()
+    return run
+
+
+def run_benchmarks(workdir, pixels, years, sensors=None, dates_per_month=None, repeat=3):
+    """
+    Runs every stage on a fresh synthetic tree under workdir.
+
+    Returns:
+        dict: {'params': {...}, 'stages': {stage: {'seconds', 'rows', 'rows_per_s', 'mb_per_s', 'peak_mb'}}}
+    """
+    workdir = Path(workdir)
+    raw_path = workdir / 'raw_data'
+    roi_name = 'BENCH'
+    tree = write_raw_tree(raw_path, roi_name, n_pixels=pixels, years=years, sensors=sensors,
+                          dates_per_month=dates_per_month)
+
+    csv_files = sorted(str(f) for f in raw_path.glob('**/*.csv') if f.parent.name != 'srtm')
+    csv_bytes = sum(os.path.getsize(f) for f in csv_files)
+    grid = grid_from_csv_files(csv_files)
+    # Every sensor export of the first month
+    month_files = [f for f in csv_files if Path(f).name == Path(csv_files[0]).name]
+    month_bytes = sum(os.path.getsize(f) for f in month_files)
+
+    stages = {}
+
+    def record(stage, fn, rows, nbytes=0):
+        seconds, peak_mb = measure(fn, repeat)
+        stages[stage] = {
+            'seconds': round(seconds, 4),
+            'rows': rows,
+            'rows_per_s': round(rows / seconds) if seconds else None,
+            'mb_per_s': round(nbytes / 1024 ** 2 / seconds, 2) if seconds and nbytes else None,
+            'peak_mb': round(peak_mb, 1),
+        }
+        print(f"  {stage:<20} {seconds:8.3f} s  {stages[stage]['rows_per_s'] or 0:>12,} rows/s  "
+              f"peak {peak_mb:8.1f} MB")
+
+    # Parsing of one raw CSV (read outside the timed section)
+    geo_file = month_files[-1]
+    geo_df = pd.read_csv(geo_file)
+    record('geo_parse', lambda: assign_pixel_ids(parse_geo_column(geo_df.copy()), grid), len(geo_df),
+           os.path.getsize(geo_file))
+
+    total_rows = tree['rows']
+    record('read_sensor_csv', lambda: [read_sensor_csv(f, grid) for f in csv_files], total_rows, csv_bytes)
+
+    month_dfs = [read_sensor_csv(f, grid) for f in month_files]
+    month_rows = sum(len(df) for df in month_dfs)
+    record('merge', lambda: join_sources([df.copy() for df in month_dfs]), month_rows, month_bytes)
+
+    dataset = workdir / 'dataset'
+
+    def from_scratch(streaming):
+        def build():
+            shutil.rmtree(dataset, ignore_errors=True)
+            create_partitioned_dataset(str(raw_path), str(dataset), incremental=True, streaming=streaming)
+        return quiet(build)
+
+    record('full_build', from_scratch(False), total_rows, csv_bytes)
+    record('streaming_build', from_scratch(True), total_rows, csv_bytes)
+
+    noop = quiet(lambda: create_partitioned_dataset(str(raw_path), str(dataset), incremental=True))
+    record('incremental_noop', noop, 0)
+
+    s2_files = [f for f in csv_files if Path(f).parent.name == 'sentinel_2'] or csv_files
+    touched = s2_files[len(s2_files) // 2]
+    touched_rows = sum(len(pd.read_csv(f, usecols=['date'])) for f in csv_files
+                       if Path(f).name == Path(touched).name)
+
+    def touch_month():
+        os.utime(touched)
+        create_partitioned_dataset(str(raw_path), str(dataset), incremental=True)
+    record('incremental_month', quiet(touch_month), touched_rows, os.path.getsize(touched))
+
+    start, end = tree['start'], tree['end']
+    months = years * 12
+    record('missing_partitions', lambda: get_missing_partitions(start, end, str(dataset)), months)
+    record('missing_months', lambda: get_missing_sensor_months(
+        start, end, roi_name, sensors=sensors or list(SENSORS), raw_path=str(raw_path),
+        refresh_current_month=False), months * len(sensors or SENSORS))
+
+    return {
+        'params': {
+            'pixels': pixels, 'years': years, 'sensors': sensors or list(SENSORS),
+            'dates_per_month': dates_per_month, 'repeat': repeat,
+            'raw_files': tree['files'], 'raw_rows': tree['rows'], 'raw_mb': round(tree['bytes'] / 1024 ** 2, 1),
+        },
+        'stages': stages,
+    }
+
+
+def compare(result, baseline, tolerance):
+    """
+    Stages slower or with a higher peak than baseline * (1 + tolerance).
+
+    Returns:
+        list: Regression messages, empty when none.
+    """
+    regressions = []
+    for stage, current in result['stages'].items():
+        reference = baseline['stages'].get(stage)
+        if reference is None:
+            continue
+
+        if reference['seconds'] >= MIN_COMPARABLE_S and current['seconds'] > reference['seconds'] * (1 + tolerance):
+            regressions.append(f"{stage}: {current['seconds']:.3f} s vs {reference['seconds']:.3f} s baseline")
+        if reference['peak_mb'] >= 1 and current['peak_mb'] > reference['peak_mb'] * (1 + tolerance):
+            regressions.append(f"{stage}: peak {current['peak_mb']:.1f} MB vs {reference['peak_mb']:.1f} MB baseline")
+
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Ingestion and partitioning benchmarks")
+    parser.add_argument('--scenario', choices=sorted(SCENARIOS), default='small')
+    parser.add_argument('--pixels', type=int, help="Pixels per export (overrides the scenario)")
+    parser.add_argument('--years', type=int, help="Years of monthly exports (overrides the scenario)")
+    parser.add_argument('--sensors', nargs='+', choices=list(SENSORS), help="Sensors to generate")
+    parser.add_argument('--dates-per-month', type=int, help="Fixed dates per export instead of the revisit")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--baseline', default=str(BASELINE_FILE))
+    parser.add_argument('--save-baseline', action='store_true', help="Store this run as the scenario baseline")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown/peak growth, 0.25 = 25%%")
+    parser.add_argument('--output', help="Also write the results JSON here")
+    parser.add_argument('--keep', action='store_true', help="Keep the synthetic tree and dataset")
+    args = parser.parse_args(argv)
+
+    custom = any(v is not None for v in (args.pixels, args.years, args.sensors, args.dates_per_month))
+    name = 'custom' if custom else args.scenario
+    pixels = args.pixels or SCENARIOS[args.scenario]['pixels']
+    years = args.years or SCENARIOS[args.scenario]['years']
+
+    workdir = tempfile.mkdtemp(prefix='bench_ingestion_')
+    print(f"Scenario {name}: {pixels} pixels x {years} years in {workdir}")
+    try:
+        result = run_benchmarks(workdir, pixels, years, args.sensors, args.dates_per_month, args.repeat)
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    result['scenario'] = name
+    result['max_rss_mb'] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+    result['machine'] = {'python': platform.python_version(), 'platform': platform.platform(),
+                         'cpus': os.cpu_count()}
+    result['created_at'] = datetime.now().isoformat(timespec='seconds')
+    print(f"  max RSS {result['max_rss_mb']} MB")
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=4)
+
+    baseline_file = Path(args.baseline)
+    baselines = json.loads(baseline_file.read_text()) if baseline_file.exists() else {}
+
+    if args.save_baseline:
+        baselines[name] = result
+        baseline_file.write_text(json.dumps(baselines, indent=4) + '\n')
+        print(f"Baseline for {name} saved to {baseline_file}")
+        return 0
+
+    if name not in baselines or baselines[name]['params'] != result['params']:
+        print(f"No comparable baseline for {name}, run with --save-baseline to create one")
+        return 0
+
+    regressions = compare(result, baselines[name], args.tolerance)
+    for message in regressions:
+        print(f"REGRESSION {message}")
+    print("OK, no regressions" if not regressions else f"{len(regressions)} regressions")
+    return 1 if regressions else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,140 @@
+"""
+Synthetic raw_data trees for the benchmarks.
+
+Files are shaped like real exports: one CSV per (sensor, month) named
+<month start>_<month end>.csv under raw_data/<roi>/<sensor folder>/, with exactly the
+columns of the extractor SELECTORS and '.geo' GeoJSON points in the EE format. Pixel
+positions are taken from the SRTM fixture in raw_data/ROI_TEST (real 10 m sampling of a
+parcel); larger sizes tile copies of that footprint side by side.
+
+Size = pixels x dates x sensors x years, dates following each sensor revisit (or a fixed
+number of dates per month).
+"""
+
+import os
+import numpy as np
+import pandas as pd
+import config
+
+from pathlib import Path
+from datetime import datetime, timedelta
+from dateutil.relativedelta import relativedelta
+from utils import parse_geo_column
+from satellites import sentinel1, sentinel2, landsat_thermal, srtm
+
+SRTM_FIXTURE = 'raw_data/ROI_TEST/srtm/srtm_data.csv'
+
+# Sensor key (config.SENSOR_FOLDERS) -> (export columns, revisit days)
+SENSORS = {
+    'sentinel_1': (sentinel1.SELECTORS, 6),
+    'sentinel_2': (sentinel2.SELECTORS, 5),
+    'landsat': (landsat_thermal.SELECTORS, 8),
+}
+
+# Value ranges of the exported columns; anything else is drawn in [0, 1)
+COLUMN_RANGES = {
+    'VV': (-20, -5), 'VH': (-28, -12), 'RATIOVHVV': (1, 2.5),
+    'NDVI': (-0.1, 0.95), 'EVI': (-0.1, 0.9), 'GNDVI': (0, 0.9), 'IRECI': (0, 1500),
+    'NDMI': (-0.3, 0.6), 'NDRE': (-0.2, 0.7), 'LST': (5, 45),
+    'valid_pixels': (0, 8000), 'total_pixels': (7000, 8000), 'erosion_m': (0, 10),
+    'elevation': (100, 400), 'slope': (0, 30), 'aspect': (0, 360),
+}
+
+# Integer-valued flags
+FLAG_COLUMNS = {'observation_valid', 'is_small_parcel'}
+
+
+def seed_pixels(n_pixels, fixture=SRTM_FIXTURE):
+    """
+    lon/lat of n_pixels sample points from the SRTM fixture, tiling shifted copies eastwards
+    when more pixels than the fixture holds are requested.
+    """
+    coords = parse_geo_column(pd.read_csv(fixture, usecols=['.geo']))[['lon', 'lat']].dropna().to_numpy()
+    width = coords[:, 0].max() - coords[:, 0].min() + 0.001
+    copies = -(-n_pixels // len(coords))
+    tiled = np.concatenate([coords + [k * width, 0] for k in range(copies)])
+    return tiled[:n_pixels, 0], tiled[:n_pixels, 1]
+
+
+def geo_strings(lon, lat):
+    """'.geo' column as exported by getDownloadURL."""
+    return [f'{{"geodesic":false,"type":"Point","coordinates":[{x!r},{y!r}]}}' for x, y in zip(lon.tolist(), lat.tolist())]
+
+
+def column_values(column, n, rng):
+    if column in FLAG_COLUMNS:
+        return rng.integers(0, 2, n)
+    lo, hi = COLUMN_RANGES.get(column, (0, 1))
+    return np.round(rng.uniform(lo, hi, n), 6)
+
+
+def sensor_month_frame(selectors, dates, geo, rng):
+    """One export: every pixel for every date, columns in selectors order."""
+    n_pixels = len(geo)
+    n = n_pixels * len(dates)
+    columns = {}
+    for column in selectors:
+        if column == 'date':
+            columns[column] = np.repeat(np.asarray(dates), n_pixels)
+        elif column == '.geo':
+            columns[column] = np.tile(np.asarray(geo, dtype=object), len(dates))
+        else:
+            columns[column] = column_values(column, n, rng)
+    return pd.DataFrame(columns, columns=selectors)
+
+
+def acquisition_dates(month_start, month_end, revisit_days, dates_per_month=None):
+    """'YYYY-MM-DD' acquisition dates of a month."""
+    days = (month_end - month_start).days + 1
+    if dates_per_month:
+        step = days / dates_per_month
+        return [(month_start + timedelta(days=int(i * step))).strftime('%Y-%m-%d') for i in range(dates_per_month)]
+    return [(month_start + timedelta(days=d)).strftime('%Y-%m-%d') for d in range(0, days, revisit_days)]
+
+
+def write_raw_tree(raw_path, roi_name='BENCH', n_pixels=2000, years=1, sensors=None, dates_per_month=None,
+                   start_year=2023, seed=0):
+    """
+    Writes a synthetic raw_data tree.
+
+    Args:
+        raw_path (str): Root of the tree (stands in for 'raw_data').
+        roi_name (str): ROI folder.
+        n_pixels (int): Pixels per export.
+        years (int): Years of monthly exports, starting in January of start_year.
+        sensors (list): Keys of SENSORS, defaults to all of them.
+        dates_per_month (int): Fixed dates per export instead of each sensor revisit.
+        seed (int): Seed of the random values.
+
+    Returns:
+        dict: {'files': int, 'rows': int, 'bytes': int, 'start': datetime, 'end': datetime}
+    """
+    rng = np.random.default_rng(seed)
+    sensors = sensors or list(SENSORS)
+    lon, lat = seed_pixels(n_pixels)
+    geo = geo_strings(lon, lat)
+    start = datetime(start_year, 1, 1)
+    end = start + relativedelta(years=years, days=-1)
+    summary = {'files': 0, 'rows': 0, 'bytes': 0, 'start': start, 'end': end}
+
+    def write(df, path):
+        path.parent.mkdir(parents=True, exist_ok=True)
+        df.to_csv(path, index=False)
+        summary['files'] += 1
+        summary['rows'] += len(df)
+        summary['bytes'] += os.path.getsize(path)
+
+    for sensor in sensors:
+        selectors, revisit_days = SENSORS[sensor]
+        folder = Path(raw_path) / roi_name / config.SENSOR_FOLDERS[sensor][0]
+        month_start = start
+        while month_start <= end:
+            month_end = month_start + relativedelta(months=1, days=-1)
+            dates = acquisition_dates(month_start, month_end, revisit_days, dates_per_month)
+            write(sensor_month_frame(selectors, dates, geo, rng),
+                  folder / f"{month_start.date()}_{month_end.date()}.csv")
+            month_start += relativedelta(months=1)
+
+    static = {c: geo if c == '.geo' else column_values(c, n_pixels, rng) for c in srtm.SELECTORS}
+    write(pd.DataFrame(static, columns=srtm.SELECTORS), Path(raw_path) / roi_name / 'srtm' / 'srtm_data.csv')
+    return summary
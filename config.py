@@ -149,4 +149,83 @@ CLOUD_THRESH_LANDSAT = 80
 SAMPLING_SCALE = 10 
 metadata_path = f"{os.getcwd()}/metadata/"
 
+# Time-series sensors: key -> (raw_data folder, metadata folder)
+SENSOR_FOLDERS = {
+    'sentinel_1': ('sentinel_1', 'sentinel_1'),
+    'sentinel_2': ('sentinel_2', 'sentinel_2'),
+    'landsat': ('landsat_thermal', 'landsat'),
+}
+
+# Earth Engine backend: 'earthengine' (live API) or 'fake' (modules/fake_ee.py, synthetic
+# rasters, no credentials) for offline runs, profiling and load tests
+EE_BACKEND = os.environ.get('EE_BACKEND', 'earthengine')
+
+# Number of sensor-month download jobs run concurrently by run_pipeline
+DOWNLOAD_WORKERS = 4
+
+# Export downloads: retries after the first attempt, base backoff delay and socket timeout
+DOWNLOAD_RETRIES = 4
+DOWNLOAD_BACKOFF_S = 2
+DOWNLOAD_TIMEOUT_S = 300
+
+# Per-pixel exports above this many rows (pixels x images) are split into date windows
+# and spatial tiles, fetched EXPORT_TILE_WORKERS at a time
+EXPORT_MAX_ROWS = 150000
+EXPORT_TILE_WORKERS = 4
+
+# Pixel transfer mode of the time-series extractors: 'csv' (sampled features with a
+# GeoJSON point per pixel per date), 'array' (dense band stacks over the ROI bounding
+# box via computePixels, stored as .npz) or 'aggregate' (no pixels: one row per parcel
+# and date with robust statistics per index). ARRAY_MAX_REQUEST_MB bounds each request.
+EXTRACTION_MODE = 'csv'
+ARRAY_MAX_REQUEST_MB = 32
+
+# Sentinel-2 reflectance bands (B2/B3/B4/B5/B8/B11) exported next to the indices, so
+# indices can be added or recomputed locally (modules/spectral_indices.py); the indices
+# in LOCAL_INDICES are recomputed from those bands at ingestion, replacing the exported ones
+S2_EXPORT_BANDS = False
+LOCAL_INDICES = []
+
+# Sentinel-2 ensemble cloud mask rules: Cloud Score+ cs/cs_cdf minimums, S2Cloudless
+# probability maximum, clear SCL classes and cloud dilation radius (m). S2_CLOUD_MASK
+# 'server' masks in Earth Engine before sampling; 'local' exports unmasked pixels with
+# their QA bands and masks them at ingestion (modules/cloud_mask.py), so changed rules
+# are re-applied to the stored raw data without downloading it again
+CLOUD_MASK_RULES = {'cs_min': 0.60, 'cs_cdf_min': 0.70, 'prob_max': 30, 'scl_clear': [4, 5, 6], 'dilation_m': 20}
+S2_CLOUD_MASK = 'server'
+
+# Cloud shadow masking of the local mask (not applied by the server mask): cloud cores
+# (S2Cloudless probability above core_prob or SCL in core_scl) are projected away from
+# the sun for each cloud height (m), confirmed where dark (NIR reflectance below nir_max,
+# SCL not water_scl) and dilated by dilation_m
+SHADOW_MASK_RULES = {'enabled': True, 'core_prob': 50, 'core_scl': [8, 9], 'heights_m': [500, 1000, 2000],
+                     'nir_max': 0.15, 'water_scl': 6, 'dilation_m': 10}
+
+# Sentinel-1 speckle filtering. S1_DESPECKLE 'server' applies the 5x5 boxcar of
+# utils.despeckle (on dB) in Earth Engine; 'local' exports the unfiltered VV/VH and
+# filters them at ingestion (modules/speckle.py) with S1_SPECKLE_FILTER: 'boxcar', 'lee'
+# or 'none' on linear power, odd window sizes over (time, y, x) and the equivalent number
+# of looks of the Lee filter. Time windows are cut at the streaming date windows
+S1_DESPECKLE = 'server'
+S1_SPECKLE_FILTER = {'filter': 'lee', 'window': [1, 5, 5], 'enl': 5}
+
+# Raw folder of the aggregate exports (<path>/<ROI>/<sensor folder>/), ingested into
+# database/<ROI>/_parcel_stats.parquet
+PARCEL_STATS_PATH = 'raw_stats'
+
+# Local cache of EE exports: folder, size bound (MB, LRU eviction) and TTL (s) for exports
+# reaching the current, still-changing month
+EXPORT_CACHE_DIR = 'cache/exports'
+EXPORT_CACHE_MAX_MB = 2048
+EXPORT_CACHE_TTL_S = 6 * 3600
+
+# Memory ceiling (MB) for streaming CSV-to-Parquet ingestion
+INGEST_MEMORY_LIMIT_MB = 1024
+
+# Multi-parcel batch mode (modules/parcels.py): GeoJSON FeatureCollection of the parcels,
+# property holding each parcel id, and raw_data/metadata folder of the parcel group
+PARCELS_FILE = 'parcels.geojson'
+PARCEL_ID_PROPERTY = 'parcel_id'
+PARCELS_GROUP = 'PARCELS'
+
 runid = "test"
\ No newline at end of file
@@ -102,8 +102,7 @@ def export_with_step2(
         coverage = stats.get('coverage_ratio')
         
         # Sample pixels
-        # Note: MNDWI is not available (bug in utils.py - mndwi function calculates NDRE instead)
-        indices = ['NDVI', 'EVI', 'GNDVI', 'IRECI', 'NDMI', 'NDRE']
+        indices = ['NDVI', 'EVI', 'GNDVI', 'IRECI', 'NDMI', 'MNDWI', 'NDRE']
         sampled = img.select(indices).sample(
             region=roi_to_use,
             scale=config.SAMPLING_SCALE,
@@ -131,7 +130,7 @@ def export_with_step2(
     print("\n4. Generating download URL...")
     selectors = [
         'date', 
-        'NDVI', 'EVI', 'GNDVI', 'IRECI', 'NDMI', 'NDRE',
+        'NDVI', 'EVI', 'GNDVI', 'IRECI', 'NDMI', 'MNDWI', 'NDRE',
         'valid_pixels', 'total_pixels', 'coverage_ratio', 
         'observation_valid', 'erosion_m', 'is_small_parcel',
         '.geo'
@@ -1,45 +1,182 @@
+import os
 import config
+import argparse
 import datetime
 import calendar
 
+# The offline backend must replace 'ee' before the extractors are imported
+if config.EE_BACKEND == 'fake':
+    from modules import fake_ee
+    fake_ee.install()
+
 from satellites.srtm import get_srtm
-from satellites.sentinel1 import get_st1
-from satellites.sentinel2 import get_st2
-from utils import get_missing_partitions, create_partitioned_dataset
-from dateutil.relativedelta import relativedelta
-from satellites.landsat_thermal import get_landsat
+from satellites.sentinel1 import get_st1, get_st1_parcels
+from satellites.sentinel2 import get_st2, get_st2_parcels
+from utils import (create_conn_ee, get_missing_sensor_months, month_window, create_partitioned_dataset,
+                   write_parcel_stats, save_run_metadata, prune_superseded_exports)
+from satellites.landsat_thermal import get_landsat, get_landsat_parcels
+from modules.pixel_grid import master_grid
+from modules.scheduler import make_job, run_jobs
+from modules.tracing import tracing, summarize, peak_rss_mb
+from modules.profiling import Profiler
+from modules.parcels import load_parcels, parcels_bounds, write_parcel_pixels, write_parcel_qa, image_dates
+
+# Extractor of each time-series sensor (keys of config.SENSOR_FOLDERS)
+EXTRACTORS = {
+    'sentinel_1': get_st1,
+    'sentinel_2': get_st2,
+    'landsat': get_landsat,
+}
+
+# Batch extractor of each time-series sensor for a group of parcels (modules/parcels.py)
+PARCEL_EXTRACTORS = {
+    'sentinel_1': get_st1_parcels,
+    'sentinel_2': get_st2_parcels,
+    'landsat': get_landsat_parcels,
+}
+
+
+def run_pipeline(roi_coords=config.ROI_TEST, start_date=config.START, end_date=config.END, progress_callback=None,
+                 max_workers=config.DOWNLOAD_WORKERS, extraction_mode=config.EXTRACTION_MODE, profile=False,
+                 profile_top=30, parcels=None, parcels_group=config.PARCELS_GROUP):
+    """
+    Downloads the missing sensor-months of the ROI and rebuilds the affected partitions.
 
+    With parcels ({parcel_id: coords}, see modules.parcels.load_parcels) the whole group
+    is extracted in batch instead of roi_coords: one collection and one export per
+    sensor-month for all parcels, stored under raw_data/<parcels_group>/ and
+    database/<parcels_group>/ with the pixel -> parcel table in _static/parcels.parquet and
+    the per-observation QA of every parcel in _parcel_qa.parquet.
+    Batch exports are CSV samples or, with extraction_mode='aggregate', parcel statistics.
 
+    extraction_mode='aggregate' transfers no pixels: each sensor-month is exported as one
+    row per parcel (the ROI alone when parcels is None) and date with robust statistics
+    per index, under config.PARCEL_STATS_PATH/<ROI>/, and ingested into
+    database/<ROI>/_parcel_stats.parquet instead of the pixel partitions. SRTM is skipped.
 
-def run_pipeline(roi_coords=config.ROI_TEST, start_date=config.START, end_date=config.END, progress_callback=None):
+    With profile=True every sensor-month job and the create_partitioned_dataset step run
+    under cProfile and tracemalloc (modules/profiling.py); jobs then run one at a time and
+    the .prof files and a report of the profile_top hotspots are written to
+    metadata/<ROI>/<runid>_profile/.
+    """
     # roi_coord will be a json file path?
 
     # set_run_id = currnet_timestamp()
     roi_coords_name = config.roi_name
+    if parcels:
+        # The parcel group replaces the single ROI; its bounding box is used for SRTM and the grid
+        roi_coords = parcels_bounds(parcels)
+        roi_coords_name = parcels_group
+    aggregate = extraction_mode == 'aggregate'
+    raw_path = config.PARCEL_STATS_PATH if aggregate else 'raw_data'
+    run_started = datetime.datetime.now()
+    traces = []
+
+    profiler = None
+    if profile:
+        profiler = Profiler(f"{config.metadata_path}{roi_coords_name}/{config.runid}_profile", top_n=profile_top)
+        # Profilers are process-wide, overlapping jobs would mix their numbers
+        max_workers = 1
     
-    dates_to_be_downloaded = get_missing_partitions(start_date, end_date, f'database/{roi_coords_name}')
+    # Gaps are detected per (sensor, month) from the raw CSVs and metadata, so only
+    # the missing sensor-month pairs are requested from Earth Engine
+    missing_sensor_months = get_missing_sensor_months(start_date, end_date, roi_coords_name, raw_path=raw_path)
+    results = []
     if roi_coords:
-        if dates_to_be_downloaded or end_date == datetime.current():
-    
-            get_srtm(roi_coords, roi_coords_name)
-            
-            for i in dates_to_be_downloaded:
-                download_start_date = i
-                if download_start_date == datetime.date.today().replace(day=1):
-                    download_end_date = datetime.date.today()
+        if not aggregate and not os.path.exists(f'raw_data/{roi_coords_name}/srtm/srtm_data.csv'):
+            with tracing('srtm') as trace:
+                get_srtm(roi_coords, roi_coords_name)
+            traces.append(trace.to_dict())
+
+        if parcels and not aggregate:
+            write_parcel_pixels(parcels, master_grid(roi_coords), roi_coords_name)
+
+        # Open the shared EE session once, before the workers start
+        create_conn_ee()
+
+        jobs = []
+        for month_start, sensors in missing_sensor_months.items():
+            download_start_date, download_end_date = month_window(month_start)
+            for sensor in sensors:
+                if parcels:
+                    extractor, region = PARCEL_EXTRACTORS[sensor], parcels
+                    kwargs = {'GROUP_NAME': roi_coords_name, 'mode': 'aggregate' if aggregate else 'csv'}
                 else:
-                    download_end_date = i + relativedelta(months=1, days=-1)
-                get_st1(roi_coords, download_start_date, download_end_date, roi_coords_name)
-                get_st2(roi_coords, download_start_date, download_end_date, roi_coords_name)
-                get_landsat(roi_coords, download_start_date, download_end_date, roi_coords_name)
+                    extractor, region = EXTRACTORS[sensor], roi_coords
+                    kwargs = {'ROI_NAME': roi_coords_name, 'mode': extraction_mode}
+                if profiler is not None:
+                    extractor = profiler.wrap(f"{sensor}_{month_start:%Y-%m}", extractor)
+                jobs.append(make_job(sensor, month_start, extractor,
+                                     region, download_start_date, download_end_date, **kwargs))
+
+        # Sensor-month jobs are independent, their EE and download waits overlap on a thread pool
+        print(f"Downloading {len(jobs)} sensor-month jobs with {max_workers} workers...")
+        results = run_jobs(jobs, max_workers=max_workers, progress_callback=progress_callback)
+
+        failed = [r for r in results if r['status'] != 'success']
+        if failed:
+            print(f"{len(failed)} jobs failed, they will be retried on the next run:")
+            for r in failed:
+                print(f"   {r['sensor']} {r['month']:%Y-%m}: {r['error']}")
 
     else:
          print(f"Roi Coords not defined, please define them. Roi coord used {roi_coords}")
 
     # else:
     #     # return report using existing data
-    create_partitioned_dataset('raw_data', f'database/{roi_coords_name}')
+
+    # Partial downloads of a month (current month, earlier runs) replaced by a longer one
+    prune_superseded_exports(f'{raw_path}/{roi_coords_name}')
+    if aggregate:
+        ingest = write_parcel_stats if profiler is None else profiler.wrap('ingestion', write_parcel_stats)
+        with tracing('ingestion') as trace:
+            ingest(f'{raw_path}/{roi_coords_name}', f'database/{roi_coords_name}')
+    else:
+        ingest = create_partitioned_dataset if profiler is None else profiler.wrap('ingestion', create_partitioned_dataset)
+        with tracing('ingestion') as trace:
+            ingest(f'{raw_path}/{roi_coords_name}', f'database/{roi_coords_name}', incremental=True, streaming=True,
+                   grid=master_grid(roi_coords) if roi_coords else None)
+            if parcels:
+                write_parcel_qa(parcels, f'database/{roi_coords_name}', master_grid(roi_coords),
+                                dates=image_dates(roi_coords_name))
+    traces.append(trace.to_dict())
+
+    # Run-level summary: where the time went, per job and per stage over the whole run
+    job_summaries = [
+        {'sensor': r['sensor'], 'month': f"{r['month']:%Y-%m}", 'status': r['status'], **r['timing']}
+        for r in results
+    ]
+    all_spans = [s for t in traces for s in t['spans']]
+    all_spans += [{**totals, 'stage': stage} for j in job_summaries for stage, totals in j['stages'].items()]
+    save_run_metadata({
+        'run_id': config.runid,
+        'created_at': str(run_started),
+        'wall_s': round((datetime.datetime.now() - run_started).total_seconds(), 3),
+        'peak_rss_mb': peak_rss_mb(),
+        'jobs': {'total': len(results), 'failed': sum(r['status'] != 'success' for r in results)},
+        'stages': summarize(all_spans)['stages'],
+        'job_timings': job_summaries,
+        'traces': traces,
+    }, roi_coords_name)
+
+    if profiler is not None:
+        print(f"Profile report written to {profiler.write_report()}")
+
+    return results
 
 if __name__ == "__main__":
-    run_pipeline()
+    parser = argparse.ArgumentParser(description="Download the missing sensor-months and update the dataset")
+    parser.add_argument('--start', default=config.START, help="Start date (YYYY-MM-DD)")
+    parser.add_argument('--end', default=config.END, help="End date (YYYY-MM-DD)")
+    parser.add_argument('--workers', type=int, default=config.DOWNLOAD_WORKERS, help="Concurrent sensor-month jobs")
+    parser.add_argument('--mode', choices=['csv', 'array', 'aggregate'], default=config.EXTRACTION_MODE, help="Extraction mode")
+    parser.add_argument('--profile', action='store_true', help="Profile every job and the ingestion step")
+    parser.add_argument('--profile-top', type=int, default=30, help="Rows of each ranking in the profile report")
+    parser.add_argument('--parcels', help="GeoJSON FeatureCollection of parcels to extract in batch")
+    parser.add_argument('--group', default=config.PARCELS_GROUP, help="Folder name of the parcel group")
+    args = parser.parse_args()
+
+    run_pipeline(start_date=args.start, end_date=args.end, max_workers=args.workers, extraction_mode=args.mode,
+                 profile=args.profile, profile_top=args.profile_top,
+                 parcels=load_parcels(args.parcels) if args.parcels else None, parcels_group=args.group)
 
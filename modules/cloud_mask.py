@@ -0,0 +1,240 @@
+"""
+Local Sentinel-2 ensemble cloud mask.
+
+Applies the rules of apply_s2_masks (modules/satellites_data_extraction.py) with NumPy
+on the pixel grid: Cloud Score+ cs/cs_cdf minimums, S2Cloudless probability maximum,
+clear SCL classes, then a disk dilation of the cloudy pixels. Thresholds and radius come
+from config.CLOUD_MASK_RULES.
+
+Cloud shadows, whose projection is disabled in the server mask, are masked as well when
+the export carries SHADOW_BANDS (config.SHADOW_MASK_RULES): the cloud cores of each
+date are translated away from the sun for every cloud height, kept where the surface is
+dark and dilated. The translations only depend on the scene geometry (solar angles), so
+their pixel offsets are computed once per geometry and applied together to all the dates
+sharing it.
+
+With config.S2_CLOUD_MASK = 'local' the Sentinel-2 extractors export unmasked pixels
+with their QA_BANDS and SHADOW_BANDS and ingestion masks them with mask_frame
+(utils.apply_local_cloud_mask), so changed rules are a local re-ingestion of the stored
+raw files instead of a new export.
+
+Only the exported pixels are known locally: clouds just outside the ROI do not dilate
+into it, nor cast their shadows on it, whereas the server mask sees the whole scene.
+"""
+
+import numpy as np
+import config
+
+from functools import lru_cache
+from modules.pixel_grid import frame_cube, frame_windows
+
+# QA bands the mask is computed from, as named by get_sentinel2_data
+QA_BANDS = ['cs_cs', 'cs_cs_cdf', 'cld_probability', 'SCL']
+
+# Per-image solar angles (degrees), as added by satellites_data_extraction.add_solar_bands
+SOLAR_BANDS = ['solar_azimuth', 'solar_zenith']
+
+# Bands needed by the shadow projection; B8 is a reflectance band and stays in the dataset
+SHADOW_BANDS = ['B8', *SOLAR_BANDS]
+
+
+def mask_rules(rules=None):
+    """config.CLOUD_MASK_RULES with the given entries overridden."""
+    return {**config.CLOUD_MASK_RULES, **(rules or {})}
+
+
+def shadow_rules(rules=None):
+    """config.SHADOW_MASK_RULES with the given entries overridden."""
+    return {**config.SHADOW_MASK_RULES, **(rules or {})}
+
+
+def disk_offsets(radius_px):
+    """(dy, dx) offsets of a disk of radius_px pixels, the 'circle' kernel of focal_max."""
+    r = int(np.floor(radius_px))
+    dy, dx = np.mgrid[-r:r + 1, -r:r + 1]
+    inside = dy ** 2 + dx ** 2 <= radius_px ** 2
+    return list(zip(dy[inside].tolist(), dx[inside].tolist()))
+
+
+def translate_union(mask, offsets):
+    """
+    Union of (..., y, x) masks translated by each (dy, dx) offset, in pixels.
+
+    Pixels moved outside the block are lost, no padding copy is made.
+    """
+    h, w = mask.shape[-2:]
+    out = np.zeros_like(mask)
+    for dy, dx in offsets:
+        if abs(dy) >= h or abs(dx) >= w:
+            continue
+        out[..., max(dy, 0):h + min(dy, 0), max(dx, 0):w + min(dx, 0)] |= \
+            mask[..., max(-dy, 0):h + min(-dy, 0), max(-dx, 0):w + min(-dx, 0)]
+    return out
+
+
+def dilate(mask, radius_px):
+    """Binary dilation of (..., y, x) masks by a disk, as focal_max(radius, 'circle')."""
+    if int(np.floor(radius_px)) < 1:
+        return mask.copy()
+    return translate_union(mask, disk_offsets(radius_px))
+
+
+@lru_cache(maxsize=4096)
+def shadow_offsets(azimuth, zenith, heights, scale=config.SAMPLING_SCALE):
+    """
+    Pixel offsets of the shadows cast by clouds at the given heights (m).
+
+    The shadow lies heights * tan(zenith) away from the cloud, opposite to the sun
+    (azimuth + 180, clockwise from north). Rows count northing cells, so north is +y.
+
+    Returns:
+        tuple: Distinct (dy, dx) offsets, empty when an angle is unknown.
+    """
+    if not (np.isfinite(azimuth) and np.isfinite(zenith)):
+        return ()
+    direction = np.radians(azimuth + 180)
+    distance = np.asarray(heights, dtype='float64') * np.tan(np.radians(zenith)) / scale
+    dy = np.rint(distance * np.cos(direction)).astype('int64')
+    dx = np.rint(distance * np.sin(direction)).astype('int64')
+    return tuple(dict.fromkeys(zip(dy.tolist(), dx.tolist())))
+
+
+def image_angles(values):
+    """Mean of the finite values of each (y, x) image of a (..., y, x) stack, NaN if none."""
+    finite = np.isfinite(values)
+    count = finite.sum(axis=(-2, -1))
+    total = np.where(finite, values, 0).sum(axis=(-2, -1))
+    return np.where(count > 0, total / np.maximum(count, 1), np.nan)
+
+
+def project_shadows(cores, azimuth, zenith, heights, scale=config.SAMPLING_SCALE):
+    """
+    Shadow projection of (..., y, x) cloud core masks.
+
+    Args:
+        cores (np.ndarray): Cloud cores, one (y, x) image per leading index.
+        azimuth, zenith (np.ndarray): Solar angles of each image (shape cores.shape[:-2]).
+        heights (list): Cloud heights (m).
+
+    Returns:
+        np.ndarray: Projected shadows, same shape as cores.
+    """
+    lead = cores.shape[:-2]
+    flat = cores.reshape(-1, *cores.shape[-2:])
+    kernels = [shadow_offsets(float(a), float(z), tuple(heights), scale)
+               for a, z in zip(np.ravel(azimuth), np.ravel(zenith))]
+
+    # Images sharing a geometry are translated together
+    shadows = np.zeros_like(flat)
+    for kernel in set(kernels):
+        if kernel:
+            images = [i for i, k in enumerate(kernels) if k == kernel]
+            shadows[images] = translate_union(flat[images], kernel)
+    return shadows.reshape(*lead, *cores.shape[-2:])
+
+
+def clear_pixels(qa, rules=None):
+    """
+    Per-pixel part of the mask, on arrays of any shape.
+
+    Args:
+        qa (dict): {band: array} for QA_BANDS, NaN where the band is missing.
+
+    Returns:
+        tuple: (known, clear) bool arrays; known is False where a QA band is missing.
+    """
+    rules = mask_rules(rules)
+    known = np.logical_and.reduce([np.isfinite(qa[band]) for band in QA_BANDS])
+    with np.errstate(invalid='ignore'):
+        clear = (qa['cs_cs'] >= rules['cs_min']) & (qa['cs_cs_cdf'] >= rules['cs_cdf_min']) \
+            & (qa['cld_probability'] <= rules['prob_max']) & np.isin(qa['SCL'], rules['scl_clear'])
+    return known, clear
+
+
+def shadow_pixels(qa, known, rules=None, scale=config.SAMPLING_SCALE):
+    """
+    Confirmed cloud shadows of (..., y, x) stacks holding QA_BANDS and SHADOW_BANDS.
+
+    Cloud cores (probability above core_prob or SCL in core_scl) are projected for every
+    height and kept where dark: NIR reflectance (B8 / 10000) below nir_max and not water.
+    """
+    rules = shadow_rules(rules)
+    with np.errstate(invalid='ignore'):
+        cores = known & ((qa['cld_probability'] > rules['core_prob']) | np.isin(qa['SCL'], rules['core_scl']))
+        dark = (qa['B8'] / 10000 < rules['nir_max']) & (qa['SCL'] != rules['water_scl'])
+
+    shadows = project_shadows(cores, image_angles(qa['solar_azimuth']), image_angles(qa['solar_zenith']),
+                              rules['heights_m'], scale)
+    return shadows & dark & known
+
+
+def valid_mask(qa, rules=None, shadows=None, scale=config.SAMPLING_SCALE):
+    """
+    Pixels kept by the mask on (..., y, x) QA stacks (e.g. an array export).
+
+    Pixels with missing QA are dropped but, as masked pixels in focal_max, not dilated.
+    Shadows are masked when qa holds SHADOW_BANDS and the shadow rules are enabled.
+
+    Args:
+        rules (dict): Overrides of config.CLOUD_MASK_RULES.
+        shadows (dict): Overrides of config.SHADOW_MASK_RULES.
+    """
+    rules = mask_rules(rules)
+    shadows = shadow_rules(shadows)
+    known, clear = clear_pixels(qa, rules)
+    invalid = dilate(known & ~clear, rules['dilation_m'] / scale)
+
+    if shadows['enabled'] and all(band in qa for band in SHADOW_BANDS):
+        invalid |= dilate(shadow_pixels(qa, known, shadows, scale), shadows['dilation_m'] / scale)
+
+    return known & ~invalid
+
+
+def mask_reach(df, rules=None, shadows=None, scale=config.SAMPLING_SCALE):
+    """
+    Farthest a pixel of a frame can be masked from (pixels): the cloud dilation radius,
+    or the longest shadow projection of its dates plus the shadow dilation.
+    """
+    rules = mask_rules(rules)
+    shadows = shadow_rules(shadows)
+    reach = int(np.floor(rules['dilation_m'] / scale))
+
+    if shadows['enabled'] and all(band in df.columns for band in SHADOW_BANDS):
+        angles = df.groupby('date')[SOLAR_BANDS].mean()
+        offsets = [offset for a, z in zip(angles['solar_azimuth'], angles['solar_zenith'])
+                   for offset in shadow_offsets(float(a), float(z), tuple(shadows['heights_m']), scale)]
+        if offsets:
+            shift = max(max(abs(dy), abs(dx)) for dy, dx in offsets)
+            reach = max(reach, shift + int(np.floor(shadows['dilation_m'] / scale)))
+    return reach
+
+
+def mask_frame(df, rules=None, shadows=None, scale=config.SAMPLING_SCALE):
+    """
+    Masks a (date, pixel_id, band...) frame of one sensor holding QA_BANDS (and
+    optionally SHADOW_BANDS), see valid_mask.
+
+    Every date must be complete (all its pixels in df) for the dilation and the shadow
+    projection to see the neighbours. Masked rows are dropped, as sample() skips masked
+    pixels, and the QA and solar columns are removed.
+
+    The dense blocks are built per frame_windows window, pixels farther apart than
+    mask_reach never affecting each other, so their size follows the pixels and not the
+    bounding box of a spread-out parcel group.
+    """
+    qa_columns = [band for band in QA_BANDS + SHADOW_BANDS if band in df.columns]
+    drop = [band for band in QA_BANDS + SOLAR_BANDS if band in df.columns]
+    if df.empty:
+        return df.drop(columns=drop)
+
+    keep = np.zeros(len(df), dtype=bool)
+    for positions in frame_windows(df, mask_reach(df, rules, shadows, scale)):
+        window = df.iloc[positions]
+        index, shape = frame_cube(window)
+        qa = {}
+        for band in qa_columns:
+            qa[band] = np.full(shape, np.nan)
+            qa[band][index] = window[band].to_numpy(dtype='float64', na_value=np.nan)
+        keep[positions] = valid_mask(qa, rules, shadows, scale)[index]
+
+    return df.loc[keep].drop(columns=drop).reset_index(drop=True)
@@ -0,0 +1,123 @@
+"""
+Shared download layer for Earth Engine exports.
+
+All extractors download their getDownloadURL exports through download_file, which:
+- reuses one pooled requests.Session (TLS connections are kept alive across exports),
+- streams the body in chunks to a hidden temp file next to the target,
+- computes a SHA-256 checksum while streaming,
+- retries failed attempts with exponential backoff,
+- moves the temp file over the target with os.replace only once it is complete,
+  so a failed download never leaves a truncated CSV behind.
+"""
+
+import os
+import time
+import hashlib
+import threading
+import requests
+import config
+
+from pathlib import Path
+from requests.adapters import HTTPAdapter
+from modules.tracing import span
+
+# HTTP status codes worth retrying (rate limiting and transient server errors)
+RETRY_STATUS = {429, 500, 502, 503, 504}
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def get_session():
+    """Process-wide requests.Session with a connection pool sized for the download workers."""
+    global _session
+
+    with _session_lock:
+        if _session is None:
+            session = requests.Session()
+            adapter = HTTPAdapter(
+                pool_connections=config.DOWNLOAD_WORKERS,
+                pool_maxsize=config.DOWNLOAD_WORKERS * 2
+            )
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session = session
+
+    return _session
+
+
+class DownloadError(Exception):
+    """Raised when a file could not be downloaded after all retries."""
+
+
+def download_file(url, output_file, retries=config.DOWNLOAD_RETRIES, backoff=config.DOWNLOAD_BACKOFF_S,
+                  chunk_size=1024 * 1024, timeout=config.DOWNLOAD_TIMEOUT_S):
+    """
+    Downloads url to output_file with streaming, retries and an atomic final rename.
+
+    Args:
+        url (str): URL to download (e.g. from getDownloadURL).
+        output_file (str/Path): Destination path, parent folders are created.
+        retries (int): Number of attempts after the first one.
+        backoff (float): Base delay in seconds, doubled after every failed attempt.
+        chunk_size (int): Bytes read from the socket and written per chunk.
+        timeout (float): Connect/read timeout in seconds.
+
+    Returns:
+        dict: {'path': str, 'bytes': int, 'sha256': str, 'attempts': int}
+
+    Raises:
+        DownloadError: If every attempt failed.
+    """
+    output_file = Path(output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    with span('download', file=output_file.name) as s:
+        info = _download(url, output_file, retries, backoff, chunk_size, timeout)
+        s['bytes'] = info['bytes']
+        s['attempts'] = info['attempts']
+    return info
+
+
+def _download(url, output_file, retries, backoff, chunk_size, timeout):
+    tmp_file = output_file.with_name(f".{output_file.name}.part")
+    session = get_session()
+    last_error = None
+
+    for attempt in range(1, retries + 2):
+        try:
+            with session.get(url, stream=True, timeout=timeout) as response:
+                if response.status_code in RETRY_STATUS:
+                    raise requests.HTTPError(f"HTTP {response.status_code}", response=response)
+                response.raise_for_status()
+
+                sha256 = hashlib.sha256()
+                size = 0
+                with open(tmp_file, 'wb') as f:
+                    for chunk in response.iter_content(chunk_size=chunk_size):
+                        f.write(chunk)
+                        sha256.update(chunk)
+                        size += len(chunk)
+
+                expected = response.headers.get('Content-Length')
+                if expected is not None and response.headers.get('Content-Encoding') is None and int(expected) != size:
+                    raise requests.ConnectionError(f"Truncated download: {size} of {expected} bytes")
+
+            os.replace(tmp_file, output_file)
+            return {'path': str(output_file), 'bytes': size, 'sha256': sha256.hexdigest(), 'attempts': attempt}
+
+        except requests.RequestException as e:
+            last_error = e
+            if tmp_file.exists():
+                tmp_file.unlink()
+
+            # Client errors other than rate limiting will not fix themselves
+            status = e.response.status_code if e.response is not None else None
+            if status is not None and status not in RETRY_STATUS:
+                break
+
+            if attempt <= retries:
+                delay = backoff * 2 ** (attempt - 1)
+                print(f"   Download attempt {attempt} failed ({e}), retrying in {delay:.0f}s...")
+                time.sleep(delay)
+
+    raise DownloadError(f"Could not download {output_file.name}: {last_error}")
@@ -0,0 +1,151 @@
+"""
+Content-addressed on-disk cache for Earth Engine exports.
+
+An export is identified by a SHA-256 of everything that determines its content (sensor,
+ROI geometry, date range, cloud thresholds, selectors, sampling scale). Repeating an
+extraction with the same parameters copies the cached CSV instead of asking EE for a new
+getDownloadURL export.
+
+Layout: <EXPORT_CACHE_DIR>/<key[:2]>/<key>.csv (.npz for array exports) plus a <key>.json sidecar holding the
+creation time and the client-side info of the original run (e.g. image count).
+The cache is bounded to EXPORT_CACHE_MAX_MB with LRU eviction (file mtime is bumped on
+every hit) and entries of a still-changing month expire after EXPORT_CACHE_TTL_S.
+"""
+
+import os
+import json
+import time
+import shutil
+import hashlib
+import threading
+import config
+
+from pathlib import Path
+from datetime import datetime
+
+# Bump when the processing of any extractor changes so old exports are not reused
+# (2: the Sentinel-2 NDRE column held MNDWI values before utils.mndwi was renamed)
+CACHE_VERSION = 2
+
+# Suffixes of the cached exports: CSV samples and pixel_arrays .npz stacks
+ENTRY_SUFFIXES = ('.csv', '.npz')
+
+_evict_lock = threading.Lock()
+
+
+def cache_key(sensor, ROI, start_date, end_date, selectors, **params):
+    """
+    Hash identifying an export.
+
+    Args:
+        sensor (str): Sensor name.
+        ROI (list/ee.Geometry): Region of interest, ee objects are serialized locally.
+        start_date, end_date: Date range (anything with a stable str()).
+        selectors (list): Exported columns.
+        **params: Any other parameter affecting the content (cloud thresholds, scale, ...).
+
+    Returns:
+        str: Hex SHA-256 digest.
+    """
+    roi = ROI.serialize() if hasattr(ROI, 'serialize') else ROI
+    payload = {
+        'version': CACHE_VERSION,
+        'sensor': sensor,
+        'roi': roi,
+        'start': str(start_date),
+        'end': str(end_date),
+        'selectors': list(selectors),
+        'params': params,
+    }
+    encoded = json.dumps(payload, sort_keys=True, default=str).encode('utf-8')
+    return hashlib.sha256(encoded).hexdigest()
+
+
+def export_ttl(end_date):
+    """TTL in seconds for an export: EXPORT_CACHE_TTL_S if it reaches the current month, else None (never expires)."""
+    end = end_date if isinstance(end_date, datetime) else datetime.strptime(str(end_date)[:10], "%Y-%m-%d")
+    now = datetime.now()
+    if (end.year, end.month) >= (now.year, now.month):
+        return config.EXPORT_CACHE_TTL_S
+    return None
+
+
+def _entry_paths(key, cache_dir, export_file):
+    """Data and info files of an entry; the data file keeps the suffix of the export."""
+    folder = Path(cache_dir) / key[:2]
+    return folder / f"{key}{Path(export_file).suffix or '.csv'}", folder / f"{key}.json"
+
+
+def fetch_cached_export(key, output_file, ttl=None, cache_dir=None):
+    """
+    Copies a cached export to output_file if a fresh entry exists.
+
+    Args:
+        key (str): Key from cache_key.
+        output_file (str/Path): Where the extractor would have written the download.
+        ttl (float): Maximum age in seconds, None for no expiry.
+
+    Returns:
+        dict or None: The info stored with the entry by store_export, None on a miss.
+    """
+    data_file, info_file = _entry_paths(key, cache_dir or config.EXPORT_CACHE_DIR, output_file)
+    if not data_file.exists() or not info_file.exists():
+        return None
+
+    with open(info_file, 'r') as f:
+        info = json.load(f)
+
+    if ttl is not None and time.time() - info['created_at'] > ttl:
+        data_file.unlink(missing_ok=True)
+        info_file.unlink(missing_ok=True)
+        return None
+
+    output_file = Path(output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = output_file.with_name(f".{output_file.name}.part")
+    shutil.copyfile(data_file, tmp_file)
+    os.replace(tmp_file, output_file)
+
+    # Mark as recently used for LRU eviction
+    os.utime(data_file)
+    return info['info']
+
+
+def store_export(key, source_file, info=None, cache_dir=None, max_mb=None):
+    """
+    Adds a downloaded export to the cache, then evicts least recently used entries.
+
+    Args:
+        key (str): Key from cache_key.
+        source_file (str/Path): Downloaded export (CSV or .npz).
+        info (dict): JSON-serializable client-side info to restore on a hit.
+    """
+    cache_dir = cache_dir or config.EXPORT_CACHE_DIR
+    data_file, info_file = _entry_paths(key, cache_dir, source_file)
+    data_file.parent.mkdir(parents=True, exist_ok=True)
+
+    tmp_file = data_file.with_name(f".{data_file.name}.part")
+    shutil.copyfile(source_file, tmp_file)
+    os.replace(tmp_file, data_file)
+
+    tmp_info = info_file.with_name(f".{info_file.name}.part")
+    with open(tmp_info, 'w') as f:
+        json.dump({'created_at': time.time(), 'info': info or {}}, f, indent=4, default=str)
+    os.replace(tmp_info, info_file)
+
+    evict(cache_dir, max_mb if max_mb is not None else config.EXPORT_CACHE_MAX_MB)
+
+
+def evict(cache_dir, max_mb):
+    """Removes least recently used entries until the cache is under max_mb."""
+    with _evict_lock:
+        entries = [(f, f.stat()) for suffix in ENTRY_SUFFIXES for f in Path(cache_dir).glob(f'*/*{suffix}')]
+        total = sum(st.st_size for _, st in entries)
+        limit = max_mb * 1024 ** 2
+
+        for data_file, st in sorted(entries, key=lambda e: e[1].st_mtime):
+            if total <= limit:
+                break
+            data_file.unlink(missing_ok=True)
+            data_file.with_suffix('.json').unlink(missing_ok=True)
+            total -= st.st_size
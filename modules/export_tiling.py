@@ -0,0 +1,181 @@
+"""
+Automatic splitting of large per-pixel exports.
+
+getDownloadURL on a flattened per-pixel FeatureCollection fails or times out once
+pixels x images grows too large. plan_export estimates the number of exported rows from
+the ROI area (computed locally) and the image count, and splits the job into sub-month
+date windows and, when a single window is still too large, into spatial tiles over the
+ROI bounding box. export_features fetches the parts in parallel through the shared
+downloader and stitches them into one CSV, replacing the target atomically.
+"""
+
+import os
+import math
+import shutil
+import hashlib
+import numpy as np
+import config
+
+from pathlib import Path
+from datetime import timedelta
+from modules.downloader import download_file
+from modules.pixel_grid import master_grid, lonlat_to_utm
+from modules.tracing import span, map_threads
+
+
+def polygon_coords(ROI):
+    """Outer ring of a ROI given as polygon coordinates ([[lon, lat], ...] or [[[lon, lat], ...]])."""
+    coords = np.asarray(ROI[0] if np.ndim(ROI) == 3 else ROI, dtype='float64')
+    return coords.reshape(-1, 2)
+
+
+def polygon_area_m2(ROI):
+    """Planar area of the ROI outer ring in its UTM zone (shoelace formula), no EE call."""
+    coords = polygon_coords(ROI)
+    easting, northing = lonlat_to_utm(coords[:, 0], coords[:, 1], master_grid(ROI))
+    return 0.5 * abs(np.dot(easting, np.roll(northing, 1)) - np.dot(northing, np.roll(easting, 1)))
+
+
+def estimate_rows(ROI, image_count, scale=config.SAMPLING_SCALE, area_m2=None):
+    """Expected number of exported rows (one per pixel per image); area_m2 overrides the ROI area."""
+    area_m2 = polygon_area_m2(ROI) if area_m2 is None else area_m2
+    return int(math.ceil(area_m2 / scale ** 2)) * max(int(image_count), 1)
+
+
+def split_dates(start_date, end_date, n_windows):
+    """
+    Splits the inclusive day range [start_date, end_date] into n_windows contiguous windows.
+
+    Returns:
+        list: (start, end) 'YYYY-MM-DD' pairs with an exclusive end, as used by filterDate.
+    """
+    n_days = (end_date - start_date).days + 1
+    n_windows = max(1, min(n_windows, n_days))
+    edges = [start_date + timedelta(days=round(i * n_days / n_windows)) for i in range(n_windows + 1)]
+    return [(lo.strftime('%Y-%m-%d'), hi.strftime('%Y-%m-%d')) for lo, hi in zip(edges[:-1], edges[1:])]
+
+
+def split_bbox(ROI, n_tiles):
+    """Splits the ROI bounding box into at least n_tiles rectangles [xmin, ymin, xmax, ymax]."""
+    coords = polygon_coords(ROI)
+    xmin, ymin = coords.min(axis=0)
+    xmax, ymax = coords.max(axis=0)
+
+    nx = int(math.ceil(math.sqrt(n_tiles)))
+    ny = int(math.ceil(n_tiles / nx))
+    xs = np.linspace(xmin, xmax, nx + 1)
+    ys = np.linspace(ymin, ymax, ny + 1)
+
+    return [
+        [float(xs[i]), float(ys[j]), float(xs[i + 1]), float(ys[j + 1])]
+        for j in range(ny) for i in range(nx)
+    ]
+
+
+def plan_export(ROI, start_date, end_date, image_count, max_rows=config.EXPORT_MAX_ROWS, area_m2=None):
+    """
+    Splits an export so that every part stays below max_rows.
+
+    Date windows are preferred (they need no geometry work on the server); spatial tiles
+    are added only when a single image already exceeds max_rows. ROIs given as ee.Geometry
+    cannot be measured locally and are exported in one part. area_m2 replaces the ROI
+    area in the row estimate when only part of the ROI is sampled (e.g. the parcels
+    inside a bounding box).
+
+    Returns:
+        list: Parts {'tile': [xmin, ymin, xmax, ymax] or None, 'start': str or None, 'end': str or None}.
+            A single part with all None means "export as is".
+    """
+    if not isinstance(ROI, list) or image_count == 0:
+        return [{'tile': None, 'start': None, 'end': None}]
+
+    rows = estimate_rows(ROI, image_count, area_m2=area_m2)
+    if rows <= max_rows:
+        return [{'tile': None, 'start': None, 'end': None}]
+
+    rows_per_image = rows / max(int(image_count), 1)
+    n_tiles = int(math.ceil(rows_per_image / max_rows))
+    images_per_window = max(1, int(max_rows // (rows_per_image / n_tiles)))
+    n_windows = int(math.ceil(image_count / images_per_window))
+
+    windows = split_dates(start_date, end_date, n_windows) if n_windows > 1 else [(None, None)]
+    tiles = split_bbox(ROI, n_tiles) if n_tiles > 1 else [None]
+
+    print(f"   Export of ~{rows} rows split into {len(windows)} date windows x {len(tiles)} tiles")
+    return [{'tile': tile, 'start': start, 'end': end} for start, end in windows for tile in tiles]
+
+
+def stitch_csv(part_files, output_file):
+    """Concatenates CSV parts keeping the first header only, through a temp file and os.replace."""
+    output_file = Path(output_file)
+    tmp_file = output_file.with_name(f".{output_file.name}.part")
+    header_written = False
+
+    with open(tmp_file, 'wb') as out:
+        for part_file in part_files:
+            with open(part_file, 'rb') as f:
+                header = f.readline()
+                if not header_written:
+                    out.write(header)
+                    header_written = True
+                shutil.copyfileobj(f, out)
+
+    os.replace(tmp_file, output_file)
+
+
+def file_sha256(path, chunk_size=1024 * 1024):
+    """SHA-256 of a file, read in chunks."""
+    sha256 = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            sha256.update(chunk)
+    return sha256.hexdigest()
+
+
+def export_features(build_features, plan, selectors, output_file, filename, max_workers=None):
+    """
+    Exports every part of a plan and stitches the results into output_file.
+
+    Args:
+        build_features (callable): build_features(tile, start, end) -> ee.FeatureCollection for one part;
+            tile is [xmin, ymin, xmax, ymax] or None, start/end are filterDate bounds or None.
+        plan (list): Parts from plan_export.
+        selectors (list): Columns to export.
+        output_file (str/Path): Final CSV path.
+        filename (str): Base file name passed to getDownloadURL.
+        max_workers (int): Parts fetched at the same time, config.EXPORT_TILE_WORKERS by default.
+
+    Returns:
+        dict: Download info as returned by download_file, plus 'parts'.
+    """
+    def fetch(i, part):
+        features = build_features(part['tile'], part['start'], part['end'])
+        with span('export_url', ee_calls=1, part=i):
+            url = features.getDownloadURL(filetype='CSV', selectors=selectors, filename=f"{filename}_{i}")
+        part_file = Path(output_file).with_name(f".{Path(output_file).stem}.part{i}.csv")
+        return download_file(url, part_file)
+
+    if len(plan) == 1:
+        part = plan[0]
+        features = build_features(part['tile'], part['start'], part['end'])
+        with span('export_url', ee_calls=1):
+            url = features.getDownloadURL(filetype='CSV', selectors=selectors, filename=filename)
+        return {**download_file(url, output_file), 'parts': 1}
+
+    output_file = Path(output_file)
+    try:
+        downloads = map_threads(fetch, range(len(plan)), plan,
+                                max_workers=config.EXPORT_TILE_WORKERS if max_workers is None else max_workers)
+        stitch_csv([d['path'] for d in downloads], output_file)
+    finally:
+        # Parts are only intermediate files, also on failure
+        for part_file in output_file.parent.glob(f".{output_file.stem}.part*.csv"):
+            part_file.unlink(missing_ok=True)
+
+    return {
+        'path': str(output_file),
+        'bytes': os.path.getsize(output_file),
+        'sha256': file_sha256(output_file),
+        'attempts': max(d['attempts'] for d in downloads),
+        'parts': len(plan),
+    }
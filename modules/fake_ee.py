@@ -0,0 +1,1334 @@
+"""
+Offline stand-in for the subset of the Earth Engine API used by the pipeline.
+
+main.run_pipeline, the satellites/* extractors and modules/satellites_data_extraction
+only talk to EE through the objects below (collections, filters, per-image band math,
+sample, sampleRegions, reduceRegion, getInfo, getDownloadURL, computePixels). This module implements
+them eagerly on synthetic NumPy rasters laid on the S2 10 m master grid, so the whole
+pipeline can be run, profiled and load-tested without credentials:
+
+    import config
+    config.EE_BACKEND = 'fake'      # or EE_BACKEND=fake in the environment
+    from modules import fake_ee
+    fake_ee.install(latency_s=0.2)  # before or after the pipeline modules are imported
+
+install() registers this module as 'ee' and mounts a requests adapter on the shared
+download session, so getDownloadURL exports are "downloaded" through the normal
+modules.downloader path.
+
+Rasters are generated per acquisition over the window of the geometry passed to
+filterBounds (revisit: S2 5 days, S1 6 days, Landsat 8/9 16 days each). Values are smooth
+deterministic fields (the same seed, collection and date always give the same pixels)
+with cloud blobs shared by S2, Cloud Score+ and S2 cloud probability of the same scene.
+Scene size follows the ROI: use square_roi to build ROIs of a given pixel count. Every
+server round-trip (getInfo, getDownloadURL, computePixels) sleeps latency_s and is
+counted in round_trips().
+
+Known simplifications: everything is computed on the 10 m grid (scale, resample and
+reproject arguments are ignored), geometry buffers are applied on the pixel mask, and a
+FeatureCollection.map callback over samples is evaluated once on an empty template
+feature, so it may only set constant properties (collections built from a list of
+Features are mapped feature by feature).
+"""
+
+import io
+import sys
+import json
+import math
+import time
+import uuid
+import zlib
+import shutil
+import tempfile
+import threading
+import warnings
+import numpy as np
+import pandas as pd
+
+from pathlib import Path
+from datetime import datetime, timedelta, timezone
+from requests.adapters import BaseAdapter
+from requests.models import Response
+from requests.structures import CaseInsensitiveDict
+from modules.pixel_grid import master_grid, lonlat_to_utm, pixel_center_lonlat, pack_pixel_id, utm_to_lonlat
+from modules.pixel_arrays import roi_window, roi_mask, window_grid_indices
+from modules.export_tiling import polygon_coords, polygon_area_m2
+
+# Scheme of the export URLs served by the download adapter
+URL_PREFIX = 'fakeee://'
+
+# Extra pixels around each scene so focal operations and buffers see their neighbourhood
+SCENE_PAD = 4
+
+# Acquisitions are aligned on this day, so revisit cycles do not depend on the query range
+EPOCH = datetime(2015, 1, 1)
+
+# Generated collections: asset id -> (generator kind, revisit days, offset days)
+COLLECTIONS = {
+    'COPERNICUS/S2_SR_HARMONIZED': ('s2', 5, 0),
+    'GOOGLE/CLOUD_SCORE_PLUS/V1/S2_HARMONIZED': ('cs_plus', 5, 0),
+    'COPERNICUS/S2_CLOUD_PROBABILITY': ('s2_cloud_probability', 5, 0),
+    'COPERNICUS/S1_GRD': ('s1', 6, 0),
+    'LANDSAT/LC08/C02/T1_L2': ('landsat', 16, 0),
+    'LANDSAT/LC09/C02/T1_L2': ('landsat', 16, 8),
+}
+
+# Generated single images: asset id -> generator kind
+IMAGES = {
+    'USGS/SRTMGL1_003': 'srtm',
+}
+
+_settings = {'seed': 0, 'latency_s': 0.0, 'cloud_fraction': 0.3, 'revisit_days': None}
+_state = {'round_trips': 0, 'downloads': {}, 'download_dir': None}
+_state_lock = threading.Lock()
+
+
+def configure(seed=None, latency_s=None, cloud_fraction=None, revisit_days=None):
+    """
+    Changes the synthetic world.
+
+    Args:
+        seed (int): Base seed of every generated raster and property.
+        latency_s (float): Sleep per server round-trip.
+        cloud_fraction (float): Mean cloudy share of optical scenes (0-1).
+        revisit_days (int): Overrides the revisit of every collection (more dates per month).
+    """
+    for key, value in (('seed', seed), ('latency_s', latency_s), ('cloud_fraction', cloud_fraction),
+                       ('revisit_days', revisit_days)):
+        if value is not None:
+            _settings[key] = value
+
+
+def round_trips():
+    """Number of server round-trips served since install/reset."""
+    return _state['round_trips']
+
+
+def reset():
+    """Clears the round-trip counter and removes the served export files."""
+    with _state_lock:
+        _state['round_trips'] = 0
+        _state['downloads'].clear()
+        if _state['download_dir'] is not None:
+            shutil.rmtree(_state['download_dir'], ignore_errors=True)
+            _state['download_dir'] = None
+
+
+def install(**settings):
+    """
+    Makes 'import ee' resolve to this module and serves its exports to the shared session.
+
+    Pipeline modules imported before install keep a reference to the real API, so it is
+    swapped in every already-loaded module of this repository as well.
+    """
+    configure(**settings)
+    this = sys.modules[__name__]
+    real = sys.modules.get('ee')
+    sys.modules['ee'] = this
+
+    root = str(Path(__file__).resolve().parent.parent)
+    for module in list(sys.modules.values()):
+        if real is not None and real is not this and getattr(module, 'ee', None) is real \
+                and str(getattr(module, '__file__', '') or '').startswith(root):
+            module.ee = this
+
+    from modules.downloader import get_session
+    get_session().mount(URL_PREFIX, _DownloadAdapter())
+    return this
+
+
+def square_roi(lon, lat, n_pixels, scale=10):
+    """Square ROI (polygon coordinates) centred on lon/lat covering about n_pixels grid cells."""
+    grid = master_grid(lon=lon, lat=lat, scale=scale)
+    easting, northing = lonlat_to_utm(lon, lat, grid)
+    half = math.sqrt(n_pixels) * scale / 2
+    corners_e = easting + np.array([-half, half, half, -half, -half])
+    corners_n = northing + np.array([-half, -half, half, half, -half])
+    lons, lats = utm_to_lonlat(corners_e, corners_n, grid)
+    return [[[float(x), float(y)] for x, y in zip(lons, lats)]]
+
+
+def _round_trip():
+    with _state_lock:
+        _state['round_trips'] += 1
+    if _settings['latency_s']:
+        time.sleep(_settings['latency_s'])
+
+
+def _seed(key):
+    return zlib.crc32(f"{_settings['seed']}|{key}".encode())
+
+
+def _resolve(value):
+    """Plain Python value of a (possibly nested) fake object, as getInfo returns it."""
+    if isinstance(value, ComputedObject):
+        return _resolve(value._value)
+    if isinstance(value, Geometry):
+        return value.getInfo()
+    if isinstance(value, dict):
+        return {k: _resolve(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_resolve(v) for v in value]
+    if isinstance(value, np.generic):
+        return value.item()
+    return value
+
+
+def Initialize(*args, **kwargs):
+    """No credentials needed."""
+
+
+def Authenticate(*args, **kwargs):
+    """No credentials needed."""
+
+
+# --- Client-side values ---
+
+class ComputedObject:
+    """Eagerly computed value; getInfo counts as a round-trip."""
+
+    def __init__(self, value=None):
+        self._value = value._value if isinstance(value, ComputedObject) else value
+
+    def getInfo(self):
+        _round_trip()
+        return _resolve(self._value)
+
+    def __repr__(self):
+        return f"{type(self).__name__}({self._value!r})"
+
+
+def _wrap(value):
+    """Fake EE objects pass through, numbers become Number, the rest ComputedObject."""
+    if isinstance(value, (ComputedObject, Image, ImageCollection, Geometry, Feature, FeatureCollection)):
+        return value
+    if isinstance(value, (int, float, np.number)) and not isinstance(value, bool):
+        return Number(value)
+    if isinstance(value, str):
+        return String(value)
+    return ComputedObject(value)
+
+
+class Number(ComputedObject):
+
+    def __init__(self, value=None):
+        super().__init__(_resolve(value))
+
+    def _op(self, other, fn):
+        a, b = self._value, _resolve(other)
+        if a is None or b is None:
+            return Number(None)
+        return Number(fn(a, b))
+
+    def add(self, other): return self._op(other, lambda a, b: a + b)
+    def subtract(self, other): return self._op(other, lambda a, b: a - b)
+    def multiply(self, other): return self._op(other, lambda a, b: a * b)
+    def divide(self, other): return self._op(other, lambda a, b: a / b if b else None)
+    def pow(self, other): return self._op(other, lambda a, b: a ** b)
+    def max(self, other): return self._op(other, max)
+    def min(self, other): return self._op(other, min)
+    def lt(self, other): return self._op(other, lambda a, b: int(a < b))
+    def lte(self, other): return self._op(other, lambda a, b: int(a <= b))
+    def gt(self, other): return self._op(other, lambda a, b: int(a > b))
+    def gte(self, other): return self._op(other, lambda a, b: int(a >= b))
+    def eq(self, other): return self._op(other, lambda a, b: int(a == b))
+    def neq(self, other): return self._op(other, lambda a, b: int(a != b))
+    def And(self, other): return self._op(other, lambda a, b: int(bool(a) and bool(b)))
+    def Or(self, other): return self._op(other, lambda a, b: int(bool(a) or bool(b)))
+    def Not(self): return Number(None if self._value is None else int(not self._value))
+    def abs(self): return Number(None if self._value is None else abs(self._value))
+    def round(self): return Number(None if self._value is None else round(self._value))
+    def int(self): return Number(None if self._value is None else int(self._value))
+    def float(self): return Number(None if self._value is None else float(self._value))
+    def sqrt(self): return Number(None if self._value is None else math.sqrt(self._value))
+    def sin(self): return Number(None if self._value is None else math.sin(self._value))
+    def cos(self): return Number(None if self._value is None else math.cos(self._value))
+    def tan(self): return Number(None if self._value is None else math.tan(self._value))
+
+
+class String(ComputedObject):
+
+    def __init__(self, value=''):
+        super().__init__(str(_resolve(value)))
+
+    def cat(self, other):
+        return String(self._value + str(_resolve(other)))
+
+
+class List(ComputedObject):
+
+    def __init__(self, values=None):
+        super().__init__(list(values) if values is not None else [])
+
+    def get(self, index):
+        return _wrap(self._value[int(_resolve(index))])
+
+    def size(self):
+        return Number(len(self._value))
+
+    length = size
+
+
+class Dictionary(ComputedObject):
+
+    def __init__(self, values=None):
+        values = values._value if isinstance(values, ComputedObject) else values
+        super().__init__(dict(values or {}))
+
+    def get(self, key, defaultValue=None):
+        return _wrap(self._value.get(_resolve(key), defaultValue))
+
+    def set(self, key, value):
+        return Dictionary({**self._value, _resolve(key): value})
+
+    def keys(self):
+        return List(list(self._value))
+
+    def contains(self, key):
+        return Number(int(_resolve(key) in self._value))
+
+
+# Joda-style tokens used with Date.format -> strftime
+_DATE_TOKENS = (('YYYY', '%Y'), ('yyyy', '%Y'), ('MM', '%m'), ('dd', '%d'), ('HH', '%H'), ('mm', '%M'), ('ss', '%S'))
+
+
+class Date(ComputedObject):
+
+    def __init__(self, value):
+        value = _resolve(value)
+        if isinstance(value, datetime):
+            when = value if value.tzinfo else value.replace(tzinfo=timezone.utc)
+        elif isinstance(value, (int, float)):
+            when = datetime.fromtimestamp(value / 1000, tz=timezone.utc)
+        else:
+            when = datetime.strptime(str(value)[:10], '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        super().__init__(when)
+
+    def millis(self):
+        return Number(int(self._value.timestamp() * 1000))
+
+    def format(self, fmt=None):
+        fmt = fmt or 'YYYY-MM-dd'
+        for token, code in _DATE_TOKENS:
+            fmt = fmt.replace(token, code)
+        return String(self._value.strftime(fmt))
+
+    def get(self, unit):
+        return Number(getattr(self._value, unit))
+
+    def difference(self, start, unit):
+        seconds = (self._value - Date(start)._value).total_seconds()
+        return Number(seconds / {'day': 86400, 'hour': 3600, 'minute': 60, 'second': 1}[unit])
+
+    def advance(self, delta, unit):
+        return Date(self._value + timedelta(**{f"{unit}s": _resolve(delta)}))
+
+    def getInfo(self):
+        _round_trip()
+        return {'type': 'Date', 'value': int(self._value.timestamp() * 1000)}
+
+
+class Algorithms:
+
+    @staticmethod
+    def If(condition, trueCase, falseCase):
+        return trueCase if _resolve(condition) else falseCase
+
+
+# --- Geometry (evaluated as a pixel mask on the master grid) ---
+
+def _disk_offsets(radius_px):
+    r = int(math.floor(radius_px))
+    return [(dy, dx) for dy in range(-r, r + 1) for dx in range(-r, r + 1) if dy * dy + dx * dx <= radius_px ** 2]
+
+
+def _shifted(values, dy, dx, fill):
+    """values shifted so that out[y, x] = values[y + dy, x + dx], fill outside."""
+    out = np.full(values.shape, fill, dtype=values.dtype)
+    h, w = values.shape
+    out[max(-dy, 0):h - max(dy, 0), max(-dx, 0):w - max(dx, 0)] = \
+        values[max(dy, 0):h - max(-dy, 0), max(dx, 0):w - max(-dx, 0)]
+    return out
+
+
+def _window_slice(window, target):
+    """Index arrays mapping every cell of target onto window (with an in-bounds mask)."""
+    rows, cols = window_grid_indices(target)
+    i = window['row_max'] - rows
+    j = cols - window['col_min']
+    inside = (i >= 0) & (i < window['height']) & (j >= 0) & (j < window['width'])
+    return np.clip(i, 0, window['height'] - 1), np.clip(j, 0, window['width'] - 1), inside
+
+
+class Geometry:
+    """Polygon, buffer or intersection, rasterized on demand on any window of its grid."""
+
+    def __init__(self, geometry=None, _kind='polygon', _args=None):
+        if isinstance(geometry, ComputedObject):
+            geometry = geometry._value
+        if isinstance(geometry, Geometry):
+            self._kind, self._args, self.grid = geometry._kind, geometry._args, geometry.grid
+            return
+        if isinstance(geometry, dict) and 'coordinates' in geometry:
+            geometry = geometry['coordinates']
+
+        self._kind = _kind
+        if _kind == 'polygon':
+            coords = polygon_coords(geometry)
+            self._args = (coords,)
+            self.grid = master_grid(coords)
+        else:
+            self._args = _args
+            self.grid = _args[0].grid
+
+    @staticmethod
+    def Polygon(coords, *args, **kwargs):
+        return Geometry(coords)
+
+    @staticmethod
+    def Rectangle(coords, *args, **kwargs):
+        xmin, ymin, xmax, ymax = _resolve(coords)
+        return Geometry([[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]])
+
+    def window(self, pad=SCENE_PAD):
+        """Grid window covering the geometry plus pad pixels."""
+        if self._kind == 'polygon':
+            return roi_window(self._args[0], self.grid, pad=pad)
+        if self._kind == 'buffer':
+            grow = int(math.ceil(max(self._args[1], 0) / self.grid['scale']))
+            return self._args[0].window(pad + grow)
+        return self._args[0].window(pad)
+
+    def scene(self):
+        return self.grid, self.window()
+
+    def mask(self, grid, window):
+        """Boolean (y, x) mask of the cells of window whose centre is inside the geometry."""
+        if self._kind == 'polygon':
+            return roi_mask(self._args[0], window, grid)
+
+        if self._kind == 'intersection':
+            return self._args[0].mask(grid, window) & self._args[1].mask(grid, window)
+
+        base, distance = self._args
+        radius = abs(distance) / grid['scale']
+        grow = int(math.ceil(radius)) + 1
+        padded = {**window, 'row_max': window['row_max'] + grow, 'col_min': window['col_min'] - grow,
+                  'height': window['height'] + 2 * grow, 'width': window['width'] + 2 * grow}
+        mask = base.mask(grid, padded)
+        offsets = _disk_offsets(radius)
+        if distance >= 0:
+            result = np.logical_or.reduce([_shifted(mask, dy, dx, False) for dy, dx in offsets])
+        else:
+            result = np.logical_and.reduce([_shifted(mask, dy, dx, False) for dy, dx in offsets])
+        return result[grow:grow + window['height'], grow:grow + window['width']]
+
+    def buffer(self, distance, *args, **kwargs):
+        return Geometry(_kind='buffer', _args=(self, float(_resolve(distance))))
+
+    def intersection(self, right, *args, **kwargs):
+        return Geometry(_kind='intersection', _args=(self, right))
+
+    def area(self, *args, **kwargs):
+        if self._kind == 'polygon':
+            return Number(float(polygon_area_m2(self._args[0])))
+        window = self.window()
+        return Number(float(self.mask(self.grid, window).sum()) * self.grid['scale'] ** 2)
+
+    def bounds(self, *args, **kwargs):
+        return self
+
+    def serialize(self):
+        return json.dumps(self.getInfo(), sort_keys=True)
+
+    def getInfo(self):
+        if self._kind == 'polygon':
+            return {'type': 'Polygon', 'coordinates': [self._args[0].tolist()]}
+        if self._kind == 'buffer':
+            return {'type': 'Buffer', 'geometry': self._args[0].getInfo(), 'distance': self._args[1]}
+        return {'type': 'Intersection', 'geometries': [g.getInfo() for g in self._args]}
+
+
+# --- Filters and reducers ---
+
+def _time_start(props):
+    return datetime.fromtimestamp(props['system:time_start'] / 1000, tz=timezone.utc)
+
+
+class Filter:
+
+    def __init__(self, predicate):
+        self._predicate = predicate
+
+    def __call__(self, props):
+        return self._predicate(props)
+
+    @staticmethod
+    def eq(name, value): return Filter(lambda p: p.get(name) == _resolve(value))
+    @staticmethod
+    def neq(name, value): return Filter(lambda p: p.get(name) != _resolve(value))
+    @staticmethod
+    def lt(name, value): return Filter(lambda p: p.get(name) is not None and p[name] < _resolve(value))
+    @staticmethod
+    def lte(name, value): return Filter(lambda p: p.get(name) is not None and p[name] <= _resolve(value))
+    @staticmethod
+    def gt(name, value): return Filter(lambda p: p.get(name) is not None and p[name] > _resolve(value))
+    @staticmethod
+    def gte(name, value): return Filter(lambda p: p.get(name) is not None and p[name] >= _resolve(value))
+
+    @staticmethod
+    def listContains(leftField=None, rightValue=None, **kwargs):
+        return Filter(lambda p: _resolve(rightValue) in (p.get(leftField) or []))
+
+    @staticmethod
+    def rangeContains(field, minValue, maxValue):
+        return Filter(lambda p: p.get(field) is not None and _resolve(minValue) <= p[field] <= _resolve(maxValue))
+
+    @staticmethod
+    def calendarRange(start, end=None, field='day_of_year'):
+        end = start if end is None else end
+
+        def predicate(props):
+            when = _time_start(props)
+            value = {'month': when.month, 'year': when.year, 'hour': when.hour,
+                     'day_of_month': when.day, 'day_of_year': when.timetuple().tm_yday}[field]
+            return start <= value <= end if start <= end else value >= start or value <= end
+
+        return Filter(predicate)
+
+
+def _nan_reduce(fn):
+    def reduce_(values, axis=None):
+        with warnings.catch_warnings():
+            warnings.simplefilter('ignore', category=RuntimeWarning)
+            return fn(values, axis=axis)
+    return reduce_
+
+
+class Reducer:
+    """Named outputs, each a NaN-aware reduction fn(values, axis)."""
+
+    def __init__(self, outputs, kind=None):
+        self._outputs = outputs
+        self._kind = kind
+
+    @staticmethod
+    def median(*args, **kwargs): return Reducer([('median', _nan_reduce(np.nanmedian))])
+    @staticmethod
+    def mean(): return Reducer([('mean', _nan_reduce(np.nanmean))])
+    @staticmethod
+    def min(*args): return Reducer([('min', _nan_reduce(np.nanmin))])
+    @staticmethod
+    def max(*args): return Reducer([('max', _nan_reduce(np.nanmax))])
+    @staticmethod
+    def stdDev(): return Reducer([('stdDev', _nan_reduce(np.nanstd))])
+    @staticmethod
+    def count(): return Reducer([('count', lambda v, axis=None: np.sum(np.isfinite(v), axis=axis))])
+
+    @staticmethod
+    def percentile(percentiles, outputNames=None, *args, **kwargs):
+        names = outputNames or [f"p{p}" for p in percentiles]
+        return Reducer([
+            (name, _nan_reduce(lambda v, axis=None, p=p: np.nanpercentile(v, p, axis=axis)))
+            for name, p in zip(names, percentiles)
+        ])
+
+    @staticmethod
+    def linearFit():
+        return Reducer([('scale', None), ('offset', None)], kind='linearFit')
+
+    def combine(self, reducer2, outputPrefix='', sharedInputs=False):
+        return Reducer(self._outputs + [(outputPrefix + name, fn) for name, fn in reducer2._outputs])
+
+    def names(self, band):
+        """Output names for one band: the band itself for single-output reducers."""
+        if len(self._outputs) == 1:
+            return [band]
+        return [f"{band}_{name}" for name, _ in self._outputs]
+
+
+# --- Images ---
+
+def _as_array(values, shape):
+    return np.broadcast_to(values, shape) if np.ndim(values) == 0 else values
+
+
+class Image:
+    """
+    Bands as {name: (values float32 (y, x) or 0-d for constants, valid bool)} on a scene
+    (grid, window). Asset images without a scene are generated when first clipped,
+    sampled or fetched.
+    """
+
+    def __init__(self, source=None, _bands=None, _props=None, _scene=None, _loader=None, _generator=None):
+        if isinstance(source, ComputedObject):
+            source = source._value
+        if isinstance(source, Image):
+            if source._bands_cache is None and source._loader is not None:
+                source._bands_cache = source._loader()
+            self._bands_cache, self._props = source._bands_cache, source._props
+            self._scene, self._loader, self._generator = source._scene, source._loader, source._generator
+            return
+
+        self._props = dict(_props or {})
+        self._scene = _scene
+        self._loader = _loader
+        self._generator = _generator
+        self._bands_cache = _bands
+
+        if isinstance(source, str):
+            if source not in IMAGES:
+                raise ValueError(f"fake ee: unknown image asset {source}")
+            kind = IMAGES[source]
+            self._generator = lambda scene: _generate(kind, scene, None, {})
+            self._props = {'system:id': source}
+        elif isinstance(source, (int, float, np.number)):
+            self._bands_cache = {'constant': (np.float32(source), np.bool_(True))}
+        elif source is None and _bands is None and _loader is None and _generator is None:
+            self._bands_cache = {'constant': (np.float32(0), np.bool_(True))}
+
+    @property
+    def _bands(self):
+        if self._bands_cache is None:
+            if self._loader is not None:
+                self._bands_cache = self._loader()
+            else:
+                raise ValueError("fake ee: asset image used before clip()/sample() gave it a region")
+        return self._bands_cache
+
+    def _bind(self, scene):
+        """Generates an asset image over scene (no-op for images that already have one)."""
+        if self._bands_cache is not None or self._loader is not None or self._generator is None:
+            return self
+        bands = self._generator(scene)
+        return Image(_bands=bands, _props=self._props, _scene=scene)
+
+    def _derive(self, bands, keep_props=True, scene=None):
+        return Image(_bands=bands, _props=self._props if keep_props else {}, _scene=scene or self._scene)
+
+    @staticmethod
+    def constant(value):
+        return Image(float(_resolve(value)))
+
+    @staticmethod
+    def cat(*images):
+        images = images[0] if len(images) == 1 and isinstance(images[0], (list, tuple)) else images
+        result = Image(images[0])
+        for image in images[1:]:
+            result = result.addBands(image)
+        return result
+
+    # Band selection and naming
+
+    def bandNames(self):
+        return List(list(self._bands))
+
+    def select(self, selectors, newNames=None, *args):
+        selectors = [selectors] if isinstance(selectors, str) else list(selectors)
+        if args:
+            selectors += list(args)
+        missing = [s for s in selectors if s not in self._bands]
+        if missing:
+            raise ValueError(f"fake ee: band(s) {missing} not found in {list(self._bands)}")
+        names = newNames or selectors
+        return self._derive({new: self._bands[old] for old, new in zip(selectors, names)})
+
+    def rename(self, *names):
+        names = list(names[0]) if len(names) == 1 and isinstance(names[0], (list, tuple)) else list(names)
+        return self._derive(dict(zip(names, self._bands.values())))
+
+    def addBands(self, srcImg, names=None, overwrite=False):
+        images = srcImg if isinstance(srcImg, (list, tuple)) else [srcImg]
+        bands = dict(self._bands)
+        scene = self._scene
+        for image in images:
+            image = Image(image)
+            scene = scene or image._scene
+            for name, band in image._bands.items():
+                if names is not None and name not in names:
+                    continue
+                target, i = name, 0
+                while target in bands and not overwrite:
+                    i += 1
+                    target = f"{name}_{i}"
+                bands[target] = band
+        return self._derive(bands, scene=scene)
+
+    # Pixel math
+
+    def _operands(self, other):
+        if isinstance(other, Image):
+            return other
+        return Image(float(_resolve(other)))
+
+    def _binary(self, other, fn):
+        other = self._operands(other)
+        left, right = list(self._bands.items()), list(other._bands.items())
+        if len(right) == 1:
+            pairs = [(name, band, right[0][1]) for name, band in left]
+        elif len(left) == 1:
+            pairs = [(name, left[0][1], band) for name, band in right]
+        elif len(left) == len(right):
+            pairs = [(name, band, rband) for (name, band), (_, rband) in zip(left, right)]
+        else:
+            raise ValueError("fake ee: band count mismatch in image operation")
+
+        bands = {}
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for name, (a, va), (b, vb) in pairs:
+                bands[name] = (np.asarray(fn(a, b), dtype='float32'), va & vb)
+        return self._derive(bands, keep_props=False, scene=self._scene or other._scene)
+
+    def add(self, other): return self._binary(other, np.add)
+    def subtract(self, other): return self._binary(other, np.subtract)
+    def multiply(self, other): return self._binary(other, np.multiply)
+    def divide(self, other): return self._binary(other, np.divide)
+    def pow(self, other): return self._binary(other, np.power)
+    def hypot(self, other): return self._binary(other, np.hypot)
+    def max(self, other): return self._binary(other, np.maximum)
+    def min(self, other): return self._binary(other, np.minimum)
+    def gt(self, other): return self._binary(other, np.greater)
+    def gte(self, other): return self._binary(other, np.greater_equal)
+    def lt(self, other): return self._binary(other, np.less)
+    def lte(self, other): return self._binary(other, np.less_equal)
+    def eq(self, other): return self._binary(other, np.equal)
+    def neq(self, other): return self._binary(other, np.not_equal)
+    def And(self, other): return self._binary(other, lambda a, b: (a != 0) & (b != 0))
+    def Or(self, other): return self._binary(other, lambda a, b: (a != 0) | (b != 0))
+    def bitwiseAnd(self, other): return self._binary(other, lambda a, b: np.bitwise_and(a.astype('int64'), int(b)))
+
+    def Not(self):
+        return self._derive({n: ((v == 0).astype('float32'), m) for n, (v, m) in self._bands.items()},
+                            keep_props=False)
+
+    def normalizedDifference(self, bandNames):
+        a, b = self.select(bandNames[0]), self.select(bandNames[1])
+        return a.subtract(b).divide(a.add(b)).rename('nd')
+
+    def expression(self, expression, map_=None, **kwargs):
+        variables = {name: Image(image) for name, image in (map_ or kwargs.get('map') or {}).items()}
+        values = {name: image._bands[next(iter(image._bands))][0] for name, image in variables.items()}
+        valid = np.bool_(True)
+        for image in variables.values():
+            valid = valid & next(iter(image._bands.values()))[1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            result = eval(compile(expression, '<expression>', 'eval'), {'__builtins__': {}}, values)
+        scene = next((image._scene for image in variables.values() if image._scene), self._scene)
+        return Image(_bands={'constant': (np.asarray(result, dtype='float32'), valid)}, _scene=scene)
+
+    def toFloat(self):
+        return self._derive({n: (np.asarray(v, dtype='float32'), m) for n, (v, m) in self._bands.items()})
+
+    toDouble = toFloat
+    float = toFloat
+    double = toFloat
+
+    # Masks
+
+    def mask(self, *args):
+        return self._derive({n: (np.asarray(m, dtype='float32'), np.ones_like(m, dtype=bool))
+                             for n, (v, m) in self._bands.items()}, keep_props=False)
+
+    def updateMask(self, mask):
+        mask = Image(mask)
+        mask_bands = list(mask._bands.values())
+        bands = {}
+        for i, (name, (values, valid)) in enumerate(self._bands.items()):
+            m_values, m_valid = mask_bands[0] if len(mask_bands) == 1 else mask_bands[i]
+            bands[name] = (values, valid & m_valid & (m_values != 0))
+        return self._derive(bands, scene=self._scene or mask._scene)
+
+    def unmask(self, value=0, *args, **kwargs):
+        return self._derive({
+            n: (np.where(m, v, np.float32(_resolve(value))).astype('float32'), np.ones(np.shape(m), dtype=bool))
+            for n, (v, m) in self._bands.items()
+        })
+
+    def clip(self, geometry):
+        image = self._bind(geometry.scene())
+        grid, window = image._scene
+        inside = geometry.mask(grid, window)
+        return image._derive({n: (_as_array(v, inside.shape), m & inside) for n, (v, m) in image._bands.items()})
+
+    # Neighbourhood operations
+
+    def _radius_px(self, radius, units):
+        return radius / self._scene[0]['scale'] if units == 'meters' else radius
+
+    def focal_max(self, radius=1.5, kernelType='circle', units='pixels', iterations=1, *args, **kwargs):
+        offsets = _disk_offsets(self._radius_px(radius, units))
+        bands = {}
+        for name, (values, valid) in self._bands.items():
+            if np.ndim(values) == 0:
+                bands[name] = (values, valid)
+                continue
+            for _ in range(iterations):
+                filled = np.where(valid, values, -np.inf)
+                values = np.max([_shifted(filled, dy, dx, -np.inf) for dy, dx in offsets], axis=0)
+                valid = np.isfinite(values)
+            bands[name] = (np.where(valid, values, 0).astype('float32'), valid)
+        return self._derive(bands, keep_props=False)
+
+    def focal_mean(self, radius=1.5, kernelType='circle', units='pixels', iterations=1, *args, **kwargs):
+        offsets = _disk_offsets(self._radius_px(radius, units))
+        bands = {}
+        for name, (values, valid) in self._bands.items():
+            if np.ndim(values) == 0:
+                bands[name] = (values, valid)
+                continue
+            for _ in range(iterations):
+                filled = np.where(valid, values, 0).astype('float64')
+                total = sum(_shifted(filled, dy, dx, 0.0) for dy, dx in offsets)
+                count = sum(_shifted(valid.astype('float64'), dy, dx, 0.0) for dy, dx in offsets)
+                valid = count > 0
+                values = np.where(valid, total / np.maximum(count, 1), 0)
+            bands[name] = (values.astype('float32'), valid)
+        return self._derive(bands, keep_props=False)
+
+    # Projection (everything already lives on the 10 m master grid)
+
+    def projection(self):
+        return Projection(self._scene[0] if self._scene else None)
+
+    def resample(self, *args, **kwargs):
+        return self
+
+    def reproject(self, *args, **kwargs):
+        return self
+
+    # Properties
+
+    def set(self, *args):
+        props = dict(args[0]) if len(args) == 1 else {args[0]: args[1]}
+        image = Image(self)
+        image._props = {**self._props, **props}
+        return image
+
+    def get(self, prop):
+        return _wrap(self._props.get(_resolve(prop)))
+
+    def copyProperties(self, source=None, properties=None, exclude=None):
+        source = Image(source)
+        keys = properties or [k for k in source._props if k not in (exclude or [])]
+        image = Image(self)
+        image._props = {**self._props, **{k: source._props[k] for k in keys if k in source._props}}
+        return image
+
+    def date(self):
+        return Date(self._props['system:time_start'])
+
+    # Reductions
+
+    def reduce(self, reducer):
+        """Per-pixel reduction across bands."""
+        stack = np.stack([np.where(m, v, np.nan) for v, m in (
+            (_as_array(v, self._shape()), _as_array(m, self._shape())) for v, m in self._bands.values())])
+        bands = {}
+        for name, fn in reducer._outputs:
+            values = np.asarray(fn(stack, axis=0), dtype='float32')
+            bands[name] = (np.nan_to_num(values), np.isfinite(values))
+        return self._derive(bands, keep_props=False)
+
+    def _shape(self):
+        return (self._scene[1]['height'], self._scene[1]['width'])
+
+    def _pixels(self, region):
+        """Band values (NaN where masked) of the cells inside region, plus their pixel ids."""
+        image = self._bind(region.scene())
+        grid, window = image._scene
+        inside = region.mask(grid, window)
+        columns = {
+            name: np.where(_as_array(m, inside.shape)[inside], _as_array(v, inside.shape)[inside], np.nan)
+            for name, (v, m) in image._bands.items()
+        }
+        rows, cols = window_grid_indices(window)
+        return columns, pack_pixel_id(rows[inside], cols[inside]), grid
+
+    def reduceRegion(self, reducer, geometry=None, scale=None, *args, **kwargs):
+        columns, _, _ = self._pixels(geometry)
+        stats = {}
+        for band, values in columns.items():
+            for key, (output, fn) in zip(reducer.names(band), reducer._outputs):
+                result = fn(values, axis=0)
+                if output == 'count':
+                    stats[key] = int(result)
+                else:
+                    stats[key] = float(result) if np.isfinite(result) else None
+        return Dictionary(stats)
+
+    def sample(self, region=None, scale=None, projection=None, factor=None, numPixels=None, seed=0,
+               dropNulls=True, tileScale=1, geometries=False):
+        columns, pixel_ids, grid = self._pixels(region)
+        keep = np.ones(len(pixel_ids), dtype=bool)
+        if dropNulls:
+            for values in columns.values():
+                keep &= np.isfinite(values)
+        lonlat = pixel_center_lonlat(pixel_ids[keep], grid) if geometries else None
+        return FeatureCollection(_columns={n: v[keep] for n, v in columns.items()}, _lonlat=lonlat)
+
+    def sampleRegions(self, collection, properties=None, scale=None, projection=None, tileScale=1,
+                      geometries=False):
+        """sample() over each feature geometry, copying the feature properties to its samples."""
+        parts = []
+        for feature in collection._features or []:
+            sampled = self.sample(region=feature._geometry, geometries=geometries)
+            props = {k: v for k, v in feature._props.items() if properties is None or k in properties}
+            parts.append(sampled.map(lambda feat, props=props: feat.set(props)))
+        return FeatureCollection(_parts=parts).flatten()
+
+    def getInfo(self):
+        _round_trip()
+        return {'type': 'Image', 'bands': [{'id': name} for name in self._bands], 'properties': _resolve(self._props)}
+
+
+class Projection:
+
+    def __init__(self, grid):
+        self.grid = grid
+
+    def nominalScale(self):
+        return Number(self.grid['scale'] if self.grid else 10)
+
+    def crs(self):
+        return String(f"EPSG:{self.grid['epsg']}" if self.grid else 'EPSG:4326')
+
+
+class Terrain:
+
+    @staticmethod
+    def _gradients(elevation):
+        values, valid = next(iter(elevation._bands.values()))
+        gy, gx = np.gradient(values.astype('float64'), elevation._scene[0]['scale'])
+        # Array rows grow southwards: d/dnorth = -d/drow
+        return -gx, gy, valid
+
+    @staticmethod
+    def slope(input):
+        de, dn, valid = Terrain._gradients(input)
+        return input._derive({'slope': (np.degrees(np.arctan(np.hypot(de, dn))).astype('float32'), valid)},
+                             keep_props=False)
+
+    @staticmethod
+    def aspect(input):
+        de, dn, valid = Terrain._gradients(input)
+        # Downslope direction, clockwise from north
+        return input._derive({'aspect': ((np.degrees(np.arctan2(de, dn)) % 360).astype('float32'), valid)},
+                             keep_props=False)
+
+    @staticmethod
+    def hillshade(input, azimuth=270, elevation=45):
+        de, dn, valid = Terrain._gradients(input)
+        slope = np.arctan(np.hypot(de, dn))
+        aspect = np.arctan2(de, dn)
+        zenith, azimuth = np.radians(90 - elevation), np.radians(azimuth)
+        shade = np.cos(zenith) * np.cos(slope) + np.sin(zenith) * np.sin(slope) * np.cos(azimuth - aspect)
+        return input._derive({'hillshade': (np.clip(255 * shade, 0, 255).astype('float32'), valid)},
+                             keep_props=False)
+
+
+# --- Collections ---
+
+def _acquisitions(kind, revisit, offset, start, end):
+    revisit = _settings['revisit_days'] or revisit
+    day = EPOCH + timedelta(days=offset)
+    if start > day:
+        day += timedelta(days=math.ceil((start - day).days / revisit) * revisit)
+    while day < end:
+        yield day
+        day += timedelta(days=revisit)
+
+
+def _scene_props(kind, asset_id, day):
+    """Metadata of one acquisition, identical for the S2 family of the same scene."""
+    family = 's2' if kind in ('s2', 'cs_plus', 's2_cloud_probability') else asset_id
+    rng = np.random.default_rng(_seed(f"props|{family}|{day:%Y%m%d}"))
+    cloud = _settings['cloud_fraction']
+    cloudy_pct = float(np.clip(100 * rng.beta(max(cloud, 0.01) * 2, max(1 - cloud, 0.01) * 2), 0, 100))
+    doy = day.timetuple().tm_yday
+    time_start = int(day.replace(hour=10, minute=15, tzinfo=timezone.utc).timestamp() * 1000)
+
+    if family == 's2':
+        return {
+            'system:index': f"{day:%Y%m%d}T101031_{day:%Y%m%d}T101028_T33TUM",
+            'system:time_start': time_start,
+            'CLOUDY_PIXEL_PERCENTAGE': round(cloudy_pct, 4),
+            'MEAN_SOLAR_AZIMUTH_ANGLE': round(155 + rng.normal(0, 3), 3),
+            'MEAN_SOLAR_ZENITH_ANGLE': round(45 - 22 * math.cos(2 * math.pi * (doy - 355) / 365) + rng.normal(0, 1), 3),
+        }
+    if kind == 's1':
+        cycle = (day - EPOCH).days // (_settings['revisit_days'] or COLLECTIONS[asset_id][1])
+        return {
+            'system:index': f"S1A_IW_GRDH_1SDV_{day:%Y%m%d}T170512",
+            'system:time_start': time_start,
+            'transmitterReceiverPolarisation': ['VV', 'VH'],
+            'instrumentMode': 'IW',
+            'orbitProperties_pass': 'ASCENDING' if cycle % 2 == 0 else 'DESCENDING',
+        }
+    return {
+        'system:index': f"{asset_id.split('/')[1]}_192028_{day:%Y%m%d}",
+        'system:time_start': time_start,
+        'CLOUD_COVER': round(cloudy_pct, 2),
+    }
+
+
+def _field(rows, cols, key, wavelength):
+    """Smooth deterministic field in [-1, 1] on absolute grid indices (consistent across windows)."""
+    rng = np.random.default_rng(_seed(key))
+    p = rng.uniform(0, 2 * np.pi, 3)
+    k = 2 * np.pi / wavelength
+    return (0.5 * np.sin(k * rows + p[0]) * np.cos(k * cols + p[1])
+            + 0.5 * np.sin(k * (rows + cols) / 1.7 + p[2])).astype('float32')
+
+
+def _generate(kind, scene, day, props):
+    """Synthetic bands of one acquisition over scene, as {band: (values, valid)}."""
+    grid, window = scene
+    rows, cols = window_grid_indices(window)
+    rng = np.random.default_rng(_seed(f"pixels|{kind}|{day:%Y%m%d}" if day else f"pixels|{kind}"))
+    noise = lambda sd: rng.normal(0, sd, rows.shape).astype('float32')
+    valid = np.ones(rows.shape, dtype=bool)
+
+    # Vegetation vigour: fixed spatial pattern scaled by a seasonal curve
+    veg = (_field(rows, cols, 'vegetation', 40) + 1) / 2
+    if day is not None:
+        season = 0.35 + 0.65 * math.exp(-((day.timetuple().tm_yday - 190) / 60) ** 2)
+        veg = np.clip(veg * season, 0, 1)
+
+    if kind in ('s2', 'cs_plus', 's2_cloud_probability', 'landsat'):
+        cloud_pct = props.get('CLOUDY_PIXEL_PERCENTAGE', props.get('CLOUD_COVER', 0)) / 100
+        family = 's2' if kind != 'landsat' else 'landsat'
+        cloud_field = (_field(rows, cols, f"cloud|{family}|{day:%Y%m%d}", 25) + 1) / 2
+        cloud = cloud_field > 1 - cloud_pct
+
+    if kind == 's2':
+        soil = 1 - veg
+        bands = {
+            'B1': 400 + 300 * soil, 'B2': 350 + 450 * soil, 'B3': 600 + 500 * soil, 'B4': 300 + 1500 * soil,
+            'B5': 1000 + 800 * veg, 'B6': 1800 + 1800 * veg, 'B7': 2000 + 2200 * veg, 'B8': 2000 + 2600 * veg,
+            'B8A': 2100 + 2600 * veg, 'B9': 900 + 500 * veg, 'B11': 1400 + 1200 * soil, 'B12': 800 + 1100 * soil,
+        }
+        bands = {name: np.where(cloud, 6000 + 2000 * cloud_field, values) + noise(40) for name, values in bands.items()}
+        bands['SCL'] = np.where(cloud, 9, np.where(veg > 0.4, 4, 5)).astype('float32')
+        bands['QA60'] = np.where(cloud, 1024, 0).astype('float32')
+    elif kind == 'cs_plus':
+        bands = {'cs': np.clip(0.95 - 0.9 * cloud + noise(0.03), 0, 1),
+                 'cs_cdf': np.clip(0.97 - 0.9 * cloud + noise(0.02), 0, 1)}
+    elif kind == 's2_cloud_probability':
+        bands = {'probability': np.clip(5 + 85 * cloud + noise(4), 0, 100)}
+    elif kind == 's1':
+        bands = {'VV': -13 + 4 * veg + noise(1.5), 'VH': -20 + 5 * veg + noise(1.5), 'angle': 30 + 0 * veg + 9.5}
+    elif kind == 'landsat':
+        lst_k = 293 + 12 * (1 - veg) + noise(0.8)
+        qa = np.where(cloud, 1 << 3, 0) | (1 << 6)
+        bands = {'ST_B10': (lst_k - 149.0) / 0.00341802, 'QA_PIXEL': qa.astype('float32'),
+                 'SR_B4': 8000 + 5000 * (1 - veg), 'SR_B5': 15000 + 12000 * veg}
+    elif kind == 'srtm':
+        bands = {'elevation': 250 + 120 * _field(rows, cols, 'terrain', 300) + 15 * _field(rows, cols, 'relief', 40)}
+    else:
+        raise ValueError(f"fake ee: no generator for {kind}")
+
+    return {name: (np.asarray(values, dtype='float32'), valid) for name, values in bands.items()}
+
+
+class ImageCollection:
+    """Eager list of Images; generated collections are built on filterBounds + filterDate."""
+
+    def __init__(self, source=None, _images=None):
+        if isinstance(source, ImageCollection):
+            self._spec, self._images_cache = source._spec, source._images_cache
+            return
+        if isinstance(source, (list, tuple)):
+            _images, source = [Image(i) for i in source], None
+        if source is not None and source not in COLLECTIONS:
+            raise ValueError(f"fake ee: unknown collection {source}")
+        self._spec = {'id': source, 'region': None, 'start': None, 'end': None}
+        self._images_cache = _images
+
+    @property
+    def _images(self):
+        if self._images_cache is None:
+            spec = self._spec
+            if spec['region'] is None or spec['start'] is None:
+                raise ValueError("fake ee: filterBounds and filterDate are needed before using a generated collection")
+            kind, revisit, offset = COLLECTIONS[spec['id']]
+            scene = spec['region'].scene()
+            images = []
+            for day in _acquisitions(kind, revisit, offset, spec['start'], spec['end']):
+                props = _scene_props(kind, spec['id'], day)
+                images.append(Image(_props=props, _scene=scene,
+                                    _loader=lambda day=day, props=props: _generate(kind, scene, day, props)))
+            self._images_cache = images
+        return self._images_cache
+
+    def _with(self, images):
+        return ImageCollection(_images=images)
+
+    def filterBounds(self, geometry):
+        if self._images_cache is not None:
+            return self
+        collection = ImageCollection(self)
+        collection._spec = {**self._spec, 'region': Geometry(geometry)}
+        return collection
+
+    def filterDate(self, start, opt_end=None):
+        start = Date(start)._value.replace(tzinfo=None)
+        end = Date(opt_end)._value.replace(tzinfo=None) if opt_end is not None else start + timedelta(days=1)
+        if self._images_cache is None:
+            collection = ImageCollection(self)
+            collection._spec = {**self._spec, 'start': start, 'end': end}
+            return collection
+        return self._with([
+            i for i in self._images
+            if start <= _time_start(i._props).replace(tzinfo=None) < end
+        ])
+
+    def filter(self, filter):
+        return self._with([i for i in self._images if filter(i._props)])
+
+    def map(self, algorithm, *args, **kwargs):
+        results = [algorithm(i) for i in self._images]
+        if all(isinstance(r, Image) for r in results):
+            return self._with(results)
+        return FeatureCollection(_parts=results)
+
+    def select(self, *args, **kwargs):
+        return self._with([i.select(*args, **kwargs) for i in self._images])
+
+    def merge(self, collection2):
+        return self._with(self._images + collection2._images)
+
+    def combine(self, secondary, overwrite=False):
+        by_index = {i._props.get('system:index'): i for i in secondary._images}
+        return self._with([
+            i.addBands(by_index[i._props.get('system:index')], overwrite=overwrite)
+            for i in self._images if i._props.get('system:index') in by_index
+        ])
+
+    def sort(self, prop, ascending=True):
+        return self._with(sorted(self._images, key=lambda i: i._props.get(prop), reverse=not ascending))
+
+    def first(self):
+        return self._images[0] if self._images else None
+
+    def size(self):
+        return Number(len(self._images))
+
+    def toList(self, count, offset=0):
+        return List(self._images[offset:offset + int(_resolve(count))])
+
+    def aggregate_array(self, property):
+        return List([i._props.get(property) for i in self._images])
+
+    def reduce(self, reducer, parallelScale=1):
+        """Per-pixel reduction across images, outputs named <band>_<reducer output>."""
+        first = self._images[0]
+        shape = first._shape()
+        stacks = {
+            name: np.stack([np.where(_as_array(i._bands[name][1], shape), _as_array(i._bands[name][0], shape), np.nan)
+                            for i in self._images])
+            for name in first._bands
+        }
+
+        if reducer._kind == 'linearFit':
+            x, y = stacks.values()
+            ok = np.isfinite(x) & np.isfinite(y)
+            n = ok.sum(axis=0)
+            x, y = np.where(ok, x, 0), np.where(ok, y, 0)
+            sx, sy, sxx, sxy = x.sum(0), y.sum(0), (x * x).sum(0), (x * y).sum(0)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                slope = (n * sxy - sx * sy) / (n * sxx - sx ** 2)
+                offset = (sy - slope * sx) / n
+            return first._derive({
+                'scale': (np.nan_to_num(slope).astype('float32'), np.isfinite(slope)),
+                'offset': (np.nan_to_num(offset).astype('float32'), np.isfinite(offset)),
+            }, keep_props=False)
+
+        bands = {}
+        for name, stack in stacks.items():
+            for output, fn in reducer._outputs:
+                values = np.asarray(fn(stack, axis=0), dtype='float32')
+                bands[f"{name}_{output}"] = (np.nan_to_num(values), np.isfinite(values))
+        return first._derive(bands, keep_props=False)
+
+    def median(self):
+        return self.reduce(Reducer.median()).rename(list(self._images[0]._bands))
+
+    def mean(self):
+        return self.reduce(Reducer.mean()).rename(list(self._images[0]._bands))
+
+    def getInfo(self):
+        _round_trip()
+        return {'type': 'ImageCollection', 'features': [
+            {'type': 'Image', 'bands': [{'id': n} for n in i._bands], 'properties': _resolve(i._props)}
+            for i in self._images
+        ]}
+
+
+# --- Features ---
+
+class Feature:
+
+    def __init__(self, geometry=None, properties=None):
+        self._geometry = geometry
+        self._props = dict(properties._value if isinstance(properties, Dictionary) else properties or {})
+
+    def geometry(self, *args, **kwargs):
+        return self._geometry
+
+    def set(self, *args):
+        props = dict(args[0]) if len(args) == 1 else {args[0]: args[1]}
+        return Feature(self._geometry, {**self._props, **props})
+
+    def get(self, prop):
+        return _wrap(self._props.get(_resolve(prop)))
+
+    def getInfo(self):
+        _round_trip()
+        return {'type': 'Feature', 'geometry': _resolve(self._geometry), 'properties': _resolve(self._props)}
+
+
+class FeatureCollection:
+    """
+    Columnar features (sample output) or a collection of such collections (map output).
+    Collections built from a list of Features also keep the Features, for sampleRegions.
+    """
+
+    def __init__(self, source=None, _columns=None, _lonlat=None, _parts=None):
+        self._features = list(source) if isinstance(source, (list, tuple)) else None
+        if isinstance(source, (list, tuple)):
+            _columns = {}
+            for i, feature in enumerate(source):
+                for key, value in feature._props.items():
+                    _columns.setdefault(key, [None] * len(source))[i] = _resolve(value)
+            _columns = {k: np.asarray(v) for k, v in _columns.items()}
+        self._columns = _columns or {}
+        self._lonlat = _lonlat
+        self._parts = _parts
+
+    def _rows(self):
+        return len(next(iter(self._columns.values()))) if self._columns else \
+            (len(self._lonlat[0]) if self._lonlat is not None else 0)
+
+    def map(self, algorithm, *args, **kwargs):
+        if self._parts is not None:
+            return FeatureCollection(_parts=[part.map(algorithm) for part in self._parts])
+        if self._features is not None:
+            return FeatureCollection([algorithm(feature) for feature in self._features])
+        # Callbacks only set constant properties: evaluate once on a template feature
+        template = algorithm(Feature())
+        n = self._rows()
+        columns = dict(self._columns)
+        for key, value in template._props.items():
+            columns[key] = np.full(n, _resolve(value), dtype=object)
+        return FeatureCollection(_columns=columns, _lonlat=self._lonlat)
+
+    def flatten(self):
+        if self._parts is None:
+            return self
+        parts = [p.flatten() for p in self._parts]
+        keys = list(dict.fromkeys(k for p in parts for k in p._columns))
+        columns = {
+            k: np.concatenate([p._columns[k] if k in p._columns else np.full(p._rows(), None, dtype=object)
+                               for p in parts]) if parts else np.array([])
+            for k in keys
+        }
+        with_geometry = [p for p in parts if p._lonlat is not None]
+        lonlat = None
+        if with_geometry and len(with_geometry) == len(parts):
+            lonlat = (np.concatenate([p._lonlat[0] for p in parts]), np.concatenate([p._lonlat[1] for p in parts]))
+        return FeatureCollection(_columns=columns, _lonlat=lonlat)
+
+    def size(self):
+        return Number(self.flatten()._rows())
+
+    def _frame(self):
+        flat = self.flatten()
+        df = pd.DataFrame({'system:index': [str(i) for i in range(flat._rows())], **flat._columns})
+        if flat._lonlat is not None:
+            df['.geo'] = [f'{{"geodesic":false,"type":"Point","coordinates":[{float(lon)!r},{float(lat)!r}]}}'
+                          for lon, lat in zip(*flat._lonlat)]
+        return df
+
+    def getDownloadURL(self, filetype='CSV', selectors=None, filename=None, *args, **kwargs):
+        """Writes the export locally and returns a URL served by the download adapter."""
+        _round_trip()
+        df = self._frame()
+        if selectors:
+            df = df.reindex(columns=list(selectors))
+
+        with _state_lock:
+            if _state['download_dir'] is None:
+                _state['download_dir'] = tempfile.mkdtemp(prefix='fake_ee_')
+            token = uuid.uuid4().hex
+            path = Path(_state['download_dir']) / f"{token}.csv"
+        df.to_csv(path, index=False)
+
+        url = f"{URL_PREFIX}downloads/{token}/{filename or 'export'}.csv"
+        with _state_lock:
+            _state['downloads'][url] = path
+        return url
+
+    def getInfo(self):
+        _round_trip()
+        df = self._frame()
+        return {'type': 'FeatureCollection', 'features': [
+            {'type': 'Feature', 'properties': row} for row in df.drop(columns=['.geo'], errors='ignore').to_dict('records')
+        ]}
+
+
+class _DownloadAdapter(BaseAdapter):
+    """requests transport adapter serving the files written by getDownloadURL."""
+
+    def send(self, request, stream=False, timeout=None, verify=True, cert=None, proxies=None):
+        path = _state['downloads'].get(request.url)
+        response = Response()
+        response.url = request.url
+        response.request = request
+        response.headers = CaseInsensitiveDict()
+
+        if path is None or not Path(path).exists():
+            response.status_code = 404
+            response.reason = 'Not Found'
+            response.raw = io.BytesIO(b'')
+        else:
+            response.status_code = 200
+            response.reason = 'OK'
+            response.headers['Content-Length'] = str(Path(path).stat().st_size)
+            response.raw = open(path, 'rb')
+        return response
+
+    def close(self):
+        pass
+
+
+# --- Pixel-array endpoint ---
+
+class data:
+
+    @staticmethod
+    def computePixels(params):
+        """NUMPY_NDARRAY structured array of an image over the requested grid (0 outside its scene)."""
+        _round_trip()
+        grid_spec = params['grid']
+        affine = grid_spec['affineTransform']
+        epsg = int(grid_spec['crsCode'].split(':')[1])
+        scale = affine['scaleX']
+        grid = {'epsg': epsg, 'zone': epsg % 100, 'south': epsg >= 32700, 'scale': scale}
+        window = {
+            'row_max': int(round(affine['translateY'] / scale)) - 1,
+            'col_min': int(round(affine['translateX'] / scale)),
+            'height': grid_spec['dimensions']['height'],
+            'width': grid_spec['dimensions']['width'],
+        }
+
+        image = Image(params['expression'])._bind((grid, window))
+        source_window = image._scene[1] if image._scene else window
+        i, j, inside = _window_slice(source_window, window)
+        shape = (source_window['height'], source_window['width'])
+
+        out = np.zeros((window['height'], window['width']),
+                       dtype=[(name, 'float32') for name in image._bands])
+        for name, (values, valid) in image._bands.items():
+            values = np.where(_as_array(valid, shape), _as_array(values, shape), 0)
+            out[name] = np.where(inside, values[i, j], 0)
+        return out
@@ -0,0 +1,117 @@
+"""
+Partition manifest of a Hive dataset written by utils.create_partitioned_dataset.
+
+One JSON file per ROI dataset records, for every year=/month= partition, the sensors it
+was built from, its row count, date coverage, per-column min/max and the run that wrote
+it. Missing-partition detection and dataset reads load this single file instead of
+walking and stat-ing the partition folders.
+"""
+
+import os
+import json
+import pyarrow.parquet as pq
+
+from pathlib import Path
+from datetime import datetime
+
+MANIFEST_FILE = '_manifest.json'
+
+
+def load_manifest(output_path):
+    """
+    Returns the manifest of a dataset, or None if it has never been written.
+
+    Returns:
+        dict: {'updated_at': str, 'partitions': {partition_key: entry}}
+    """
+    manifest_file = Path(output_path) / MANIFEST_FILE
+    if not manifest_file.exists():
+        return None
+
+    with open(manifest_file, 'r') as f:
+        return json.load(f)
+
+
+def save_manifest(output_path, manifest):
+    """Writes the manifest through a temp file and os.replace."""
+    manifest_file = Path(output_path) / MANIFEST_FILE
+    manifest_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = manifest_file.with_name(f".{manifest_file.name}.tmp")
+
+    manifest['updated_at'] = str(datetime.now())
+    with open(tmp_file, 'w') as f:
+        json.dump(manifest, f, indent=4)
+    os.replace(tmp_file, manifest_file)
+
+
+def summarize_partition_file(path):
+    """
+    Builds row count and per-column min/max from the Parquet footer only (no data read).
+
+    Args:
+        path (Path): Partition data file.
+
+    Returns:
+        dict: {'rows': int, 'stats': {column: {'min': ..., 'max': ..., 'null_count': int}}}
+    """
+    metadata = pq.read_metadata(path)
+    stats = {}
+
+    for rg in range(metadata.num_row_groups):
+        row_group = metadata.row_group(rg)
+        for i in range(row_group.num_columns):
+            column = row_group.column(i)
+            col_stats = column.statistics
+            if col_stats is None:
+                continue
+
+            entry = stats.setdefault(column.path_in_schema, {'min': None, 'max': None, 'null_count': 0})
+            entry['null_count'] += col_stats.null_count or 0
+            if col_stats.has_min_max:
+                entry['min'] = col_stats.min if entry['min'] is None else min(entry['min'], col_stats.min)
+                entry['max'] = col_stats.max if entry['max'] is None else max(entry['max'], col_stats.max)
+
+    # Timestamps and other non-JSON types are stored as strings
+    for entry in stats.values():
+        for k in ('min', 'max'):
+            if entry[k] is not None and not isinstance(entry[k], (int, float, str)):
+                entry[k] = str(entry[k])
+
+    return {'rows': metadata.num_rows, 'stats': stats}
+
+
+def update_partition_entry(manifest, key, output_path, path, sensors, run_id):
+    """
+    Records a freshly written partition in the manifest.
+
+    Args:
+        manifest (dict): Manifest being updated in place.
+        key (str): Partition key, e.g. '2024-6'.
+        output_path (str): Root of the dataset.
+        path (Path): Partition data file.
+        sensors (list): Source folders the partition was built from.
+        run_id (str): Run that wrote the partition.
+    """
+    summary = summarize_partition_file(path)
+    date_stats = summary['stats'].get('date', {})
+
+    manifest['partitions'][key] = {
+        'path': Path(path).relative_to(output_path).as_posix(),
+        'sensors': sorted(sensors),
+        'rows': summary['rows'],
+        'date_min': date_stats.get('min'),
+        'date_max': date_stats.get('max'),
+        'stats': summary['stats'],
+        'run_id': run_id,
+        'written_at': str(datetime.now()),
+    }
+
+
+def remove_partition_entry(manifest, key):
+    """Drops a partition that no longer has data."""
+    manifest['partitions'].pop(key, None)
+
+
+def manifest_files(output_path, manifest):
+    """Absolute paths of all partition files listed in the manifest."""
+    return [str(Path(output_path) / entry['path']) for entry in manifest['partitions'].values()]
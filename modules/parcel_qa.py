@@ -0,0 +1,184 @@
+"""
+Local adaptive erosion and per-observation QA of parcels on the pixel grid.
+
+modules/s2cleaning.py builds the eroded core of a parcel (get_adaptive_core) and the
+observation validity (validate_parcel_observation) as nested ee.Algorithms.If graphs,
+evaluated per parcel and per image on the server. Here the same rules are applied with
+NumPy:
+
+- each parcel is rasterized once on the 10 m grid (cells whose centre lies inside it,
+  as sampled by sampleRegions) with the distance of every cell centre to the parcel
+  boundary, so the 10/5/0 m erosions are thresholds of the same array;
+- the adaptive core of each ROI is cached for the process;
+- valid_pixels, coverage_ratio and observation_valid of every (parcel, date) are
+  computed at once from a pixel frame with a single bincount.
+
+Areas are counted in grid cells: the core is kept when it holds MIN_CORE_PIXELS cells
+and total_pixels is the number of core cells (the server divides geometric areas).
+"""
+
+import json
+import numpy as np
+import pandas as pd
+
+from functools import lru_cache
+from modules.export_tiling import polygon_coords, polygon_area_m2
+from modules.pixel_grid import lonlat_to_utm, pack_pixel_id
+from modules.pixel_arrays import roi_window, roi_mask, window_grid_indices
+
+# Erosion distances tried in order (m), as get_adaptive_core
+EROSION_LEVELS_M = [10, 5, 0]
+
+# A core is kept when it holds at least this many pixels
+MIN_CORE_PIXELS = 25
+
+# Parcels under this many pixels (original area) are small
+SMALL_PARCEL_PIXELS = 60
+
+# Observation thresholds of validate_parcel_observation: valid pixels of at least
+# max(MIN_VALID_PIXELS, MIN_VALID_SHARE of the core) (MIN_VALID_PIXELS_SMALL for small
+# parcels) and a coverage of at least MIN_COVERAGE (MIN_COVERAGE_SMALL)
+MIN_VALID_PIXELS = 25
+MIN_VALID_PIXELS_SMALL = 15
+MIN_VALID_SHARE = 0.30
+MIN_COVERAGE = 0.60
+MIN_COVERAGE_SMALL = 0.50
+
+
+def boundary_distance(ROI, grid):
+    """
+    Rasterizes a parcel on the grid.
+
+    Returns:
+        tuple: (pixel_ids, distance) of the cells whose centre lies inside the parcel,
+            distance being from the cell centre to the parcel boundary in meters.
+    """
+    window = roi_window(ROI, grid)
+    inside = roi_mask(ROI, window, grid)
+    rows, cols = window_grid_indices(window)
+    rows, cols = rows[inside], cols[inside]
+
+    coords = polygon_coords(ROI)
+    vx, vy = lonlat_to_utm(coords[:, 0], coords[:, 1], grid)
+    x1, y1, x2, y2 = vx, vy, np.roll(vx, -1), np.roll(vy, -1)
+
+    # Point-to-segment distances, cells x edges
+    px = ((cols + 0.5) * grid['scale'])[:, None]
+    py = ((rows + 0.5) * grid['scale'])[:, None]
+    dx, dy = x2 - x1, y2 - y1
+    length2 = np.where(dx * dx + dy * dy > 0, dx * dx + dy * dy, 1.0)
+    t = np.clip(((px - x1) * dx + (py - y1) * dy) / length2, 0.0, 1.0)
+    distance = np.hypot(px - (x1 + t * dx), py - (y1 + t * dy)).min(axis=1, initial=np.inf)
+
+    return pack_pixel_id(rows, cols), distance
+
+
+@lru_cache(maxsize=None)
+def _adaptive_core(key):
+    ROI, grid = json.loads(key)
+    pixel_ids, distance = boundary_distance(ROI, grid)
+
+    for erosion_m in EROSION_LEVELS_M:
+        core = distance >= erosion_m
+        if core.sum() >= MIN_CORE_PIXELS or erosion_m == 0:
+            break
+
+    pixel_area = grid['scale'] ** 2
+    return {
+        'pixel_ids': pixel_ids[core],
+        'erosion_m': erosion_m,
+        'is_small_parcel': int(polygon_area_m2(ROI) / pixel_area < SMALL_PARCEL_PIXELS),
+    }
+
+
+def adaptive_core(ROI, grid):
+    """
+    Adaptive core of a parcel, as get_adaptive_core: eroded by the first of
+    EROSION_LEVELS_M that keeps MIN_CORE_PIXELS pixels. Cached per ROI and grid.
+
+    Returns:
+        dict: {'pixel_ids': int64 array, 'erosion_m': int, 'is_small_parcel': int}
+    """
+    return _adaptive_core(json.dumps([ROI, grid], sort_keys=True))
+
+
+def core_tables(parcels, grid):
+    """
+    Cores of a parcel group.
+
+    Returns:
+        tuple: (pixels, cores) DataFrames: the (pixel_id, parcel) core membership, parcel
+            being the position in parcels, and one row per parcel with its parcel_id,
+            total_pixels, erosion_m and is_small_parcel.
+    """
+    pixels, cores = [], []
+    for position, (parcel_id, ROI) in enumerate(parcels.items()):
+        core = adaptive_core(ROI, grid)
+        pixels.append(pd.DataFrame({'pixel_id': core['pixel_ids'], 'parcel': position}))
+        cores.append({'parcel_id': parcel_id, 'total_pixels': len(core['pixel_ids']),
+                      'erosion_m': core['erosion_m'], 'is_small_parcel': core['is_small_parcel']})
+    return pd.concat(pixels, ignore_index=True), pd.DataFrame(cores)
+
+
+def validate_observations(valid_pixels, total_pixels, is_small):
+    """
+    observation_valid of validate_parcel_observation on arrays (broadcast together).
+
+    Returns:
+        tuple: (coverage_ratio, observation_valid) arrays; coverage is NaN for empty cores.
+    """
+    valid_pixels = np.asarray(valid_pixels, dtype='float64')
+    total_pixels = np.asarray(total_pixels, dtype='float64')
+    is_small = np.asarray(is_small, dtype=bool)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        coverage = np.where(total_pixels > 0, valid_pixels / total_pixels, np.nan)
+    min_valid = np.maximum(np.where(is_small, MIN_VALID_PIXELS_SMALL, MIN_VALID_PIXELS), MIN_VALID_SHARE * total_pixels)
+    min_coverage = np.where(is_small, MIN_COVERAGE_SMALL, MIN_COVERAGE)
+    with np.errstate(invalid='ignore'):
+        observation_valid = (valid_pixels >= min_valid) & (coverage >= min_coverage)
+    return coverage, observation_valid.astype('int64')
+
+
+def observation_qa(df, parcels, grid, band='NDVI', dates=None):
+    """
+    Per-observation QA of every parcel and date of a pixel frame.
+
+    Args:
+        df (pd.DataFrame): (date, pixel_id, band) rows; a pixel is valid on a date when
+            its band value is not null (masked pixels are not sampled).
+        parcels (dict): {parcel_id: coords}.
+        band (str): Column telling valid pixels.
+        dates (list): Acquisition dates with no row in df (every pixel masked) are only
+            known from the export; they get zero valid pixels.
+
+    Returns:
+        pd.DataFrame: One row per (date, parcel_id) with valid_pixels, total_pixels,
+            coverage_ratio, observation_valid, erosion_m and is_small_parcel.
+    """
+    pixels, cores = core_tables(parcels, grid)
+    dates = pd.DatetimeIndex(df['date'].unique()).union(pd.DatetimeIndex(dates if dates is not None else []))
+    codes = dates.get_indexer(df['date'])
+
+    valid = df[band].notna().to_numpy()
+    observed = pd.DataFrame({'pixel_id': df['pixel_id'].to_numpy()[valid], 'date': codes[valid]})
+    observed = observed.merge(pixels, on='pixel_id')
+
+    n_dates, n_parcels = len(dates), len(cores)
+    valid_pixels = np.bincount(observed['date'].to_numpy() * n_parcels + observed['parcel'].to_numpy(),
+                               minlength=n_dates * n_parcels).reshape(n_dates, n_parcels)
+
+    total_pixels = cores['total_pixels'].to_numpy()
+    is_small = cores['is_small_parcel'].to_numpy()
+    coverage, observation_valid = validate_observations(valid_pixels, total_pixels, is_small)
+
+    return pd.DataFrame({
+        'date': np.repeat(np.asarray(dates), n_parcels),
+        'parcel_id': np.tile(cores['parcel_id'].astype(str).to_numpy(), n_dates),
+        'valid_pixels': valid_pixels.ravel(),
+        'total_pixels': np.tile(total_pixels, n_dates),
+        'coverage_ratio': coverage.ravel(),
+        'observation_valid': observation_valid.ravel(),
+        'erosion_m': np.tile(cores['erosion_m'].to_numpy(), n_dates),
+        'is_small_parcel': np.tile(is_small, n_dates),
+    })
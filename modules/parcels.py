@@ -0,0 +1,432 @@
+"""
+Multi-parcel batch extraction.
+
+The single-ROI extractors filter, cloud-mask and sample the collections once per parcel,
+so serving many vineyards repeats the same work for every scene they share. In batch mode
+each collection is filtered once on the bounding box of all parcels (get_sentinel2_data
+then masks every scene once), each image is sampled over all parcels in the same request
+with sampleRegions, and every sample carries the id of the parcel it fell in.
+
+Parcels come from a GeoJSON FeatureCollection (config.PARCELS_FILE) with an id property
+(config.PARCEL_ID_PROPERTY) and are passed around as {parcel_id: polygon coordinates}.
+
+Which parcel a pixel belongs to does not change over time, so write_parcel_pixels stores
+it once as a static raw CSV (ingested as _static/parcels.parquet), and the parcel_id
+column of the time-series exports is only used to tag the raw files.
+
+In aggregate mode (extraction mode 'aggregate') no pixel leaves Earth Engine: every image
+is reduced per parcel with modules.s2cleaning.extract_parcel_stats and the export holds
+one row per parcel and date with robust statistics of each index, written under
+config.PARCEL_STATS_PATH and ingested by utils.write_parcel_stats.
+
+Pixel exports carry no per-observation QA. write_parcel_qa computes it locally after
+ingestion, for every parcel and date at once (modules/parcel_qa.py), into
+database/<group>/_parcel_qa.parquet.
+"""
+
+import os
+import json
+import ee
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+import config
+
+from pathlib import Path
+from modules.export_tiling import polygon_coords, polygon_area_m2, plan_export, export_features
+from modules.export_cache import cache_key, export_ttl, fetch_cached_export, store_export
+from modules.pixel_grid import pack_pixel_id, pixel_center_lonlat
+from modules.pixel_arrays import roi_window, roi_mask, window_grid_indices
+from modules.tracing import span
+from modules.s2cleaning import get_adaptive_core, extract_parcel_stats, validate_parcel_observation
+from modules.parcel_qa import observation_qa
+from utils import create_conn_ee, generate_metadata, save_metadata, fetch_info, read_dataset, partition_key
+from modules.manifest import load_manifest, manifest_files
+
+# Column holding the parcel id in the exports and the static table
+PARCEL_COLUMN = 'parcel_id'
+
+# Raw-data folder (and static table name) of the pixel -> parcel membership
+PARCELS_FOLDER = 'parcels'
+
+# Statistics exported per index in aggregate mode, as named by the combined reducer of
+# extract_parcel_stats (<index>_<stat>)
+PARCEL_STATS = ['median', 'p10', 'p25', 'p75', 'p90', 'count', 'stdDev']
+
+# Per-observation QA columns of aggregates over the eroded parcel core (Sentinel-2)
+PARCEL_QA_COLUMNS = ['valid_pixels', 'total_pixels', 'coverage_ratio', 'observation_valid', 'erosion_m',
+                     'is_small_parcel']
+
+# Table of the locally computed QA of pixel exports, one row per (date, parcel_id)
+PARCEL_QA_TABLE = '_parcel_qa.parquet'
+
+
+def load_parcels(path=None, id_property=None):
+    """
+    Reads parcels from a GeoJSON FeatureCollection of Polygons.
+
+    Args:
+        path (str): GeoJSON file, defaults to config.PARCELS_FILE.
+        id_property (str): Feature property holding the parcel id, defaults to
+            config.PARCEL_ID_PROPERTY (the feature 'id' member is used when missing).
+
+    Returns:
+        dict: {parcel_id (str): [[[lon, lat], ...]]}
+    """
+    path = path or config.PARCELS_FILE
+    id_property = id_property or config.PARCEL_ID_PROPERTY
+
+    with open(path, 'r') as f:
+        collection = json.load(f)
+
+    parcels = {}
+    for i, feature in enumerate(collection['features']):
+        geometry = feature['geometry']
+        if geometry['type'] != 'Polygon':
+            raise ValueError(f"Parcel {i} in {path} is a {geometry['type']}, only Polygons are supported")
+
+        parcel_id = (feature.get('properties') or {}).get(id_property, feature.get('id'))
+        if parcel_id is None:
+            raise ValueError(f"Parcel {i} in {path} has no '{id_property}' property")
+        if str(parcel_id) in parcels:
+            raise ValueError(f"Duplicate parcel id {parcel_id} in {path}")
+        parcels[str(parcel_id)] = geometry['coordinates']
+
+    return parcels
+
+
+def parcels_bounds(parcels):
+    """Bounding box of all parcels as polygon coordinates, the ROI the collections are filtered on."""
+    coords = np.concatenate([polygon_coords(ROI) for ROI in parcels.values()])
+    xmin, ymin = coords.min(axis=0).tolist()
+    xmax, ymax = coords.max(axis=0).tolist()
+    return [[[xmin, ymin], [xmax, ymin], [xmax, ymax], [xmin, ymax], [xmin, ymin]]]
+
+
+def parcels_area_m2(parcels):
+    """Summed area of the parcels, i.e. the sampled area (the bounding box can be mostly empty)."""
+    return float(sum(polygon_area_m2(ROI) for ROI in parcels.values()))
+
+
+def split_parcels(parcels, tiles):
+    """
+    Assigns each parcel to the first tile containing its centroid, so a parcel is exported
+    by exactly one part even when it crosses tile edges.
+
+    Returns:
+        list: One {parcel_id: coords} dict per tile.
+    """
+    groups = [{} for _ in tiles]
+    for parcel_id, ROI in parcels.items():
+        cx, cy = polygon_coords(ROI).mean(axis=0)
+        for group, (xmin, ymin, xmax, ymax) in zip(groups, tiles):
+            if xmin <= cx <= xmax and ymin <= cy <= ymax:
+                group[parcel_id] = ROI
+                break
+    return groups
+
+
+def parcels_collection(parcels):
+    """ee.FeatureCollection of the parcels with their id in PARCEL_COLUMN."""
+    return ee.FeatureCollection([
+        ee.Feature(ee.Geometry.Polygon(ROI), {PARCEL_COLUMN: parcel_id}) for parcel_id, ROI in parcels.items()
+    ])
+
+
+def parcel_selectors(bands):
+    """Columns of a batch export."""
+    return ['date', PARCEL_COLUMN, *bands, '.geo']
+
+
+def parcel_stats_selectors(bands, use_erosion=False):
+    """Columns of an aggregate export."""
+    stats = [f'{band}_{stat}' for band in bands for stat in PARCEL_STATS]
+    return ['date', PARCEL_COLUMN, *stats, *(PARCEL_QA_COLUMNS if use_erosion else [])]
+
+
+def parcel_cores(parcels, use_erosion=False):
+    """
+    ee.FeatureCollection of the regions the parcels are reduced over: the adaptively
+    eroded core (get_adaptive_core, with erosion_m and is_small_parcel properties) or the
+    full polygon.
+    """
+    features = []
+    for parcel_id, ROI in parcels.items():
+        if use_erosion:
+            core = get_adaptive_core(ROI, sampling_scale=config.SAMPLING_SCALE)
+            features.append(ee.Feature(core['core_geometry'], {
+                PARCEL_COLUMN: parcel_id,
+                'erosion_m': core['erosion_applied'],
+                'is_small_parcel': core['is_small_parcel'],
+            }))
+        else:
+            features.append(ee.Feature(ee.Geometry.Polygon(ROI), {PARCEL_COLUMN: parcel_id}))
+    return ee.FeatureCollection(features)
+
+
+def export_parcel_stats(collection, bands, parcels, output_file, filename, use_erosion=False):
+    """
+    Reduces every image of collection over each parcel and downloads one CSV row per
+    parcel and image (see parcel_stats_selectors).
+
+    With use_erosion the statistics cover the eroded core and each row carries the
+    observation QA of validate_parcel_observation, as the per-pixel export of get_st2.
+    The export is parcels x images rows, so it is never split.
+
+    Returns:
+        dict: Download info, see export_features.
+    """
+    cores = parcel_cores(parcels, use_erosion)
+
+    def build_features(tile=None, start=None, end=None):
+        def reduce_image(img):
+            date = img.date().format('YYYY-MM-dd')
+            img = img.select(bands)
+
+            def reduce_parcel(parcel):
+                stats = extract_parcel_stats(img, parcel.geometry(), sampling_scale=config.SAMPLING_SCALE)
+                feature = ee.Feature(None, stats).set({'date': date, PARCEL_COLUMN: parcel.get(PARCEL_COLUMN)})
+                if not use_erosion:
+                    return feature
+
+                is_small = parcel.get('is_small_parcel')
+                return feature.set({
+                    'valid_pixels': stats.get('valid_pixel_count'),
+                    'total_pixels': stats.get('total_pixel_count'),
+                    'observation_valid': validate_parcel_observation(stats, is_small_parcel=is_small),
+                    'erosion_m': parcel.get('erosion_m'),
+                    'is_small_parcel': is_small,
+                })
+
+            return cores.map(reduce_parcel)
+
+        return collection.map(reduce_image).flatten()
+
+    plan = [{'tile': None, 'start': None, 'end': None}]
+    return export_features(build_features, plan, parcel_stats_selectors(bands, use_erosion), output_file, filename)
+
+
+def export_parcel_samples(collection, bands, parcels, output_file, filename, start_date, end_date, image_count):
+    """
+    Samples every image of collection over all parcels and downloads the result as one CSV.
+
+    Large exports are split by plan_export on the parcels' bounding box; a spatial part
+    takes the parcels whose centroid falls in its tile.
+
+    Returns:
+        dict: Download info, see export_features.
+    """
+    bounds = parcels_bounds(parcels)
+    plan = plan_export(bounds, start_date, end_date, image_count, area_m2=parcels_area_m2(parcels))
+    tiles = [part['tile'] for part in plan if part['tile'] is not None]
+    unique_tiles = list(dict.fromkeys(tuple(tile) for tile in tiles))
+    by_tile = dict(zip(unique_tiles, split_parcels(parcels, unique_tiles)))
+
+    def build_features(tile=None, start=None, end=None):
+        images = collection if start is None else collection.filterDate(start, end)
+        regions = parcels_collection(parcels if tile is None else by_tile[tuple(tile)])
+
+        def sample_parcels(img):
+            date = img.date().format('YYYY-MM-dd')
+            return img.select(bands).sampleRegions(
+                collection=regions,
+                properties=[PARCEL_COLUMN],
+                scale=config.SAMPLING_SCALE,
+                geometries=True,
+            ).map(lambda feat: feat.set('date', date))
+
+        return images.map(sample_parcels).flatten()
+
+    return export_features(build_features, plan, parcel_selectors(bands), output_file, filename)
+
+
+def extract_parcels(sensor, build_collection, bands, parcels, start_date, end_date, group_name, source, provider,
+                    mode='csv', use_erosion=False, **params):
+    """
+    Batch extraction of one sensor-month for all parcels: one filtered, masked collection
+    and one sampling request, written to raw_data/<group_name>/<sensor folder>/. With
+    mode='aggregate' the parcel statistics are exported instead of the pixels, to
+    config.PARCEL_STATS_PATH/<group_name>/<sensor folder>/.
+
+    Args:
+        sensor (str): Key of config.SENSOR_FOLDERS.
+        build_collection (callable): build_collection(ROI, start_date, end_date) -> processed
+            ee.ImageCollection holding bands.
+        bands (list): Bands to sample.
+        parcels (dict): {parcel_id: coords}, see load_parcels.
+        group_name (str): Folder name of the parcel group under raw_data and metadata.
+        source, provider (str): Metadata labels.
+        mode (str): 'csv' (pixel samples) or 'aggregate' (parcel statistics).
+        use_erosion (bool): Aggregate over the eroded core with observation QA columns.
+        **params: Processing parameters that change the export (part of the cache key).
+    """
+    raw_folder, metadata_folder = config.SENSOR_FOLDERS[sensor]
+    aggregate = mode == 'aggregate'
+    if aggregate:
+        selectors = parcel_stats_selectors(bands, use_erosion)
+        output_file = f'{config.PARCEL_STATS_PATH}/{group_name}/{raw_folder}/{start_date.date()}_{end_date.date()}.csv'
+    else:
+        selectors = parcel_selectors(bands)
+        output_file = f'raw_data/{group_name}/{raw_folder}/{start_date.date()}_{end_date.date()}.csv'
+
+    def save(image_count, status, **extra):
+        metadata = generate_metadata(source, provider, image_count, start_date, end_date, selectors,
+                                     parcels_bounds(parcels), config.runid, status)
+        metadata['parcels'] = sorted(parcels)
+        metadata.update(extra)
+        save_metadata(metadata, group_name, metadata_folder, start_date, end_date)
+
+    export_key = cache_key(f'{sensor}_parcels', parcels, start_date, end_date, selectors,
+                           scale=config.SAMPLING_SCALE, mode=mode, use_erosion=use_erosion, **params)
+    cached = fetch_cached_export(export_key, output_file, ttl=export_ttl(end_date))
+    if cached is not None:
+        print(f"   Served from export cache: {output_file}")
+        save(cached.get('image_count'), 'success', cache_key=export_key, image_dates=cached.get('image_dates'))
+        return
+
+    create_conn_ee()
+    with span('ee_graph_build'):
+        collection = build_collection(parcels_bounds(parcels), start_date, end_date)
+
+    # Acquisition dates are kept in the metadata: masked pixels are not sampled, so a date
+    # with every parcel under clouds leaves no row in the export (see write_parcel_qa)
+    info = fetch_info({'image_count': collection.size(), 'times': collection.aggregate_array('system:time_start')})
+    image_count = info['image_count']
+    image_dates = sorted({f"{pd.Timestamp(t, unit='ms'):%Y-%m-%d}" for t in info['times']})
+    if image_count == 0:
+        print(f"No {source} images for {start_date} to {end_date}")
+        save(0, 'empty')
+        return
+
+    status = 'failed'
+    download = None
+    error = None
+    try:
+        if aggregate:
+            print(f"Reducing {len(parcels)} parcels on {image_count} {source} images...")
+            download = export_parcel_stats(collection, bands, parcels, output_file, f'{sensor}_parcel_stats',
+                                           use_erosion)
+        else:
+            print(f"Sampling {len(parcels)} parcels on {image_count} {source} images...")
+            download = export_parcel_samples(collection, bands, parcels, output_file, f'{sensor}_parcels',
+                                             start_date, end_date, image_count)
+        store_export(export_key, output_file, {'image_count': image_count, 'image_dates': image_dates})
+        status = 'success'
+    except Exception as e:
+        print(f"Error generating URL or downloading: {e}")
+        error = e
+
+    save(image_count, status, download=download, cache_key=export_key, image_dates=image_dates)
+
+    # The failure is recorded in the metadata, and reported to the scheduler as well
+    if error is not None:
+        raise error
+
+
+def write_parcel_pixels(parcels, grid, group_name, raw_path='raw_data'):
+    """
+    Writes the static pixel -> parcel table as raw_data/<group_name>/parcels/parcels.csv.
+
+    Pixels are the grid cells whose centre lies inside a parcel, the cells sampleRegions
+    returns. A cell inside two overlapping parcels keeps the first one at ingestion.
+    Computed locally, no EE request; an unchanged table is not rewritten, so incremental
+    ingestion does not see it as modified.
+    """
+    frames = []
+    for parcel_id, ROI in parcels.items():
+        window = roi_window(ROI, grid)
+        inside = roi_mask(ROI, window, grid)
+        rows, cols = window_grid_indices(window)
+        lon, lat = pixel_center_lonlat(pack_pixel_id(rows[inside], cols[inside]), grid)
+        frames.append(pd.DataFrame({
+            PARCEL_COLUMN: parcel_id,
+            '.geo': [f'{{"type":"Point","coordinates":[{x!r},{y!r}]}}' for x, y in zip(lon.tolist(), lat.tolist())],
+        }))
+
+    content = pd.concat(frames, ignore_index=True).to_csv(index=False)
+    output_file = Path(raw_path) / group_name / PARCELS_FOLDER / 'parcels.csv'
+    if output_file.exists() and output_file.read_text() == content:
+        return output_file
+
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = output_file.with_name(f".{output_file.name}.part")
+    tmp_file.write_text(content)
+    os.replace(tmp_file, output_file)
+    return output_file
+
+
+def image_dates(group_name, sensor='sentinel_2'):
+    """Acquisition dates recorded by extract_parcels in the successful exports of a group."""
+    _, metadata_folder = config.SENSOR_FOLDERS[sensor]
+    dates = set()
+    for metadata_file in Path(f"{config.metadata_path}{group_name}/{metadata_folder}").glob('*.json'):
+        with open(metadata_file, 'r') as f:
+            metadata = json.load(f)
+        if metadata.get('status') == 'success':
+            dates.update(metadata.get('image_dates') or [])
+    return pd.DatetimeIndex(sorted(dates))
+
+
+def _empty_qa_frame(band):
+    return pd.DataFrame({'date': pd.Series(dtype='datetime64[ns]'), 'pixel_id': pd.Series(dtype='int64'),
+                         band: pd.Series(dtype='float64')})
+
+
+def _qa_frames(output_path, band, dates):
+    """
+    (date, pixel_id, band) frame of the Sentinel-2 dates of each manifest partition, with
+    the acquisition dates of its month; months with dates but no partition get an empty frame.
+    """
+    empty = _empty_qa_frame(band)
+    manifest = load_manifest(output_path)
+    if manifest is None:
+        frames = [(read_dataset(output_path, columns=['date', band], with_static=False), dates)]
+    else:
+        months = {}
+        for date in dates:
+            months.setdefault(partition_key(date.year, date.month), []).append(date)
+        frames = []
+        for key, entry in manifest['partitions'].items():
+            file = Path(output_path) / entry['path']
+            # Partitions without any Sentinel-2 sample have no band column
+            if band in pq.read_schema(file).names:
+                frames.append((pd.read_parquet(file, engine='pyarrow', columns=['date', 'pixel_id', band]), months.pop(key, None)))
+            elif key in months:
+                frames.append((empty, months.pop(key)))
+        frames += [(empty, month_dates) for month_dates in months.values()]
+
+    for df, month_dates in frames:
+        # Dates of other sensors have no Sentinel-2 value in any pixel
+        yield df[df.groupby('date')[band].transform('count') > 0], month_dates
+
+
+def write_parcel_qa(parcels, output_path, grid, band='NDVI', dates=None):
+    """
+    Writes the per-observation QA of every parcel and Sentinel-2 date of a pixel dataset
+    as output_path/PARCEL_QA_TABLE.
+
+    The columns are those of the aggregates (PARCEL_QA_COLUMNS) over the adaptive cores,
+    computed from the pixels with a valid band value (see modules/parcel_qa.py), with no
+    EE request. Dates never span partitions, so the partitions listed in the manifest are
+    read one at a time (date, pixel_id and band only) and the table replaced atomically.
+
+    Args:
+        dates (list): Acquisition dates of the exports (image_dates). Dates with every
+            pixel masked leave no row in the dataset; they are written with
+            observation_valid = 0, as the server-side QA reports them.
+    """
+    dates = pd.DatetimeIndex(dates if dates is not None else [])
+    with span('parcel_qa') as s:
+        tables = [observation_qa(df, parcels, grid, band=band, dates=month_dates)
+                  for df, month_dates in _qa_frames(output_path, band, dates)]
+        if not tables:
+            # No Sentinel-2 data yet: the table is written with its columns only
+            tables = [observation_qa(_empty_qa_frame(band), parcels, grid, band=band)]
+        qa = pd.concat(tables, ignore_index=True).sort_values('date', kind='mergesort')
+        s['rows'] = len(qa)
+
+    target_file = Path(output_path) / PARCEL_QA_TABLE
+    tmp_file = target_file.with_name(f".{target_file.name}.tmp")
+    qa[['date', PARCEL_COLUMN, *PARCEL_QA_COLUMNS]].to_parquet(tmp_file, engine='pyarrow', index=False)
+    os.replace(tmp_file, target_file)
+    return target_file
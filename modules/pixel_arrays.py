@@ -0,0 +1,307 @@
+"""
+Array-based pixel transfer for the time-series extractors (EXTRACTION_MODE = 'array').
+
+The CSV mode samples every pixel of every image into a Feature and downloads it with a
+GeoJSON point string, i.e. ~100 bytes of text per pixel per date that must be parsed
+back with a regex. Here each image is fetched as a dense float32 band stack over the ROI
+bounding box, on the S2 10 m master grid, through the computePixels pixel-array
+endpoint, and the stack of a whole job is stored as one compressed .npz:
+
+    data   float32 (time, band, y, x), NaN where the image is masked
+    dates  'YYYY-MM-DD' per time step
+    bands  band names
+    roi    bool (y, x), pixel centres inside the ROI polygon
+    window / grid  placement of the array on the master grid (JSON)
+
+Array row i, column j is grid row window['row_max'] - i, column window['col_min'] + j,
+so pixel ids come from the grid indices directly, without any coordinate parsing.
+
+Backends fetch the pixels: EarthEngineArrayBackend calls EE, StubArrayBackend returns
+deterministic synthetic arrays so the mode can be run and tested offline.
+"""
+
+import os
+import json
+import time
+import zlib
+import numpy as np
+import pandas as pd
+import config
+
+from pathlib import Path
+from datetime import datetime, timezone
+from modules.pixel_grid import master_grid, lonlat_to_utm, pack_pixel_id, pixel_center_lonlat, snap_to_grid
+from modules.export_tiling import polygon_coords, file_sha256
+from modules.tracing import span, map_threads
+
+ARRAY_SUFFIX = '.npz'
+
+# Band holding the combined mask of the requested bands in computePixels responses
+VALID_BAND = '_valid'
+
+
+def roi_window(ROI, grid, pad=1):
+    """
+    Grid window covering the ROI bounding box, padded by pad pixels.
+
+    Returns:
+        dict: {'row_max': int, 'col_min': int, 'height': int, 'width': int}
+    """
+    coords = polygon_coords(ROI)
+    easting, northing = lonlat_to_utm(coords[:, 0], coords[:, 1], grid)
+    scale = grid['scale']
+
+    col_min = int(np.floor(easting.min() / scale)) - pad
+    col_max = int(np.floor(easting.max() / scale)) + pad
+    row_min = int(np.floor(northing.min() / scale)) - pad
+    row_max = int(np.floor(northing.max() / scale)) + pad
+
+    return {'row_max': row_max, 'col_min': col_min, 'height': row_max - row_min + 1, 'width': col_max - col_min + 1}
+
+
+def window_grid_indices(window):
+    """(row, col) int64 grid indices of every array cell, each shaped (y, x)."""
+    rows = window['row_max'] - np.arange(window['height'], dtype='int64')
+    cols = window['col_min'] + np.arange(window['width'], dtype='int64')
+    return np.meshgrid(rows, cols, indexing='ij')
+
+
+def roi_mask(ROI, window, grid):
+    """Boolean (y, x) mask of the array cells whose centre lies inside the ROI outer ring."""
+    coords = polygon_coords(ROI)
+    vx, vy = lonlat_to_utm(coords[:, 0], coords[:, 1], grid)
+
+    rows, cols = window_grid_indices(window)
+    px = (cols + 0.5) * grid['scale']
+    py = (rows + 0.5) * grid['scale']
+
+    # Even-odd ray casting, vectorized over the cells, one pass per polygon edge
+    inside = np.zeros(px.shape, dtype=bool)
+    for x1, y1, x2, y2 in zip(vx, vy, np.roll(vx, -1), np.roll(vy, -1)):
+        if y1 == y2:
+            continue
+        crosses = (y1 > py) != (y2 > py)
+        x_cross = x1 + (py - y1) * (x2 - x1) / (y2 - y1)
+        inside ^= crosses & (px < x_cross)
+
+    return inside
+
+
+def window_affine(window, grid, row_offset=0):
+    """computePixels affineTransform of the window (or of a row block starting at row_offset)."""
+    scale = grid['scale']
+    return {
+        'scaleX': scale, 'shearX': 0, 'translateX': window['col_min'] * scale,
+        'shearY': 0, 'scaleY': -scale, 'translateY': (window['row_max'] + 1 - row_offset) * scale,
+    }
+
+
+def row_blocks(window, n_bands, max_mb=None):
+    """(row_offset, n_rows) blocks keeping each request below ARRAY_MAX_REQUEST_MB."""
+    max_bytes = (max_mb or config.ARRAY_MAX_REQUEST_MB) * 1024 ** 2
+    rows_per_block = max(1, int(max_bytes // (window['width'] * (n_bands + 1) * 4)))
+    return [(r, min(rows_per_block, window['height'] - r)) for r in range(0, window['height'], rows_per_block)]
+
+
+class EarthEngineArrayBackend:
+    """
+    Fetches band stacks from Earth Engine with ee.data.computePixels (NUMPY_NDARRAY).
+
+    ee is imported on use: modules/fake_ee.py imports this module before it installs
+    itself as 'ee', and must not need earthengine-api.
+    """
+
+    def list_images(self, collection):
+        """
+        Images of a collection with their acquisition date, in one round-trip.
+
+        Returns:
+            list: (ee.Image, 'YYYY-MM-DD') pairs.
+        """
+        import ee
+        with span('get_info', ee_calls=1):
+            times = ee.Dictionary({'times': collection.aggregate_array('system:time_start')}).getInfo()['times']
+        images = collection.toList(max(len(times), 1))
+        return [
+            (ee.Image(images.get(i)), datetime.fromtimestamp(t / 1000, tz=timezone.utc).strftime('%Y-%m-%d'))
+            for i, t in enumerate(times)
+        ]
+
+    def fetch(self, image, bands, window, grid):
+        """
+        Dense float32 (band, y, x) stack of one image over the window, NaN where masked.
+
+        Masked pixels are unmasked to 0 server-side and restored from an extra band holding
+        the combined mask, as NUMPY_NDARRAY responses carry no mask.
+        """
+        import ee
+        selected = image.select(bands)
+        valid = selected.mask().reduce(ee.Reducer.min()).rename(VALID_BAND)
+        expression = selected.toFloat().unmask(0).addBands(valid.unmask(0))
+
+        stack = np.empty((len(bands), window['height'], window['width']), dtype='float32')
+        for row_offset, n_rows in row_blocks(window, len(bands)):
+            with span('download', ee_calls=1) as s:
+                pixels = ee.data.computePixels({
+                    'expression': expression,
+                    'fileFormat': 'NUMPY_NDARRAY',
+                    'grid': {
+                        'dimensions': {'width': window['width'], 'height': n_rows},
+                        'affineTransform': window_affine(window, grid, row_offset),
+                        'crsCode': f"EPSG:{grid['epsg']}",
+                    },
+                })
+                s['bytes'] = pixels.nbytes
+            invalid = pixels[VALID_BAND] == 0
+            for b, band in enumerate(bands):
+                block = stack[b, row_offset:row_offset + n_rows]
+                block[:] = pixels[band]
+                block[invalid] = np.nan
+
+        return stack
+
+
+class StubArrayBackend:
+    """
+    Offline backend returning deterministic synthetic stacks (smooth field + noise, with
+    a random share of masked pixels), so the array mode runs without EE credentials.
+
+    Args:
+        dates (list): 'YYYY-MM-DD' dates returned by list_images when the collection
+            itself is not a list of dates.
+        seed (int): Base seed; the same (seed, date, band) always gives the same array.
+        masked_fraction (float): Share of NaN pixels per image.
+        latency_s (float): Sleep per fetch, to mimic a remote call.
+    """
+
+    def __init__(self, dates=None, seed=0, masked_fraction=0.2, latency_s=0.0):
+        self.dates = list(dates or [])
+        self.seed = seed
+        self.masked_fraction = masked_fraction
+        self.latency_s = latency_s
+
+    def list_images(self, collection):
+        dates = collection if isinstance(collection, (list, tuple)) else self.dates
+        return [(date, date) for date in dates]
+
+    def fetch(self, image, bands, window, grid):
+        if self.latency_s:
+            time.sleep(self.latency_s)
+
+        rows, cols = window_grid_indices(window)
+        stack = np.empty((len(bands), window['height'], window['width']), dtype='float32')
+        rng = np.random.default_rng(zlib.crc32(f"{self.seed}|{image}".encode()))
+        masked = rng.random(rows.shape) < self.masked_fraction
+
+        for b, band in enumerate(bands):
+            phase = zlib.crc32(band.encode()) % 628 / 100
+            field = np.sin(rows * 0.05 + phase) * np.cos(cols * 0.05 - phase)
+            stack[b] = field + rng.normal(0, 0.05, rows.shape)
+            stack[b][masked] = np.nan
+
+        return stack
+
+
+def save_array_stack(output_file, data, dates, bands, window, grid, roi):
+    """Writes a stack as compressed .npz through a hidden temp file and os.replace."""
+    output_file = Path(output_file)
+    output_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = output_file.with_name(f".{output_file.stem}.tmp{ARRAY_SUFFIX}")
+
+    np.savez_compressed(
+        tmp_file,
+        data=data,
+        dates=np.asarray(dates, dtype='U10'),
+        bands=np.asarray(bands, dtype='U32'),
+        roi=roi,
+        window=json.dumps(window),
+        grid=json.dumps(grid),
+    )
+    os.replace(tmp_file, output_file)
+
+
+def load_array_stack(file):
+    """Loads a stack written by save_array_stack into a dict."""
+    with np.load(file) as f:
+        return {
+            'data': f['data'],
+            'dates': [str(d) for d in f['dates']],
+            'bands': [str(b) for b in f['bands']],
+            'roi': f['roi'],
+            'window': json.loads(str(f['window'])),
+            'grid': json.loads(str(f['grid'])),
+        }
+
+
+def read_array_frame(file, grid):
+    """
+    Long (date, pixel_id, band...) DataFrame of the ROI pixels of a stored stack, the same
+    shape read_sensor_csv returns for a CSV export. Pixel-dates with every band masked
+    are dropped, as sample() skips them.
+
+    Args:
+        file (str/Path): .npz written by export_arrays.
+        grid (dict): Dataset master grid; stacks on another grid are re-snapped to it.
+    """
+    stack = load_array_stack(file)
+    rows, cols = window_grid_indices(stack['window'])
+    roi = stack['roi']
+
+    if stack['grid'] == grid:
+        pixel_ids = pack_pixel_id(rows[roi], cols[roi])
+    else:
+        lon, lat = pixel_center_lonlat(pack_pixel_id(rows[roi], cols[roi]), stack['grid'])
+        pixel_ids = snap_to_grid(lon, lat, grid)
+
+    # (time, band, y, x) -> (time, pixel, band) -> (time * pixel, band), a single copy
+    values = stack['data'][:, :, roi].transpose(0, 2, 1).reshape(-1, len(stack['bands']))
+    n_dates, n_pixels = len(stack['dates']), len(pixel_ids)
+
+    df = pd.DataFrame(values.astype('float64'), columns=stack['bands'])
+    df.insert(0, 'pixel_id', np.tile(pixel_ids, n_dates))
+    df.insert(0, 'date', pd.to_datetime(np.repeat(np.asarray(stack['dates']), n_pixels)))
+
+    keep = np.isfinite(values).any(axis=1) & (df['pixel_id'].to_numpy() >= 0)
+    return df[keep].reset_index(drop=True)
+
+
+def export_arrays(collection, bands, ROI, output_file, backend=None, grid=None,
+                  max_workers=None):
+    """
+    Fetches every image of a collection as a band stack over the ROI and stores the job as .npz.
+
+    Args:
+        collection: ee.ImageCollection (or whatever the backend lists images from).
+        bands (list): Bands to fetch, in output order.
+        ROI (list): Polygon coordinates; ee.Geometry ROIs cannot be rasterized locally.
+        output_file (str/Path): Target .npz path.
+        backend: EarthEngineArrayBackend (default) or StubArrayBackend.
+        grid (dict): Master grid, defaults to master_grid(ROI).
+        max_workers (int): Images fetched at the same time, config.EXPORT_TILE_WORKERS by default.
+
+    Returns:
+        dict: {'path', 'bytes', 'sha256', 'images', 'shape'}, like a download record.
+    """
+    if not isinstance(ROI, list):
+        raise TypeError("Array extraction needs the ROI as polygon coordinates, not an ee.Geometry")
+
+    backend = backend or EarthEngineArrayBackend()
+    grid = grid or master_grid(ROI)
+    window = roi_window(ROI, grid)
+    images = backend.list_images(collection)
+
+    stacks = map_threads(lambda item: backend.fetch(item[0], bands, window, grid), images,
+                         max_workers=config.EXPORT_TILE_WORKERS if max_workers is None else max_workers)
+
+    data = np.stack(stacks) if stacks else \
+        np.empty((0, len(bands), window['height'], window['width']), dtype='float32')
+    save_array_stack(output_file, data, [date for _, date in images], bands, window, grid,
+                     roi_mask(ROI, window, grid))
+
+    return {
+        'path': str(output_file),
+        'bytes': os.path.getsize(output_file),
+        'sha256': file_sha256(output_file),
+        'images': len(images),
+        'shape': list(data.shape),
+    }
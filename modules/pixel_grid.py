@@ -0,0 +1,254 @@
+"""
+Integer pixel grid aligned to the Sentinel-2 master grid.
+
+Sentinel-2 L2A bands at 10 m are delivered in the UTM zone of their tile with pixel
+edges on multiples of 10 m, which is the projection returned by
+satellites_data_extraction.get_master_crs (B4 projection). Every sample (S1, S2,
+Landsat, SRTM) is snapped to the 10 m cell containing it, so sensors can be joined on a
+compact int64 'pixel_id' instead of exact coordinates.
+
+The projection is done locally with the Krüger series for the Transverse Mercator
+(sub-millimetre accuracy inside a UTM zone), so no extra dependency nor EE call is needed.
+"""
+
+import os
+import json
+import numpy as np
+
+# WGS84 ellipsoid and UTM constants
+WGS84_A = 6378137.0
+WGS84_F = 1 / 298.257223563
+UTM_K0 = 0.9996
+UTM_FALSE_EASTING = 500000.0
+UTM_FALSE_NORTHING_SOUTH = 10000000.0
+
+# Columns are packed in the lowest COL_BITS bits of the pixel id
+# (UTM eastings stay below 1,000 km, i.e. < 100,000 columns at 10 m)
+COL_BITS = 20
+
+GRID_FILE = '_grid.json'
+
+_n = WGS84_F / (2 - WGS84_F)
+_A = WGS84_A / (1 + _n) * (1 + _n ** 2 / 4 + _n ** 4 / 64)
+_ALPHA = (
+    _n / 2 - 2 * _n ** 2 / 3 + 5 * _n ** 3 / 16,
+    13 * _n ** 2 / 48 - 3 * _n ** 3 / 5,
+    61 * _n ** 3 / 240,
+)
+_BETA = (
+    _n / 2 - 2 * _n ** 2 / 3 + 37 * _n ** 3 / 96,
+    _n ** 2 / 48 + _n ** 3 / 15,
+    17 * _n ** 3 / 480,
+)
+_DELTA = (
+    2 * _n - 2 * _n ** 2 / 3 - 2 * _n ** 3,
+    7 * _n ** 2 / 3 - 8 * _n ** 3 / 5,
+    56 * _n ** 3 / 15,
+)
+_E_FACTOR = 2 * np.sqrt(_n) / (1 + _n)
+
+
+def utm_zone(lon):
+    """UTM zone number (1-60) for a longitude in degrees."""
+    return int(np.floor((lon + 180) / 6) % 60) + 1
+
+
+def master_grid(ROI=None, lon=None, lat=None, scale=10):
+    """
+    Builds the grid definition for a ROI (list of polygon coordinates) or a lon/lat point.
+
+    The UTM zone is taken from the ROI centroid, which is the zone of the S2 tile for
+    all parcels not sitting on a zone boundary.
+
+    Returns:
+        dict: {'epsg': int, 'zone': int, 'south': bool, 'scale': int}
+    """
+    if ROI is not None:
+        coords = np.asarray(ROI, dtype='float64').reshape(-1, 2)
+        lon, lat = coords[:, 0].mean(), coords[:, 1].mean()
+
+    zone = utm_zone(lon)
+    south = bool(lat < 0)
+
+    return {
+        'epsg': (32700 if south else 32600) + zone,
+        'zone': zone,
+        'south': south,
+        'scale': scale,
+    }
+
+
+def lonlat_to_utm(lon, lat, grid):
+    """
+    Vectorized forward UTM projection.
+
+    Args:
+        lon, lat (array-like): Coordinates in degrees (EPSG:4326).
+        grid (dict): Grid definition from master_grid.
+
+    Returns:
+        tuple: (easting, northing) float64 arrays in meters.
+    """
+    lon = np.asarray(lon, dtype='float64')
+    lat = np.asarray(lat, dtype='float64')
+
+    lon0 = np.radians((grid['zone'] - 1) * 6 - 180 + 3)
+    phi = np.radians(lat)
+    lam = np.radians(lon) - lon0
+
+    sin_phi = np.sin(phi)
+    t = np.sinh(np.arctanh(sin_phi) - _E_FACTOR * np.arctanh(_E_FACTOR * sin_phi))
+    xi = np.arctan2(t, np.cos(lam))
+    eta = np.arctanh(np.sin(lam) / np.sqrt(1 + t ** 2))
+
+    easting = eta + sum(a * np.cos(2 * j * xi) * np.sinh(2 * j * eta) for j, a in enumerate(_ALPHA, start=1))
+    northing = xi + sum(a * np.sin(2 * j * xi) * np.cosh(2 * j * eta) for j, a in enumerate(_ALPHA, start=1))
+
+    easting = UTM_FALSE_EASTING + UTM_K0 * _A * easting
+    northing = UTM_K0 * _A * northing
+    if grid['south']:
+        northing += UTM_FALSE_NORTHING_SOUTH
+
+    return easting, northing
+
+
+def utm_to_lonlat(easting, northing, grid):
+    """Vectorized inverse of lonlat_to_utm. Returns (lon, lat) in degrees."""
+    easting = np.asarray(easting, dtype='float64')
+    northing = np.asarray(northing, dtype='float64')
+    if grid['south']:
+        northing = northing - UTM_FALSE_NORTHING_SOUTH
+
+    xi = northing / (UTM_K0 * _A)
+    eta = (easting - UTM_FALSE_EASTING) / (UTM_K0 * _A)
+
+    xi_p = xi - sum(b * np.sin(2 * j * xi) * np.cosh(2 * j * eta) for j, b in enumerate(_BETA, start=1))
+    eta_p = eta - sum(b * np.cos(2 * j * xi) * np.sinh(2 * j * eta) for j, b in enumerate(_BETA, start=1))
+
+    chi = np.arcsin(np.sin(xi_p) / np.cosh(eta_p))
+    phi = chi + sum(d * np.sin(2 * j * chi) for j, d in enumerate(_DELTA, start=1))
+
+    lon0 = np.radians((grid['zone'] - 1) * 6 - 180 + 3)
+    lam = lon0 + np.arctan2(np.sinh(eta_p), np.cos(xi_p))
+
+    return np.degrees(lam), np.degrees(phi)
+
+
+def pack_pixel_id(row, col):
+    """Packs (row, col) grid indices into a single int64 id."""
+    return (np.asarray(row, dtype='int64') << COL_BITS) | np.asarray(col, dtype='int64')
+
+
+def unpack_pixel_id(pixel_id):
+    """Inverse of pack_pixel_id. Returns (row, col) int64 arrays."""
+    pixel_id = np.asarray(pixel_id, dtype='int64')
+    return pixel_id >> COL_BITS, pixel_id & ((1 << COL_BITS) - 1)
+
+
+def frame_cube(df, dates=None):
+    """
+    Positions of the rows of a (date, pixel_id) frame in a dense (date, y, x) block
+    covering their pixels.
+
+    Args:
+        dates (np.ndarray): Sorted dates of the time axis, for blocks of one window of a
+            larger frame that must share its time axis; defaults to the dates of df.
+
+    Returns:
+        tuple: ((t, y, x) index arrays, block shape)
+    """
+    if dates is None:
+        dates, t = np.unique(df['date'].to_numpy(), return_inverse=True)
+    else:
+        t = np.searchsorted(dates, df['date'].to_numpy())
+    rows, cols = unpack_pixel_id(df['pixel_id'].to_numpy())
+    rows = rows - rows.min()
+    cols = cols - cols.min()
+    return (t, rows, cols), (len(dates), int(rows.max()) + 1, int(cols.max()) + 1)
+
+
+def _split_gaps(values, positions, reach):
+    """Splits positions where the sorted values jump by more than reach."""
+    order = np.argsort(values[positions], kind='stable')
+    breaks = np.flatnonzero(np.diff(values[positions][order]) > reach) + 1
+    return np.split(positions[order], breaks)
+
+
+def frame_windows(df, reach):
+    """
+    Splits the rows of a (date, pixel_id) frame into spatial windows whose pixels are
+    more than reach cells apart (along rows or columns) from those of any other window.
+
+    Neighbourhood operations reaching up to reach cells (dilations, moving windows)
+    give the same result on each window's frame_cube as on the whole frame, while the
+    blocks only cover the pixels: a parcel group spread over a large area is split at
+    the empty space between parcels. Windows are found by cutting the unique pixels at
+    row and column gaps, recursively.
+
+    Returns:
+        list: Row positions (sorted) of each window.
+    """
+    pixel_ids, inverse = np.unique(df['pixel_id'].to_numpy(), return_inverse=True)
+    rows, cols = unpack_pixel_id(pixel_ids)
+
+    windows, pending = [], [np.arange(len(pixel_ids))]
+    while pending:
+        positions = pending.pop()
+        parts = _split_gaps(rows, positions, reach)
+        if len(parts) == 1:
+            parts = _split_gaps(cols, positions, reach)
+        if len(parts) == 1:
+            windows.append(positions)
+        else:
+            pending.extend(parts)
+
+    labels = np.empty(len(pixel_ids), dtype='int64')
+    for label, positions in enumerate(windows):
+        labels[positions] = label
+    row_labels = labels[np.ravel(inverse)]
+    order = np.argsort(row_labels, kind='stable')
+    return np.split(order, np.cumsum(np.bincount(row_labels, minlength=len(windows)))[:-1])
+
+
+def snap_to_grid(lon, lat, grid):
+    """
+    Snaps lon/lat samples to the grid cell containing them.
+
+    Rows count northing cells and columns easting cells from the UTM origin, so ids are
+    stable across ROIs and runs that share the same zone.
+
+    Returns:
+        np.ndarray: int64 pixel ids (-1 where lon/lat is NaN).
+    """
+    easting, northing = lonlat_to_utm(lon, lat, grid)
+    valid = np.isfinite(easting) & np.isfinite(northing)
+
+    row = np.floor(np.where(valid, northing, 0) / grid['scale']).astype('int64')
+    col = np.floor(np.where(valid, easting, 0) / grid['scale']).astype('int64')
+
+    return np.where(valid, pack_pixel_id(row, col), -1)
+
+
+def pixel_center_lonlat(pixel_id, grid):
+    """Lon/lat of the centre of each grid cell, for lookups and map display."""
+    row, col = unpack_pixel_id(pixel_id)
+    easting = (col + 0.5) * grid['scale']
+    northing = (row + 0.5) * grid['scale']
+    return utm_to_lonlat(easting, northing, grid)
+
+
+def save_grid(output_path, grid):
+    """Stores the grid definition next to the dataset so pixel ids can be decoded later."""
+    os.makedirs(output_path, exist_ok=True)
+    with open(os.path.join(output_path, GRID_FILE), 'w') as f:
+        json.dump(grid, f, indent=4)
+
+
+def load_grid(output_path):
+    """Returns the grid definition stored with a dataset, or None."""
+    grid_file = os.path.join(output_path, GRID_FILE)
+    if not os.path.exists(grid_file):
+        return None
+
+    with open(grid_file, 'r') as f:
+        return json.load(f)
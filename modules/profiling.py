@@ -0,0 +1,139 @@
+"""
+Built-in profiling mode of run_pipeline (run_pipeline(profile=True) / python main.py --profile).
+
+Each profiled stage (a sensor-month job, create_partitioned_dataset) runs under cProfile
+and between two tracemalloc snapshots. Per stage this writes into the output folder:
+
+    <stage>.prof         cProfile stats, for pstats / snakeviz
+    <stage>.memory.txt   top allocation growth between the snapshots, by source line
+
+and, once the run is over, report.txt: wall time and memory per stage, then the top-N
+functions of all stages together by own and cumulative time, then the top-N allocation
+sites.
+
+cProfile and tracemalloc are process-wide (cProfile uses sys.monitoring on Python 3.12+,
+which allows a single active profiler), so profiled stages never overlap: they take a
+lock, and run_pipeline runs the jobs one at a time while profiling. cProfile only records
+the thread it was started on, so within a stage the export tiles and array images
+(tracing.map_threads) are fetched on that thread as well, one at a time.
+"""
+
+import io
+import re
+import time
+import pstats
+import cProfile
+import threading
+import tracemalloc
+
+from pathlib import Path
+from functools import wraps
+from modules.tracing import single_thread
+
+# Frames kept per allocation trace
+TRACEMALLOC_FRAMES = 10
+
+
+def stage_filename(name):
+    """File-system safe version of a stage name."""
+    return re.sub(r'[^A-Za-z0-9_.-]+', '_', name).strip('_')
+
+
+class Profiler:
+    """
+    Profiles named pipeline stages and writes their reports.
+
+    Args:
+        output_dir (str/Path): Folder of the .prof files and report.txt.
+        top_n (int): Rows of each ranking in the reports.
+    """
+
+    def __init__(self, output_dir, top_n=30):
+        self.output_dir = Path(output_dir)
+        self.top_n = top_n
+        self.stages = []
+        self._lock = threading.Lock()
+
+    def run(self, name, func, *args, **kwargs):
+        """Calls func(*args, **kwargs) as the profiled stage name and returns its result."""
+        self.output_dir.mkdir(parents=True, exist_ok=True)
+        stem = stage_filename(name)
+
+        with self._lock:
+            started_tracing = not tracemalloc.is_tracing()
+            if started_tracing:
+                tracemalloc.start(TRACEMALLOC_FRAMES)
+            tracemalloc.reset_peak()
+            before = tracemalloc.take_snapshot()
+
+            profile = cProfile.Profile()
+            started = time.perf_counter()
+            try:
+                with single_thread():
+                    return profile.runcall(func, *args, **kwargs)
+            finally:
+                wall_s = time.perf_counter() - started
+                _, peak = tracemalloc.get_traced_memory()
+                after = tracemalloc.take_snapshot()
+                if started_tracing:
+                    tracemalloc.stop()
+
+                prof_file = self.output_dir / f"{stem}.prof"
+                profile.dump_stats(prof_file)
+                growth = after.compare_to(before, 'lineno')
+                self._write_memory(self.output_dir / f"{stem}.memory.txt", name, growth)
+
+                self.stages.append({
+                    'name': name,
+                    'prof_file': prof_file,
+                    'wall_s': round(wall_s, 3),
+                    'peak_traced_mb': round(peak / 1024 ** 2, 1),
+                    'net_alloc_mb': round(sum(s.size_diff for s in growth) / 1024 ** 2, 1),
+                    'growth': growth[:self.top_n],
+                })
+
+    def wrap(self, name, func):
+        """func profiled as stage name on every call."""
+        @wraps(func)
+        def profiled(*args, **kwargs):
+            return self.run(name, func, *args, **kwargs)
+        return profiled
+
+    def _write_memory(self, path, name, growth):
+        with open(path, 'w') as f:
+            f.write(f"Allocation growth during {name} (top {self.top_n} source lines)\n\n")
+            for stat in growth[:self.top_n]:
+                f.write(f"{stat}\n")
+
+    def write_report(self):
+        """
+        Writes report.txt with the per-stage table and the ranked hotspots of all stages.
+
+        Returns:
+            Path or None: The report, None when nothing was profiled.
+        """
+        if not self.stages:
+            return None
+
+        out = io.StringIO()
+        out.write(f"Profiled stages: {len(self.stages)}\n\n")
+        out.write(f"{'stage':<40} {'wall s':>10} {'peak MB':>10} {'net MB':>10}\n")
+        for stage in sorted(self.stages, key=lambda s: s['wall_s'], reverse=True):
+            out.write(f"{stage['name']:<40} {stage['wall_s']:>10.3f} "
+                      f"{stage['peak_traced_mb']:>10.1f} {stage['net_alloc_mb']:>10.1f}\n")
+
+        stats = pstats.Stats(*[str(s['prof_file']) for s in self.stages], stream=out)
+        stats.strip_dirs()
+        for sort_key, title in (('tottime', 'own time'), ('cumulative', 'cumulative time')):
+            out.write(f"\n\nTop {self.top_n} functions by {title}, all stages\n")
+            stats.sort_stats(sort_key).print_stats(self.top_n)
+
+        growth = sorted((stat for s in self.stages for stat in s['growth']),
+                        key=lambda stat: stat.size_diff, reverse=True)
+        out.write(f"\nTop {self.top_n} allocation sites, all stages\n\n")
+        for stat in growth[:self.top_n]:
+            out.write(f"{stat}\n")
+
+        report_file = self.output_dir / 'report.txt'
+        report_file.write_text(out.getvalue())
+        return report_file
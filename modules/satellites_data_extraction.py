@@ -75,7 +75,98 @@ def get_sentinel1_data(ROI=config.ROI_TEST, start_date=config.T1_START, end_date
 
     return s1_full
 
-def get_sentinel2_data(ROI=config.ROI_TEST, start_date=config.T1_START, end_date=config.T2_END):
+def apply_s2_masks(img, rules=None):
+    """
+    Applies the ensemble mask rules to a single image.
+
+    Thresholds, clear SCL classes and dilation come from config.CLOUD_MASK_RULES (rules
+    overrides some of them); modules/cloud_mask.py applies the same rules locally.
+    """
+    rules = {**config.CLOUD_MASK_RULES, **(rules or {})}
+    
+    # --- 1A. Thresholds (Regole Base) ---
+    # Cloud Score+ Rules: cs >= 0.60 AND cs_cdf >= 0.70
+    # bands: cs_cs, cs_cs_cdf
+    is_cs_clear = img.select('cs_cs').gte(rules['cs_min']).And(img.select('cs_cs_cdf').gte(rules['cs_cdf_min']))
+    
+    # S2Cloudless Rules: probability <= 30
+    # band: cld_probability
+    is_prob_clear = img.select('cld_probability').lte(rules['prob_max'])
+    
+    # --- 1B. SCL Toxic Classes ---
+    # 0: No Data, 1: Saturated, 2: Dark, 3: Cloud Shadow, 7: Unclassified,
+    # 8: Medium Cloud, 9: High Cloud, 10: Thin Cirrus, 11: Snow
+    scl = img.select('SCL')
+    # We keep only: 4 (Vegetation), 5 (Bare Soil), 6 (Water)
+    # Note: We include 6 for now, but exclude it for dark pixel check later.
+    is_scl_clear = scl.eq(rules['scl_clear'][0])
+    for scl_class in rules['scl_clear'][1:]:
+        is_scl_clear = is_scl_clear.Or(scl.eq(scl_class))
+    
+    # Combine "Cloud-Like" detections (Inverted logic: invalid if ANY says bad)
+    # But here we defined "clear" conditions.
+    # Pixel is clear if ALL say clear.
+    cloud_mask = is_cs_clear.And(is_prob_clear).And(is_scl_clear)
+    
+    # --- 1D. Shadow Projection (Ombre) ---
+    # Temporarily DISABLED for debugging GE/Server error
+    # 1. Identification of Cloud Core (Strict cloud for projection)
+    # is_cloud_core = img.select('cld_probability').gt(50).Or(scl.eq(8)).Or(scl.eq(9))
+    
+    # 2. Geometric Projection params
+    # azimuth = ee.Number(img.get('MEAN_SOLAR_AZIMUTH_ANGLE'))
+    # zenith = ee.Number(img.get('MEAN_SOLAR_ZENITH_ANGLE'))
+    
+    # Shadow direction = Azimuth + 180 (moved to radians)
+    # shadow_azimuth = azimuth.add(180).multiply(3.14159265 / 180)
+    
+    # Project function
+    # def project_shadows(cloud_mask, height):
+    #     # Distance = height * tan(zenith)
+    #     dist = ee.Number(height).multiply(zenith.multiply(3.14159265 / 180).tan())
+    #     x_shift = dist.multiply(shadow_azimuth.sin()).divide(10) # divide by scale (10m)
+    #     y_shift = dist.multiply(shadow_azimuth.cos()).divide(10)
+    #     return cloud_mask.changeProj(cloud_mask.projection(), cloud_mask.projection().translate(x_shift, y_shift))
+
+    # Try multiple heights (simplified for MVP: 500m, 1000m, 2000m)
+    # Using a reduce/iterate approach or hardcoded union for simplicity
+    # shadow_proj = ee.Image(0)
+    # for h in [500, 1000, 2000]:
+    #      shadow_proj = shadow_proj.Or(project_shadows(is_cloud_core, h))
+    
+    # 3. Dark Pixel Confirmation (Intersection)
+    # Must be projected shadow AND dark (NIR < 0.15) AND Not Water (SCL!=6)
+    # nir = img.select('B8').divide(10000) # L2A is scaled by 10000
+    # is_dark = nir.lt(0.15).And(scl.neq(6))
+    
+    # confirmed_shadow = shadow_proj.And(is_dark)
+    
+    # Dilate masks (Buffer) - Simulated with focal_min/max
+    # "Dilate Cloud 20m" -> 2 pixels radius (focal_max on cloud mask)
+    # "Dilate Shadow 10m" -> 1 pixel radius
+    
+    # Note: cloud_mask is 1 for CLEAR. So we invert to dilate CLOUDS.
+    is_cloud = cloud_mask.Not()
+    is_cloud_dilated = is_cloud.focal_max(rules['dilation_m'], 'circle', 'meters')
+    
+    # is_shadow_dilated = confirmed_shadow.focal_max(10, 'circle', 'meters')
+    
+    # Final Invalid Mask
+    is_invalid = is_cloud_dilated #.Or(is_shadow_dilated)
+    
+    # --- 1E. Final Masking ---
+    return img.updateMask(is_invalid.Not())
+
+def add_solar_bands(img):
+    """
+    Adds the scene solar angles as constant bands (solar_azimuth, solar_zenith), so they
+    are exported per pixel for the local shadow projection (modules/cloud_mask.py).
+    """
+    azimuth = ee.Image.constant(img.get('MEAN_SOLAR_AZIMUTH_ANGLE')).rename('solar_azimuth').toFloat()
+    zenith = ee.Image.constant(img.get('MEAN_SOLAR_ZENITH_ANGLE')).rename('solar_zenith').toFloat()
+    return img.addBands(azimuth).addBands(zenith)
+
+def get_sentinel2_data(ROI=config.ROI_TEST, start_date=config.T1_START, end_date=config.T2_END, apply_mask=True):
 
     roi = ee.Geometry.Polygon(ROI)
     try:
@@ -104,83 +195,11 @@ def get_sentinel2_data(ROI=config.ROI_TEST, start_date=config.T1_START, end_date
         # Combine (Inner Join on system:index)
         s2_full = s2.combine(cs_plus).combine(s2_cloudless)
 
-        def apply_masks(img):
-            """
-            Applies the ensemble mask rules to a single image.
-            """
-            
-            # --- 1A. Thresholds (Regole Base) ---
-            # Cloud Score+ Rules: cs >= 0.60 AND cs_cdf >= 0.70
-            # bands: cs_cs, cs_cs_cdf
-            is_cs_clear = img.select('cs_cs').gte(0.60).And(img.select('cs_cs_cdf').gte(0.70))
-            
-            # S2Cloudless Rules: probability <= 30
-            # band: cld_probability
-            is_prob_clear = img.select('cld_probability').lte(30)
-            
-            # --- 1B. SCL Toxic Classes ---
-            # 0: No Data, 1: Saturated, 2: Dark, 3: Cloud Shadow, 7: Unclassified,
-            # 8: Medium Cloud, 9: High Cloud, 10: Thin Cirrus, 11: Snow
-            scl = img.select('SCL')
-            # We keep only: 4 (Vegetation), 5 (Bare Soil), 6 (Water)
-            # Note: We include 6 for now, but exclude it for dark pixel check later.
-            is_scl_clear = scl.eq(4).Or(scl.eq(5)).Or(scl.eq(6))
-            
-            # Combine "Cloud-Like" detections (Inverted logic: invalid if ANY says bad)
-            # But here we defined "clear" conditions.
-            # Pixel is clear if ALL say clear.
-            cloud_mask = is_cs_clear.And(is_prob_clear).And(is_scl_clear)
-            
-            # --- 1D. Shadow Projection (Ombre) ---
-            # Temporarily DISABLED for debugging GE/Server error
-            # 1. Identification of Cloud Core (Strict cloud for projection)
-            # is_cloud_core = img.select('cld_probability').gt(50).Or(scl.eq(8)).Or(scl.eq(9))
-            
-            # 2. Geometric Projection params
-            # azimuth = ee.Number(img.get('MEAN_SOLAR_AZIMUTH_ANGLE'))
-            # zenith = ee.Number(img.get('MEAN_SOLAR_ZENITH_ANGLE'))
-            
-            # Shadow direction = Azimuth + 180 (moved to radians)
-            # shadow_azimuth = azimuth.add(180).multiply(3.14159265 / 180)
-            
-            # Project function
-            # def project_shadows(cloud_mask, height):
-            #     # Distance = height * tan(zenith)
-            #     dist = ee.Number(height).multiply(zenith.multiply(3.14159265 / 180).tan())
-            #     x_shift = dist.multiply(shadow_azimuth.sin()).divide(10) # divide by scale (10m)
-            #     y_shift = dist.multiply(shadow_azimuth.cos()).divide(10)
-            #     return cloud_mask.changeProj(cloud_mask.projection(), cloud_mask.projection().translate(x_shift, y_shift))
-
-            # Try multiple heights (simplified for MVP: 500m, 1000m, 2000m)
-            # Using a reduce/iterate approach or hardcoded union for simplicity
-            # shadow_proj = ee.Image(0)
-            # for h in [500, 1000, 2000]:
-            #      shadow_proj = shadow_proj.Or(project_shadows(is_cloud_core, h))
-            
-            # 3. Dark Pixel Confirmation (Intersection)
-            # Must be projected shadow AND dark (NIR < 0.15) AND Not Water (SCL!=6)
-            # nir = img.select('B8').divide(10000) # L2A is scaled by 10000
-            # is_dark = nir.lt(0.15).And(scl.neq(6))
-            
-            # confirmed_shadow = shadow_proj.And(is_dark)
-            
-            # Dilate masks (Buffer) - Simulated with focal_min/max
-            # "Dilate Cloud 20m" -> 2 pixels radius (focal_max on cloud mask)
-            # "Dilate Shadow 10m" -> 1 pixel radius
-            
-            # Note: cloud_mask is 1 for CLEAR. So we invert to dilate CLOUDS.
-            is_cloud = cloud_mask.Not()
-            is_cloud_dilated = is_cloud.focal_max(20, 'circle', 'meters')
-            
-            # is_shadow_dilated = confirmed_shadow.focal_max(10, 'circle', 'meters')
-            
-            # Final Invalid Mask
-            is_invalid = is_cloud_dilated #.Or(is_shadow_dilated)
-            
-            # --- 1E. Final Masking ---
-            return img.updateMask(is_invalid.Not())
-
-        return s2_full.map(apply_masks)
+        if not apply_mask:
+            # Unmasked images with the QA bands and solar angles, masked locally (modules/cloud_mask.py)
+            return s2_full.map(add_solar_bands)
+
+        return s2_full.map(apply_s2_masks)
    
     except Exception as e:
         print(f"Warning: sentinel2 data not found or error loading collection ({e}). Using dummy data.")
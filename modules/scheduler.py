@@ -0,0 +1,88 @@
+"""
+Concurrent scheduler for (sensor, month) download jobs.
+
+Each extractor call spends most of its time waiting on Earth Engine (getInfo round-trips,
+export URL generation) and on the HTTP download, so jobs are run on a bounded thread pool
+where those waits overlap. Every job reports its own result or error; a failing job never
+stops the others. Each job runs in its own trace (modules/tracing.py), whose per-stage
+summary is returned with the result.
+"""
+
+import time
+import traceback
+
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from modules.tracing import tracing
+
+
+def make_job(sensor, month_start, func, *args, **kwargs):
+    """
+    Describes one download job.
+
+    Args:
+        sensor (str): Sensor key (see config.SENSOR_FOLDERS).
+        month_start (datetime): Month the job covers.
+        func (callable): Extractor to call, e.g. get_st2.
+        *args, **kwargs: Arguments passed to func.
+
+    Returns:
+        dict
+    """
+    return {'sensor': sensor, 'month': month_start, 'func': func, 'args': args, 'kwargs': kwargs}
+
+
+def _run_job(job):
+    started = time.perf_counter()
+    result = {'sensor': job['sensor'], 'month': job['month']}
+
+    with tracing(f"{job['sensor']} {job['month']:%Y-%m}") as trace:
+        try:
+            result['value'] = job['func'](*job['args'], **job['kwargs'])
+            result['status'] = 'success'
+        except Exception as e:
+            result['status'] = 'failed'
+            result['error'] = f"{type(e).__name__}: {e}"
+            result['traceback'] = traceback.format_exc()
+
+    result['timing'] = trace.summary()
+    result['elapsed_s'] = round(time.perf_counter() - started, 3)
+    return result
+
+
+def run_jobs(jobs, max_workers=4, progress_callback=None):
+    """
+    Runs download jobs concurrently on a bounded thread pool.
+
+    Args:
+        jobs (list): Jobs built with make_job.
+        max_workers (int): Maximum number of jobs running at the same time (1 = serial).
+        progress_callback (callable): Optional, called as progress_callback(done, total, result)
+            each time a job finishes.
+
+    Returns:
+        list: One result dict per job, in the order of jobs:
+            {'sensor', 'month', 'status': 'success'|'failed', 'value', 'error', 'traceback', 'elapsed_s',
+             'timing': per-stage summary, see modules.tracing.Trace.summary}
+    """
+    if not jobs:
+        return []
+
+    results = [None] * len(jobs)
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        futures = {executor.submit(_run_job, job): i for i, job in enumerate(jobs)}
+
+        for done, future in enumerate(as_completed(futures), start=1):
+            result = future.result()
+            results[futures[future]] = result
+
+            label = f"{result['sensor']} {result['month']:%Y-%m}"
+            if result['status'] == 'success':
+                print(f"[{done}/{len(jobs)}] {label} done in {result['elapsed_s']}s")
+            else:
+                print(f"[{done}/{len(jobs)}] {label} FAILED: {result['error']}")
+
+            if progress_callback is not None:
+                progress_callback(done, len(jobs), result)
+
+    return results
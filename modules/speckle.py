@@ -0,0 +1,149 @@
+"""
+Local Sentinel-1 speckle filtering and backscatter indices on the pixel grid.
+
+get_st1 used to build the 5x5 boxcar of utils.despeckle and then sample the unfiltered
+collection. With config.S1_DESPECKLE = 'local' the extractors export the unfiltered
+VV/VH backscatter (dB) instead, and ingestion (utils.apply_local_s1_processing) runs
+process_frame on every such frame: the pixels are scattered into dense (time, y, x)
+stacks, filtered with config.S1_SPECKLE_FILTER and turned back into the VV, VH and
+RATIOVHVV columns of a server export.
+
+Filters work on linear power, where speckle is multiplicative, as separable moving
+windows: the window sums are cumulative-sum differences along each axis, so their cost
+does not depend on the window size. Both polarisations are filtered together and the
+dB conversion and ratio are computed on the filtered values in the same pass.
+
+Pixels that are not exported (outside the ROI, masked) are NaN and simply left out of
+the windows, which shrink at the block edges.
+"""
+
+import numpy as np
+import config
+
+from modules.pixel_grid import frame_cube, frame_windows
+
+# Exported backscatter bands (dB) and the derived band
+POLARIZATIONS = ['VV', 'VH']
+RATIO_BAND = 'RATIOVHVV'
+
+FILTERS = ['none', 'boxcar', 'lee']
+
+
+def speckle_rules(rules=None):
+    """config.S1_SPECKLE_FILTER with the given entries overridden."""
+    return {**config.S1_SPECKLE_FILTER, **(rules or {})}
+
+
+def window_sum(values, window):
+    """
+    Moving-window sums over the last len(window) axes, windows centered and truncated
+    at the edges.
+
+    Args:
+        values (np.ndarray): Array to sum, NaN free.
+        window (list): Odd window size per axis, e.g. (time, y, x); 1 leaves the axis alone.
+    """
+    for axis, size in zip(range(-len(window), 0), window):
+        if size <= 1:
+            continue
+        n = values.shape[axis]
+        half = size // 2
+        cumsum = np.cumsum(values, axis=axis)
+        cumsum = np.concatenate([np.zeros_like(np.take(cumsum, [0], axis=axis)), cumsum], axis=axis)
+        i = np.arange(n)
+        values = np.take(cumsum, np.minimum(i + half + 1, n), axis=axis) - np.take(cumsum, np.maximum(i - half, 0), axis=axis)
+    return values
+
+
+def window_moments(power, window):
+    """
+    Local mean and mean of squares of power over the finite pixels of each window.
+
+    Returns:
+        tuple: (mean, mean_square), NaN where a window holds no finite pixel.
+    """
+    finite = np.isfinite(power)
+    filled = np.where(finite, power, 0.0)
+    count = window_sum(finite.astype('float64'), window)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mean = window_sum(filled, window) / count
+        mean_square = window_sum(filled * filled, window) / count
+    return mean, mean_square
+
+
+def despeckle(power, rules=None):
+    """
+    Speckle filter of linear power stacks (..., time, y, x).
+
+    'boxcar' is the local mean. 'lee' is the Lee filter: the local mean plus the
+    deviation from it weighted by the share of the local variance not explained by
+    speckle, whose coefficient of variation is 1 / sqrt(enl). 'none' returns power.
+    NaN pixels stay NaN.
+    """
+    rules = speckle_rules(rules)
+    if rules['filter'] not in FILTERS:
+        raise ValueError(f"Unknown speckle filter {rules['filter']!r}, available: {FILTERS}")
+    if rules['filter'] == 'none':
+        return power
+
+    window = rules['window']
+    mean, mean_square = window_moments(power, window)
+    if rules['filter'] == 'boxcar':
+        filtered = mean
+    else:
+        cu2 = 1.0 / rules['enl']
+        variance = np.maximum(mean_square - mean * mean, 0.0)
+        signal_variance = np.maximum((variance - mean * mean * cu2) / (1 + cu2), 0.0)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            weight = np.where(variance > 0, signal_variance / variance, 0.0)
+        filtered = mean + weight * (power - mean)
+
+    return np.where(np.isfinite(power), filtered, np.nan)
+
+
+def process_stacks(vv_db, vh_db, rules=None):
+    """
+    Filters VV/VH backscatter stacks (dB, NaN where missing) and derives RATIOVHVV.
+
+    Both polarisations are converted to power and filtered as one (2, ..., time, y, x)
+    stack, then converted back to dB; RATIOVHVV is VH / VV in dB, as utils.rariovhvv.
+
+    Returns:
+        dict: {'VV': dB, 'VH': dB, 'RATIOVHVV': ratio} arrays of the input shape.
+    """
+    power = np.power(10.0, np.stack([vv_db, vh_db]).astype('float64') / 10.0)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        vv, vh = 10.0 * np.log10(despeckle(power, rules))
+        ratio = vh / vv
+    return {'VV': vv, 'VH': vh, RATIO_BAND: np.where(np.isfinite(ratio), ratio, np.nan)}
+
+
+def process_frame(df, rules=None):
+    """
+    Filters a (date, pixel_id, VV, VH) frame of unfiltered exports and adds RATIOVHVV.
+
+    Every date in the time window must be complete for the windows to see the
+    neighbours; rows and their order are kept.
+
+    The stacks are built per frame_windows window (pixels farther apart than half the
+    spatial window never share a window sum) on the time axis of the whole frame, so
+    their size follows the pixels and not the bounding box of a spread-out parcel group.
+    """
+    if df.empty:
+        return df.assign(**{RATIO_BAND: np.nan})
+
+    dates = np.unique(df['date'].to_numpy())
+    reach = max(size // 2 for size in speckle_rules(rules)['window'][-2:])
+    output = {band: np.full(len(df), np.nan) for band in [*POLARIZATIONS, RATIO_BAND]}
+    for positions in frame_windows(df, reach):
+        window = df.iloc[positions]
+        index, shape = frame_cube(window, dates)
+        stacks = {}
+        for band in POLARIZATIONS:
+            stacks[band] = np.full(shape, np.nan)
+            stacks[band][index] = window[band].to_numpy(dtype='float64', na_value=np.nan)
+
+        for band, values in process_stacks(stacks['VV'], stacks['VH'], rules).items():
+            output[band][positions] = values[index]
+
+    return df.assign(**output)
@@ -0,0 +1,156 @@
+"""
+Local NumPy engine for the Sentinel-2 spectral indices.
+
+The index functions in utils.py (ndvi, evi, ...) are Earth Engine expressions, so adding
+or correcting an index means re-exporting the whole history. compute_indices evaluates
+the same formulas on stored reflectance bands (exported with config.S2_EXPORT_BANDS),
+so indices can be added or recomputed over the existing dataset without any EE request:
+
+    values = compute_indices({'B3': b3, 'B8': b8, 'B11': b11}, ['NDMI', 'MNDWI'])
+
+The evaluation is fused: the values are processed in blocks of BLOCK_SIZE, each input
+band is converted to float once per block into a reused buffer, and every requested index
+is computed straight into its output slice with two reused scratch buffers. Inputs are
+read once and each output written once, with no full-size temporaries, whatever the
+number of indices.
+
+Masked pixels are NaN, and so are indices whose denominator is 0.
+"""
+
+import numpy as np
+
+# Values per block; a block of every band and scratch buffer stays in the CPU cache
+BLOCK_SIZE = 1 << 14
+
+# Reflectance bands each index is computed from
+INDEX_BANDS = {
+    'NDVI': ('B8', 'B4'),
+    'EVI': ('B8', 'B4', 'B2'),
+    'GNDVI': ('B8', 'B3'),
+    'IRECI': ('B5', 'B4', 'B11'),
+    'NDMI': ('B8', 'B11'),
+    'MNDWI': ('B3', 'B11'),
+    'NDRE': ('B8', 'B5'),
+    'CIREDEDGE': ('B5', 'B11'),
+}
+
+
+def _normalized_difference(first, second):
+    """(first - second) / (first + second), as ee.Image.normalizedDifference."""
+    def kernel(bands, out, tmp, _):
+        np.subtract(bands[first], bands[second], out=out)
+        np.add(bands[first], bands[second], out=tmp)
+        np.divide(out, tmp, out=out)
+    return kernel
+
+
+def _evi(bands, out, tmp, tmp2):
+    """2.5 * (NIR - RED) / (NIR + 6 RED - 7.5 BLUE + 1) on reflectance (DN / 10000), as utils.evi."""
+    # The 1/10000 scaling cancels out except for the constant term
+    np.subtract(bands['B8'], bands['B4'], out=out)
+    np.multiply(bands['B4'], 6.0, out=tmp)
+    np.multiply(bands['B2'], 7.5, out=tmp2)
+    np.subtract(tmp, tmp2, out=tmp)
+    np.add(tmp, bands['B8'], out=tmp)
+    np.add(tmp, 10000.0, out=tmp)
+    np.divide(out, tmp, out=out)
+    np.multiply(out, 2.5, out=out)
+
+
+def _ireci(bands, out, tmp, _):
+    """(B5 - B4) / (B11 / B11), the expression of utils.ireci (B11 / B11 only masks B11 = 0)."""
+    np.subtract(bands['B5'], bands['B4'], out=out)
+    np.divide(bands['B11'], bands['B11'], out=tmp)
+    np.divide(out, tmp, out=out)
+
+
+def _cirededge(bands, out, _, __):
+    """B5 / B11 - 1, as utils.cirededge."""
+    np.divide(bands['B5'], bands['B11'], out=out)
+    np.subtract(out, 1.0, out=out)
+
+
+KERNELS = {
+    'NDVI': _normalized_difference('B8', 'B4'),
+    'EVI': _evi,
+    'GNDVI': _normalized_difference('B8', 'B3'),
+    'IRECI': _ireci,
+    'NDMI': _normalized_difference('B8', 'B11'),
+    'MNDWI': _normalized_difference('B3', 'B11'),
+    'NDRE': _normalized_difference('B8', 'B5'),
+    'CIREDEDGE': _cirededge,
+}
+
+
+def required_bands(indices):
+    """Bands needed to compute indices, in first-use order."""
+    unknown = [name for name in indices if name not in INDEX_BANDS]
+    if unknown:
+        raise ValueError(f"Unknown indices {unknown}, available: {list(INDEX_BANDS)}")
+    return list(dict.fromkeys(band for name in indices for band in INDEX_BANDS[name]))
+
+
+def compute_indices(bands, indices=None, dtype='float32', block_size=BLOCK_SIZE):
+    """
+    Computes several indices in one fused pass over the bands.
+
+    Args:
+        bands (dict): {band: array}, all of the same shape (any: pixels, time x y x x, ...),
+            NaN where masked. Bands not needed by indices are ignored.
+        indices (list): Names from INDEX_BANDS, all of them by default.
+        dtype (str): Output and working dtype.
+        block_size (int): Values per block.
+
+    Returns:
+        dict: {index: array of the input shape}
+    """
+    indices = list(indices or INDEX_BANDS)
+    needed = required_bands(indices)
+    missing = [band for band in needed if band not in bands]
+    if missing:
+        raise ValueError(f"Bands {missing} are needed for {indices}")
+
+    arrays = {band: np.asarray(bands[band]) for band in needed}
+    shape = arrays[needed[0]].shape
+    if any(array.shape != shape for array in arrays.values()):
+        raise ValueError(f"Bands have different shapes: { {b: a.shape for b, a in arrays.items()} }")
+
+    flat = {band: array.reshape(-1) for band, array in arrays.items()}
+    size = int(np.prod(shape))
+    out = {name: np.empty(size, dtype=dtype) for name in indices}
+
+    block_size = max(1, min(block_size, size))
+    buffers = {band: np.empty(block_size, dtype=dtype) for band in needed}
+    scratch = np.empty(block_size, dtype=dtype), np.empty(block_size, dtype=dtype)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        for start in range(0, size, block_size):
+            stop = min(start + block_size, size)
+            n = stop - start
+            block = {band: buffers[band][:n] for band in needed}
+            for band in needed:
+                block[band][...] = flat[band][start:stop]
+
+            tmp, tmp2 = scratch[0][:n], scratch[1][:n]
+            for name in indices:
+                result = out[name][start:stop]
+                KERNELS[name](block, result, tmp, tmp2)
+                # Infinite ratios (0 denominators) are invalid, as masked pixels
+                result[np.isinf(result)] = np.nan
+
+    return {name: values.reshape(shape) for name, values in out.items()}
+
+
+def add_indices(df, indices=None, dtype='float64'):
+    """
+    Computes indices from the band columns of a DataFrame and stores them as columns,
+    replacing existing ones.
+
+    Returns:
+        pd.DataFrame: df, modified in place.
+    """
+    indices = list(indices or INDEX_BANDS)
+    bands = {band: df[band].to_numpy() for band in required_bands(indices) if band in df.columns}
+    for name, values in compute_indices(bands, indices, dtype=dtype).items():
+        df[name] = values
+    return df
@@ -0,0 +1,216 @@
+"""
+Per-stage timing and resource spans for the pipeline.
+
+A trace collects the spans of one unit of work (a sensor-month job, the ingestion step).
+Code marks its stages with span(stage):
+
+    with span('download') as s:
+        ...
+        s['bytes'] = size
+
+Every span records its wall time, bytes transferred, rows, Earth Engine calls and the
+process peak RSS when it ends. Spans opened while no trace is active are measured and
+dropped, so instrumented functions behave the same when called outside the pipeline.
+
+Stages used across the pipeline:
+    ee_graph_build   building the (lazy) EE computation client-side
+    get_info         getInfo round-trips
+    export_url       getDownloadURL calls
+    download         HTTP downloads and computePixels requests
+    parse            reading raw CSV/npz files into pixel-id frames
+    merge            outer join of the sources
+    parquet_write    writing partition files
+
+The current trace lives in a context variable; work handed to a thread pool
+must be wrapped with bind() to be recorded in the caller's trace.
+"""
+
+import sys
+import time
+import threading
+import contextvars
+
+from contextlib import contextmanager
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Order of the stages in summaries
+STAGES = ['ee_graph_build', 'get_info', 'export_url', 'download', 'parse', 'merge', 'parquet_write']
+
+# Fields summed per stage in summaries
+COUNTERS = ['bytes', 'rows', 'ee_calls']
+
+_current_trace = contextvars.ContextVar('current_trace', default=None)
+
+# Set while a thread is profiled (modules/profiling.py): map_threads then runs inline
+_single_thread = contextvars.ContextVar('single_thread', default=False)
+
+
+def peak_rss_mb():
+    """Process high-water resident set size in MB (None where it cannot be read)."""
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Bytes on macOS, kilobytes elsewhere
+    return round(peak / 1024 ** 2 if sys.platform == 'darwin' else peak / 1024, 1)
+
+
+class Trace:
+    """Thread-safe list of the finished spans of one unit of work."""
+
+    def __init__(self, name):
+        self.name = name
+        self.started_at = datetime.now()
+        self.spans = []
+        self._started = time.perf_counter()
+        self._lock = threading.Lock()
+
+    def add(self, record):
+        with self._lock:
+            self.spans.append(record)
+
+    def summary(self):
+        """
+        Per-stage totals of the spans plus the trace wall time.
+
+        Nested spans are counted in their own stage only, but their wall time is also part
+        of the enclosing span.
+
+        Returns:
+            dict: {'name', 'started_at', 'wall_s', 'ee_calls', 'peak_rss_mb',
+                'stages': {stage: {'count', 'wall_s', 'bytes', 'rows', 'ee_calls'}}}
+        """
+        with self._lock:
+            spans = list(self.spans)
+
+        return summarize(spans, name=self.name, started_at=str(self.started_at),
+                         wall_s=round(time.perf_counter() - self._started, 3))
+
+    def to_dict(self):
+        """Summary plus the individual spans."""
+        with self._lock:
+            spans = list(self.spans)
+        return {**self.summary(), 'spans': spans}
+
+
+def summarize(spans, **fields):
+    """
+    Per-stage totals of a list of spans (see Trace.summary).
+
+    Stage totals of other summaries (records with a 'count') can be summed the same way.
+    Bytes and rows are only summed within a stage: a file is counted once when downloaded
+    and again when parsed, so a cross-stage total would mean nothing.
+    """
+    stages = {}
+    for record in spans:
+        totals = stages.setdefault(record['stage'], {'count': 0, 'wall_s': 0.0, **{c: 0 for c in COUNTERS}})
+        totals['count'] += record.get('count', 1)
+        totals['wall_s'] = round(totals['wall_s'] + record['wall_s'], 3)
+        for counter in COUNTERS:
+            totals[counter] += record.get(counter) or 0
+
+    ordered = {stage: stages[stage] for stage in STAGES if stage in stages}
+    ordered.update({stage: totals for stage, totals in stages.items() if stage not in ordered})
+
+    peaks = [record['peak_rss_mb'] for record in spans if record.get('peak_rss_mb') is not None]
+    return {
+        **fields,
+        'ee_calls': sum(totals['ee_calls'] for totals in ordered.values()),
+        'peak_rss_mb': max(peaks) if peaks else peak_rss_mb(),
+        'stages': ordered,
+    }
+
+
+@contextmanager
+def tracing(name):
+    """Makes a new Trace current for the enclosed block and yields it."""
+    trace = Trace(name)
+    token = _current_trace.set(trace)
+    try:
+        yield trace
+    finally:
+        _current_trace.reset(token)
+
+
+def current_trace():
+    """The active Trace, or None."""
+    return _current_trace.get()
+
+
+@contextmanager
+def span(stage, **fields):
+    """
+    Measures the enclosed block as one span of the current trace.
+
+    Args:
+        stage (str): Stage name (see STAGES).
+        **fields: Initial values, e.g. ee_calls=1 or a 'file' label.
+
+    Yields:
+        dict: The span record; set 'bytes'/'rows' (or any JSON value) on it inside the block.
+    """
+    record = {'stage': stage, 'wall_s': 0.0, 'bytes': 0, 'rows': 0, 'ee_calls': 0, **fields}
+    started = time.perf_counter()
+    try:
+        yield record
+    except BaseException:
+        record['status'] = 'failed'
+        raise
+    finally:
+        record['wall_s'] = round(time.perf_counter() - started, 4)
+        record['peak_rss_mb'] = peak_rss_mb()
+
+        trace = _current_trace.get()
+        if trace is not None:
+            trace.add(record)
+
+
+def attach_trace(metadata):
+    """Stores the summary and spans of the current trace in a metadata dict under 'timing'/'spans'."""
+    trace = _current_trace.get()
+    if trace is not None:
+        timing = trace.to_dict()
+        metadata['spans'] = timing.pop('spans')
+        metadata['timing'] = timing
+    return metadata
+
+
+def bind(fn):
+    """fn running in the trace of the caller, for use on worker threads."""
+    trace = _current_trace.get()
+
+    def bound(*args, **kwargs):
+        token = _current_trace.set(trace)
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            _current_trace.reset(token)
+
+    return bound
+
+
+@contextmanager
+def single_thread():
+    """Runs the map_threads calls made inside the block on the calling thread."""
+    token = _single_thread.set(True)
+    try:
+        yield
+    finally:
+        _single_thread.reset(token)
+
+
+def map_threads(fn, *iterables, max_workers=1):
+    """
+    list(map(fn, *iterables)) on max_workers threads, in the trace of the caller.
+
+    Inside single_thread(), or with max_workers <= 1, the calls run on the calling thread.
+    """
+    if max_workers <= 1 or _single_thread.get():
+        return list(map(bind(fn), *iterables))
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(bind(fn), *iterables))
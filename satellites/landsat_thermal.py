@@ -1,14 +1,36 @@
 import ee
-import os
-import json
 import config
-import requests
 
-from pathlib import Path
-from utils import create_conn_ee, generate_metadata
+from utils import create_conn_ee, generate_metadata, save_metadata, fetch_info
 from modules.satellites_data_extraction import get_landsat_thermal_data
+from modules.export_tiling import plan_export, export_features
+from modules.pixel_arrays import ARRAY_SUFFIX, export_arrays
+from modules.export_cache import cache_key, export_ttl, fetch_cached_export, store_export
+from modules.tracing import span
+from modules.parcels import extract_parcels
 
-def get_landsat(ROI=config.ROI_TEST, start_date=config.T1_START, end_date=config.T2_END, ROI_NAME="ROI_TEST"):
+# Columns of the CSV export
+SELECTORS = ['date', 'LST', '.geo']
+
+
+def process_thermal(image):
+    """LST in Celsius from ST_B10, with clouds and cloud shadows masked from QA_PIXEL."""
+    # ST_B10 is the thermal band in Landsat Collection 2 Level 2
+    # It's already in Kelvin, scaled by 0.00341802 + 149.0
+    lst_kelvin = image.select('ST_B10').multiply(0.00341802).add(149.0)
+    lst_celsius = lst_kelvin.subtract(273.15)
+
+    # Apply QA mask to remove clouds and cloud shadows
+    qa = image.select('QA_PIXEL')
+    # Bit 3: Cloud
+    # Bit 4: Cloud Shadow
+    cloud_mask = qa.bitwiseAnd(1 << 3).eq(0).And(qa.bitwiseAnd(1 << 4).eq(0))
+
+    return lst_celsius.updateMask(cloud_mask).rename('LST').copyProperties(image, ['system:time_start'])
+
+
+def get_landsat(ROI=config.ROI_TEST, start_date=config.T1_START, end_date=config.T2_END, ROI_NAME="ROI_TEST",
+                mode=config.EXTRACTION_MODE):
     """
     Extract Landsat 8/9 thermal data and convert to Land Surface Temperature (LST) in Celsius.
 
@@ -17,87 +39,113 @@ def get_landsat(ROI=config.ROI_TEST, start_date=config.T1_START, end_date=config
         start_date: Start date (YYYY-MM-DD)
         end_date: End date (YYYY-MM-DD)
         ROI_NAME: Name for organizing output files
+        mode: 'csv' (sampled features), 'array' (band stacks, see modules/pixel_arrays.py)
+            or 'aggregate' (ROI statistics per date, see get_landsat_parcels)
 
     Returns:
         None (saves data to files)
     """
-    create_conn_ee()
-    landsat_raw = get_landsat_thermal_data(ROI, start_date, end_date)
-
-    def process_thermal(image):
-        # ST_B10 is the thermal band in Landsat Collection 2 Level 2
-        # It's already in Kelvin, scaled by 0.00341802 + 149.0
-        lst_kelvin = image.select('ST_B10').multiply(0.00341802).add(149.0)
-        lst_celsius = lst_kelvin.subtract(273.15)
+    if mode == 'aggregate':
+        # The ROI is a single parcel named after it
+        return get_landsat_parcels({ROI_NAME: ROI}, start_date, end_date, GROUP_NAME=ROI_NAME, mode=mode)
+
+    selectors = SELECTORS
+    suffix = ARRAY_SUFFIX if mode == 'array' else '.csv'
+    output_file = f'raw_data/{ROI_NAME}/landsat_thermal/{start_date.date()}_{end_date.date()}{suffix}'
+
+    # Repeated exports with identical parameters are served from the local cache
+    export_key = cache_key('landsat', ROI, start_date, end_date, selectors,
+                           cloud_thresh=config.CLOUD_THRESH_LANDSAT, scale=config.SAMPLING_SCALE, mode=mode)
+    cached = fetch_cached_export(export_key, output_file, ttl=export_ttl(end_date))
+    if cached is not None:
+        print(f"Served from export cache: {output_file}")
+        metadata = generate_metadata("LANDSAT" ,"LANDSAT/LC08/C02/T1_L2, LANDSAT/LC09/C02/T1_L2", cached.get('image_count'), start_date, end_date, selectors, ROI, config.runid, 'success')
+        metadata['cache_key'] = export_key
+        save_metadata(metadata, ROI_NAME, 'landsat', start_date, end_date)
+        return
 
-        # Apply QA mask to remove clouds and cloud shadows
-        qa = image.select('QA_PIXEL')
-        # Bit 3: Cloud
-        # Bit 4: Cloud Shadow
-        cloud_mask = qa.bitwiseAnd(1 << 3).eq(0).And(qa.bitwiseAnd(1 << 4).eq(0))
+    create_conn_ee()
+    with span('ee_graph_build'):
+        landsat_raw = get_landsat_thermal_data(ROI, start_date, end_date)
 
-        return lst_celsius.updateMask(cloud_mask).rename('LST').copyProperties(image, ['system:time_start'])
+    # Single round-trip for the client-side values; skip the export when there is nothing to sample
+    image_count = fetch_info({'image_count': landsat_raw.size()})['image_count']
+    if image_count == 0:
+        print(f"No Landsat images for {start_date} to {end_date}")
+        metadata = generate_metadata("LANDSAT" ,"LANDSAT/LC08/C02/T1_L2, LANDSAT/LC09/C02/T1_L2", 0, start_date, end_date, selectors, ROI, config.runid, 'empty')
+        save_metadata(metadata, ROI_NAME, 'landsat', start_date, end_date)
+        return
 
     # Process all images
-    landsat_processed = landsat_raw.map(process_thermal)
-
-    def sample_pixel(img):
-        img = img.set('date_str', img.date().format('YYYY-MM-dd'))
-        # Select band and sample
-        return img.select(['LST']).sample(
-            region=ee.Geometry.Polygon(ROI) if isinstance(ROI, list) else ROI,
-            scale=config.SAMPLING_SCALE,
-            geometries=True,
-        ).map(lambda feat: feat.set('date', img.get('date_str')))
-
-    # Flatten collection to features
-    features = landsat_processed.map(sample_pixel).flatten()
-
+    with span('ee_graph_build'):
+        landsat_processed = landsat_raw.map(process_thermal)
+
+    def make_sample_pixel(region):
+        def sample_pixel(img):
+            img = img.set('date_str', img.date().format('YYYY-MM-dd'))
+            # Select band and sample
+            return img.select(['LST']).sample(
+                region=region,
+                scale=config.SAMPLING_SCALE,
+                geometries=True,
+            ).map(lambda feat: feat.set('date', img.get('date_str')))
+        return sample_pixel
+
+    roi_geometry = ee.Geometry.Polygon(ROI) if isinstance(ROI, list) else ROI
+
+    def build_features(tile=None, start=None, end=None):
+        """Flattened features of one export part (spatial tile and/or date window, None = all)."""
+        collection = landsat_processed if start is None else landsat_processed.filterDate(start, end)
+        region = roi_geometry if tile is None else roi_geometry.intersection(ee.Geometry.Rectangle(tile), maxError=1)
+        return collection.map(make_sample_pixel(region)).flatten()
+
+    status = 'failed'
+    download = None
+    error = None
     try:
-        # Define columns to export
-        selectors = ['date', 'LST', '.geo']
-
-        url = features.getDownloadURL(
-            filetype='CSV',
-            selectors=selectors,
-            filename='landsat_thermal_data'
-        )
-
         print(f"Downloading Landsat thermal data for {start_date} to {end_date}...")
-        response = requests.get(url)
-
-        # Create directory if it doesn't exist
-        output_dir = f'raw_data/{ROI_NAME}/landsat_thermal'
-        os.makedirs(output_dir, exist_ok=True)
-
-        output_file = f'{output_dir}/{start_date.date()}_{end_date.date()}.csv'
-        with open(output_file, 'wb') as f:
-            f.write(response.content)
+        if mode == 'array':
+            download = export_arrays(landsat_processed, ['LST'], ROI, output_file)
+        else:
+            # Large exports are split into date windows/tiles and stitched
+            plan = plan_export(ROI, start_date, end_date, image_count)
+            download = export_features(build_features, plan, selectors, output_file, 'landsat_thermal_data')
+        store_export(export_key, output_file, {'image_count': image_count})
 
         print(f"Saved to {output_file}")
+        status = 'success'
 
     except Exception as e:
         print(f"Error generating URL or downloading: {e}")
+        error = e
 
     # Metadata generation
-    metadata = generate_metadata(
-        "Landsat 8/9 Thermal",
-        "LANDSAT/LC08-09/C02/T1_L2",
-        landsat_raw.size().getInfo(),
-        start_date,
-        end_date,
-        selectors,
-        ROI,
-        config.runid
-    )
-
-    metadata = generate_metadata("LANDSAT" ,"LANDSAT/LC08/C02/T1_L2, LANDSAT/LC09/C02/T1_L2", landsat_raw.size().getInfo(), start_date, end_date, ['date', 'LST', '.geo'], ROI, config.runid)
-    metadata_filename = f'{ROI_NAME}/landsat/{config.runid}_{start_date.date()}_{end_date.date()}.json'
-    metadata_path = Path(f"{config.metadata_path}{metadata_filename}")
-    metadata_path.parent.mkdir(parents=True, exist_ok=True)
-    metadata_path.touch(exist_ok=True)
-
-    with open(metadata_path, 'w') as f:
-        json.dump(metadata, f, indent=4)
+    metadata = generate_metadata("LANDSAT" ,"LANDSAT/LC08/C02/T1_L2, LANDSAT/LC09/C02/T1_L2", image_count, start_date, end_date, selectors, ROI, config.runid, status)
+    metadata['download'] = download
+    metadata['cache_key'] = export_key
+    save_metadata(metadata, ROI_NAME, 'landsat', start_date, end_date)
+
+    # The failure is recorded in the metadata, and reported to the scheduler as well
+    if error is not None:
+        raise error
 
     return
+
+
+def get_landsat_parcels(parcels, start_date=config.T1_START, end_date=config.T2_END, GROUP_NAME=config.PARCELS_GROUP,
+                        mode='csv'):
+    """
+    Landsat 8/9 LST of many parcels with one collection and one export per sensor-month
+    (see modules/parcels.py).
+
+    Args:
+        parcels (dict): {parcel_id: coords}, see modules.parcels.load_parcels.
+        GROUP_NAME (str): Folder of the parcel group under raw_data and metadata.
+        mode (str): 'csv' (pixel samples) or 'aggregate' (per-parcel statistics).
+    """
+    def build_collection(ROI, start, end):
+        return get_landsat_thermal_data(ROI, start, end).map(process_thermal)
+
+    extract_parcels('landsat', build_collection, ['LST'], parcels, start_date, end_date, GROUP_NAME,
+                    "LANDSAT", "LANDSAT/LC08/C02/T1_L2, LANDSAT/LC09/C02/T1_L2", mode=mode,
+                    cloud_thresh=config.CLOUD_THRESH_LANDSAT)
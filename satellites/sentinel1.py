@@ -1,61 +1,147 @@
 import ee
-import os
-import json
 import config
-import requests
 
-from pathlib import Path
-from utils import create_conn_ee, despeckle, indicesst1, generate_metadata
+from utils import create_conn_ee, despeckle, indicesst1, generate_metadata, save_metadata, fetch_info
 from modules.satellites_data_extraction import get_sentinel1_data
+from modules.export_tiling import plan_export, export_features
+from modules.pixel_arrays import ARRAY_SUFFIX, export_arrays
+from modules.export_cache import cache_key, export_ttl, fetch_cached_export, store_export
+from modules.tracing import span
+from modules.parcels import extract_parcels
+from modules.speckle import POLARIZATIONS
 
-def get_st1(ROI=config.ROI_TEST, start_date=config.T1_START, end_date=config.T2_END, ROI_NAME="ROI_TEST"):
+# Backscatter bands sampled per pixel
+BANDS = ['VV', 'VH', 'RATIOVHVV']
+
+# Columns of the CSV export
+SELECTORS = ['date', *BANDS, '.geo']
+
+
+def local_despeckle():
+    """True when the speckle filter runs at ingestion (config.S1_DESPECKLE = 'local')."""
+    return config.S1_DESPECKLE == 'local'
+
+
+def export_bands():
+    """Bands sampled per pixel: BANDS, or the unfiltered POLARIZATIONS with the local filter."""
+    return POLARIZATIONS if local_despeckle() else BANDS
+
+
+def export_selectors():
+    """Columns of the CSV export for export_bands()."""
+    return ['date', *export_bands(), '.geo']
+
+
+def build_st1(collection, local=False):
+    """Despeckled collection with RATIOVHVV, or the unfiltered one for the local filter."""
+    if local:
+        return collection
+    return collection.map(despeckle).map(indicesst1)
+
+def get_st1(ROI=config.ROI_TEST, start_date=config.T1_START, end_date=config.T2_END, ROI_NAME="ROI_TEST",
+            mode=config.EXTRACTION_MODE):
+
+    if mode == 'aggregate':
+        # The ROI is a single parcel named after it, see get_st1_parcels
+        return get_st1_parcels({ROI_NAME: ROI}, start_date, end_date, GROUP_NAME=ROI_NAME, mode=mode)
+
+    selectors = export_selectors()
+    bands = export_bands()
+    suffix = ARRAY_SUFFIX if mode == 'array' else '.csv'
+    output_file = f'raw_data/{ROI_NAME}/sentinel_1/{start_date.date()}_{end_date.date()}{suffix}'
+
+    # Repeated exports with identical parameters are served from the local cache
+    export_key = cache_key('sentinel_1', ROI, start_date, end_date, selectors, scale=config.SAMPLING_SCALE, mode=mode,
+                           despeckle=config.S1_DESPECKLE)
+    cached = fetch_cached_export(export_key, output_file, ttl=export_ttl(end_date))
+    if cached is not None:
+        print(f"Served from export cache: {output_file}")
+        metadata = generate_metadata("Sentinel-1", "COPERNICUS/S1_GRD", cached.get('image_count'), start_date, end_date, selectors, ROI, config.runid, 'success')
+        metadata['cache_key'] = export_key
+        save_metadata(metadata, ROI_NAME, 'sentinel_1', start_date, end_date)
+        return
 
     create_conn_ee()
-    st1_raw = get_sentinel1_data(ROI, start_date, end_date)
-    st1 = st1_raw.map(despeckle)
-    st1 = st1_raw.map(indicesst1)
-
-    def sample_pixel(img):
-        img = img.set('date_str', img.date().format('YYYY-MM-dd'))
-        # Seleciona banda e amostra
-        return img.select(['VV', 'VH', 'RATIOVHVV']).sample(
-            region=ee.Geometry.Polygon(ROI),
-            scale=config.SAMPLING_SCALE,
-            geometries=True, # Mantém a geometria
-        ).map(lambda feat: feat.set('date', img.get('date_str'))) # Passa a data da imagem para cada ponto
-
-    # Transforma a coleção de imagens em uma coleção de pontos (FeatureCollection)
-    features = st1.map(sample_pixel).flatten()
+    with span('ee_graph_build'):
+        st1_raw = get_sentinel1_data(ROI, start_date, end_date)
+        st1 = build_st1(st1_raw, local=local_despeckle())
 
-    try:
-        # 2. Solicitar a URL de download (formato CSV ou GeoJSON)
-        url = features.getDownloadURL(
-                filetype='CSV',
-                selectors=['date', 'VV', 'VH', 'RATIOVHVV', '.geo'],  # '.geo' traz a geometria em formato WKT
-                filename='sentinel_data'
-            )
+    # Single round-trip for the client-side values; skip the export when there is nothing to sample
+    image_count = fetch_info({'image_count': st1_raw.size()})['image_count']
+    if image_count == 0:
+        print(f"No Sentinel-1 images for {start_date} to {end_date}")
+        metadata = generate_metadata("Sentinel-1", "COPERNICUS/S1_GRD", 0, start_date, end_date, selectors, ROI, config.runid, 'empty')
+        save_metadata(metadata, ROI_NAME, 'sentinel_1', start_date, end_date)
+        return
 
-        response = requests.get(url)
+    def make_sample_pixel(region):
+        def sample_pixel(img):
+            img = img.set('date_str', img.date().format('YYYY-MM-dd'))
+            # Seleciona banda e amostra
+            return img.select(bands).sample(
+                region=region,
+                scale=config.SAMPLING_SCALE,
+                geometries=True, # Mantém a geometria
+            ).map(lambda feat: feat.set('date', img.get('date_str'))) # Passa a data da imagem para cada ponto
+        return sample_pixel
 
-        output_dir = f'raw_data/{ROI_NAME}/sentinel_1'
-        os.makedirs(output_dir, exist_ok=True)
-        output_file = f'{output_dir}/{start_date.date()}_{end_date.date()}.csv'
-        with open(output_file, 'wb') as f:
-            f.write(response.content)
+    # Transforma a coleção de imagens em uma coleção de pontos (FeatureCollection), por parte do export
+    roi_geometry = ee.Geometry.Polygon(ROI)
+
+    def build_features(tile=None, start=None, end=None):
+        collection = st1 if start is None else st1.filterDate(start, end)
+        region = roi_geometry if tile is None else roi_geometry.intersection(ee.Geometry.Rectangle(tile), maxError=1)
+        return collection.map(make_sample_pixel(region)).flatten()
+
+    status = 'failed'
+    download = None
+    error = None
+    try:
+        if mode == 'array':
+            # Pilhas densas de bandas sobre o bbox da ROI, sem uma geometria por pixel
+            download = export_arrays(st1, bands, ROI, output_file)
+        else:
+            # Exports grandes são divididos em janelas de datas/tiles e depois unidos
+            plan = plan_export(ROI, start_date, end_date, image_count)
+            # 2. Solicitar a URL de download (CSV, '.geo' traz a geometria) e baixar
+            download = export_features(build_features, plan, selectors, output_file, 'sentinel_data')
+        store_export(export_key, output_file, {'image_count': image_count})
+        status = 'success'
 
     except Exception as e:
         print(f"Erro ao gerar URL: {e}")
+        error = e
 
-    metadata = generate_metadata("Sentinel-1", "COPERNICUS/S1_GRD", st1_raw.size().getInfo(), start_date, end_date, ['date', 'VV', 'VH', 'RATIOVHVV', '.geo'], ROI, config.runid)
-    metadata_filename = f'{ROI_NAME}/sentinel_1/{config.runid}_{start_date.date()}_{end_date.date()}.json'
-    metadata_path = Path(f"{config.metadata_path}{metadata_filename}")
-    metadata_path.parent.mkdir(parents=True, exist_ok=True)
-    metadata_path.touch(exist_ok=True)
+    metadata = generate_metadata("Sentinel-1", "COPERNICUS/S1_GRD", image_count, start_date, end_date, selectors, ROI, config.runid, status)
+    metadata['download'] = download
+    metadata['cache_key'] = export_key
+    save_metadata(metadata, ROI_NAME, 'sentinel_1', start_date, end_date)
 
-
-    with open(metadata_path, 'w') as f:
-        json.dump(metadata, f, indent=4)
+    # The failure is recorded in the metadata, and reported to the scheduler as well
+    if error is not None:
+        raise error
 
 
     return
 
+
+def get_st1_parcels(parcels, start_date=config.T1_START, end_date=config.T2_END, GROUP_NAME=config.PARCELS_GROUP,
+                    mode='csv'):
+    """
+    Sentinel-1 backscatter of many parcels with one collection and one export per
+    sensor-month (see modules/parcels.py).
+
+    Args:
+        parcels (dict): {parcel_id: coords}, see modules.parcels.load_parcels.
+        GROUP_NAME (str): Folder of the parcel group under raw_data and metadata.
+        mode (str): 'csv' (pixel samples) or 'aggregate' (per-parcel statistics).
+    """
+    # Aggregates are reduced server side, from the despeckled collection
+    local = local_despeckle() and mode != 'aggregate'
+
+    def build_collection(ROI, start, end):
+        return build_st1(get_sentinel1_data(ROI, start, end), local=local)
+
+    extract_parcels('sentinel_1', build_collection, POLARIZATIONS if local else BANDS, parcels, start_date, end_date,
+                    GROUP_NAME, "Sentinel-1", "COPERNICUS/S1_GRD", mode=mode,
+                    despeckle='local' if local else 'server')
@@ -1,20 +1,89 @@
 import ee
-import os
-import json
 import config
-import requests
 
-from pathlib import Path
-from modules.satellites_data_extraction import get_sentinel2_data
-from utils import create_conn_ee, indicesanddate, generate_metadata
+from modules.satellites_data_extraction import get_sentinel2_data, apply_s2_masks
+from modules.cloud_mask import QA_BANDS, SHADOW_BANDS
+from modules.export_tiling import plan_export, export_features
+from modules.pixel_arrays import ARRAY_SUFFIX, export_arrays
+from modules.export_cache import cache_key, export_ttl, fetch_cached_export, store_export
+from modules.tracing import span
+from modules.parcels import extract_parcels
+from utils import create_conn_ee, indicesanddate, generate_metadata, save_metadata, fetch_info
 from modules.s2cleaning import get_adaptive_core, extract_parcel_stats, validate_parcel_observation
 
+# Spectral indices sampled per pixel
+# Note: exports made before MNDWI got its own band hold MNDWI in NDRE, see utils.correct_legacy_ndre
+INDICES = ['NDVI', 'EVI', 'GNDVI', 'IRECI', 'NDMI', 'MNDWI', 'NDRE']
 
-def get_st2(ROI=config.ROI_TEST, start_date=config.T1_START, end_date=config.T2_END, use_erosion=True, ROI_NAME="ROI_TEST"):
+# Reflectance bands exported with the indices when config.S2_EXPORT_BANDS is set
+RAW_BANDS = ['B2', 'B3', 'B4', 'B5', 'B8', 'B11']
+
+# Columns of the CSV export (indices plus per-observation QA)
+SELECTORS = [
+    'date',
+    'NDVI', 'EVI', 'GNDVI', 'IRECI', 'NDMI', 'MNDWI', 'NDRE',
+    'valid_pixels', 'total_pixels', 'coverage_ratio',
+    'observation_valid', 'erosion_m', 'is_small_parcel',
+    '.geo'
+]
+
+
+def local_mask():
+    """True when the cloud mask is applied at ingestion (config.S2_CLOUD_MASK = 'local')."""
+    return config.S2_CLOUD_MASK == 'local'
+
+
+def extra_bands():
+    """RAW_BANDS with config.S2_EXPORT_BANDS, QA_BANDS and SHADOW_BANDS with the local cloud mask."""
+    bands = (RAW_BANDS if config.S2_EXPORT_BANDS else []) + (QA_BANDS + SHADOW_BANDS if local_mask() else [])
+    return list(dict.fromkeys(bands))
+
+
+def export_bands():
+    """Bands sampled per pixel: the indices plus extra_bands()."""
+    return INDICES + extra_bands()
+
+
+def export_selectors():
+    """Columns of the CSV export, SELECTORS plus extra_bands()."""
+    return [*SELECTORS[:-1], *extra_bands(), '.geo']
+
+
+def mask_setting():
+    """Cloud mask part of the export cache key: the server rules, or 'local' (unmasked export)."""
+    return 'local' if local_mask() else config.CLOUD_MASK_RULES
+
+
+def get_st2(ROI=config.ROI_TEST, start_date=config.T1_START, end_date=config.T2_END, use_erosion=True, ROI_NAME="ROI_TEST",
+            mode=config.EXTRACTION_MODE):
+
+    if mode == 'aggregate':
+        # The ROI is a single parcel named after it, see get_st2_parcels
+        return get_st2_parcels({ROI_NAME: ROI}, start_date, end_date, GROUP_NAME=ROI_NAME, mode=mode,
+                               use_erosion=use_erosion)
+
+    selectors = export_selectors()
+    bands = export_bands()
+    suffix = ARRAY_SUFFIX if mode == 'array' else '.csv'
+    output_file = f'raw_data/{ROI_NAME}/sentinel_2/{start_date.date()}_{end_date.date()}{suffix}'
+
+    # Repeated exports with identical parameters are served from the local cache
+    export_key = cache_key('sentinel_2', ROI, start_date, end_date, selectors,
+                           cloud_thresh=config.CLOUD_THRESH, scale=config.SAMPLING_SCALE, use_erosion=use_erosion, mode=mode,
+                           cloud_mask=mask_setting())
+    cached = fetch_cached_export(export_key, output_file, ttl=export_ttl(end_date))
+    if cached is not None:
+        print(f"   Served from export cache: {output_file}")
+        metadata = generate_metadata("Sentinel-2", "COPERNICUS/S2_SR_HARMONIZED", cached.get('image_count'), start_date, end_date, selectors, ROI, config.runid, 'success')
+        metadata['cache_key'] = export_key
+        save_metadata(metadata, ROI_NAME, 'sentinel_2', start_date, end_date)
+        return
 
     create_conn_ee()
-    st2_raw = get_sentinel2_data(ROI, start_date, end_date)
-    st2 = st2_raw.map(indicesanddate)
+    with span('ee_graph_build'):
+        # With the local cloud mask the pixels are exported unmasked with their QA bands
+        st2_raw = get_sentinel2_data(ROI, start_date, end_date, apply_mask=not local_mask())
+        st2 = st2_raw.map(indicesanddate)
 
     # def sample_pixel(img):
     #     img = img.set('date_str', img.date().format('YYYY-MM-dd'))
@@ -39,30 +108,45 @@ def get_st2(ROI=config.ROI_TEST, start_date=config.T1_START, end_date=config.T2_
     #     response = requests.get(url)
 
 
-    count = st2.size().getInfo()
+    # Every client-side scalar (image count, erosion outcome, areas) in one round-trip
+    with span('ee_graph_build'):
+        roi_geometry = ee.Geometry.Polygon(ROI) if isinstance(ROI, list) else ROI
+        info_request = {'count': st2.size()}
+        if use_erosion:
+            core_result = get_adaptive_core(ROI, sampling_scale=config.SAMPLING_SCALE)
+            info_request.update({
+                'erosion_applied': core_result['erosion_applied'],
+                'is_small': core_result['is_small_parcel'],
+                'original_area': roi_geometry.area(),
+                'core_area': core_result['core_geometry'].area(),
+            })
+    info = fetch_info(info_request)
+
+    count = info['count']
     print(f"   Found {count} clean images")
 
     if count == 0:
         print("   No images found. Exiting.")
+        metadata = generate_metadata("Sentinel-2", "COPERNICUS/S2_SR_HARMONIZED", 0, start_date, end_date, [], ROI, config.runid, 'empty')
+        save_metadata(metadata, ROI_NAME, 'sentinel_2', start_date, end_date)
         return None
 
     # Step 2: Apply adaptive erosion (if enabled)
     if use_erosion:
         print("\n2. Applying adaptive parcel erosion...")
-        core_result = get_adaptive_core(ROI, sampling_scale=config.SAMPLING_SCALE)
         roi_to_use = core_result['core_geometry']
-        erosion_applied = core_result['erosion_applied'].getInfo()
-        is_small = core_result['is_small_parcel'].getInfo()
+        erosion_applied = info['erosion_applied']
+        is_small = info['is_small']
 
-        original_area = ee.Geometry.Polygon(ROI).area().getInfo() if isinstance(ROI, list) else ROI.area().getInfo()
-        core_area = roi_to_use.area().getInfo()
+        original_area = info['original_area']
+        core_area = info['core_area']
 
         print(f"   Original area: {original_area:.0f} m²")
         print(f"   Core area: {core_area:.0f} m² ({((original_area - core_area) / original_area * 100):.1f}% reduction)")
         print(f"   Erosion applied: {erosion_applied}m")
         print(f"   Small parcel: {bool(is_small)}")
     else:
-        roi_to_use = ee.Geometry.Polygon(ROI) if isinstance(ROI, list) else ROI
+        roi_to_use = roi_geometry
         erosion_applied = 0
         is_small = 0
         print("\n2. Erosion disabled, using full ROI")
@@ -70,84 +154,112 @@ def get_st2(ROI=config.ROI_TEST, start_date=config.T1_START, end_date=config.T2_
     # Step 3: Extract data with QA metadata
     print("\n3. Extracting pixel data with QA metadata...")
 
-    def sample_with_qa(img):
-        """Sample pixels and add QA metadata per image."""
-        img = img.set('date_str', img.date().format('YYYY-MM-dd'))
-
-        # Extract statistics for QA
-        stats = extract_parcel_stats(img, roi_to_use, sampling_scale=config.SAMPLING_SCALE)
-
-        # Validate observation
-        is_valid = validate_parcel_observation(stats, is_small_parcel=is_small)
-
-        # Get QA values
-        valid_count = stats.get('valid_pixel_count')
-        total_count = stats.get('total_pixel_count')
-        coverage = stats.get('coverage_ratio')
-
-        # Sample pixels
-        # Note: MNDWI is not available (bug in utils.py - mndwi function calculates NDRE instead)
-        indices = ['NDVI', 'EVI', 'GNDVI', 'IRECI', 'NDMI', 'NDRE']
-        sampled = img.select(indices).sample(
-            region=roi_to_use,
-            scale=config.SAMPLING_SCALE,
-            geometries=True
-        )
-
-        # Add metadata to each feature
-        def add_metadata(feat):
-            return feat.set({
-                'date': img.get('date_str'),
-                'valid_pixels': valid_count,
-                'total_pixels': total_count,
-                'coverage_ratio': coverage,
-                'observation_valid': is_valid,
-                'erosion_m': erosion_applied,
-                'is_small_parcel': is_small
-            })
-
-        return sampled.map(add_metadata)
-
-    # Process all images
-    features = st2.map(sample_with_qa).flatten()
-
-    # Get download URL
-    print("\n4. Generating download URL...")
-    selectors = [
-        'date',
-        'NDVI', 'EVI', 'GNDVI', 'IRECI', 'NDMI', 'NDRE',
-        'valid_pixels', 'total_pixels', 'coverage_ratio',
-        'observation_valid', 'erosion_m', 'is_small_parcel',
-        '.geo'
-    ]
-
+    def make_sample_with_qa(sample_region):
+        """Sampler for one export part: QA stats cover the whole core, sampling only sample_region."""
+        def sample_with_qa(img):
+            """Sample pixels and add QA metadata per image."""
+            img = img.set('date_str', img.date().format('YYYY-MM-dd'))
+
+            # Extract statistics for QA (on the masked image, whatever mask the export uses)
+            masked = apply_s2_masks(img) if local_mask() else img
+            stats = extract_parcel_stats(masked, roi_to_use, sampling_scale=config.SAMPLING_SCALE)
+
+            # Validate observation
+            is_valid = validate_parcel_observation(stats, is_small_parcel=is_small)
+
+            # Get QA values
+            valid_count = stats.get('valid_pixel_count')
+            total_count = stats.get('total_pixel_count')
+            coverage = stats.get('coverage_ratio')
+
+            # Sample pixels
+            sampled = img.select(bands).sample(
+                region=sample_region,
+                scale=config.SAMPLING_SCALE,
+                geometries=True
+            )
+
+            # Add metadata to each feature
+            def add_metadata(feat):
+                return feat.set({
+                    'date': img.get('date_str'),
+                    'valid_pixels': valid_count,
+                    'total_pixels': total_count,
+                    'coverage_ratio': coverage,
+                    'observation_valid': is_valid,
+                    'erosion_m': erosion_applied,
+                    'is_small_parcel': is_small
+                })
+
+            return sampled.map(add_metadata)
+        return sample_with_qa
+
+    def build_features(tile=None, start=None, end=None):
+        """FeatureCollection of one export part (spatial tile and/or date window, None = all)."""
+        collection = st2 if start is None else st2.filterDate(start, end)
+        region = roi_to_use if tile is None else roi_to_use.intersection(ee.Geometry.Rectangle(tile), maxError=1)
+        return collection.map(make_sample_with_qa(region)).flatten()
+
+    status = 'failed'
+    download = None
+    error = None
     try:
-        url = features.getDownloadURL(
-            filetype='CSV',
-            selectors=selectors,
-            filename='sentinel2_polibio'
-        )
-
-        print("   Downloading data...")
-        response = requests.get(url)
-
-        output_dir = f'raw_data/{ROI_NAME}/sentinel_2'
-        os.makedirs(output_dir, exist_ok=True)
-        output_file = f'{output_dir}/{start_date.date()}_{end_date.date()}.csv'
-        with open(output_file, 'wb') as f:
-            f.write(response.content)
+        if mode == 'array':
+            # Dense index stacks clipped to the (eroded) core; the per-image QA columns are
+            # not part of the array export
+            print("\n4. Fetching index arrays...")
+            download = export_arrays(st2.map(lambda img: img.clip(roi_to_use)), bands, ROI, output_file)
+        else:
+            # Get download URL (large exports are split into date windows/tiles and stitched)
+            print("\n4. Generating download URL...")
+            plan = plan_export(ROI, start_date, end_date, count)
+
+            print("   Downloading data...")
+            download = export_features(build_features, plan, selectors, output_file, 'sentinel2_polibio')
+        store_export(export_key, output_file, {'image_count': count})
+        status = 'success'
 
     except Exception as e:
         print(f"Erro ao gerar URL: {e}")
-
-    metadata = generate_metadata("Sentinel-2", "COPERNICUS/S2_SR_HARMONIZED", st2.size().getInfo(), start_date, end_date, selectors, ROI, config.runid)
-    metadata_filename = f'{ROI_NAME}/sentinel_2/{config.runid}_{start_date.date()}_{end_date.date()}.json'
-    metadata_path = Path(f"{config.metadata_path}{metadata_filename}")
-    metadata_path.parent.mkdir(parents=True, exist_ok=True)
-    metadata_path.touch(exist_ok=True)
-
-
-    with open(metadata_path, 'w') as f:
-        json.dump(metadata, f, indent=4)
-
-    return
\ No newline at end of file
+        error = e
+
+    metadata = generate_metadata("Sentinel-2", "COPERNICUS/S2_SR_HARMONIZED", count, start_date, end_date, selectors, ROI, config.runid, status)
+    metadata['download'] = download
+    metadata['cache_key'] = export_key
+    save_metadata(metadata, ROI_NAME, 'sentinel_2', start_date, end_date)
+
+    # The failure is recorded in the metadata, and reported to the scheduler as well
+    if error is not None:
+        raise error
+
+    return
+
+
+def get_st2_parcels(parcels, start_date=config.T1_START, end_date=config.T2_END, GROUP_NAME=config.PARCELS_GROUP,
+                    mode='csv', use_erosion=True):
+    """
+    Sentinel-2 indices of many parcels with one masked collection and one export per
+    sensor-month (see modules/parcels.py).
+
+    Pixel exports (mode='csv') sample the full parcel polygons, without the adaptive
+    erosion and the per-observation QA columns of get_st2. Aggregate exports
+    (mode='aggregate') reduce each parcel's eroded core and carry the QA columns.
+
+    Args:
+        parcels (dict): {parcel_id: coords}, see modules.parcels.load_parcels.
+        GROUP_NAME (str): Folder of the parcel group under raw_data and metadata.
+        mode (str): 'csv' or 'aggregate'.
+        use_erosion (bool): Erode the parcels in aggregate mode.
+    """
+    # Aggregates are reduced per index, the reflectance and QA bands are only exported per pixel
+    aggregate = mode == 'aggregate'
+    local = local_mask() and not aggregate
+
+    def build_collection(ROI, start, end):
+        return get_sentinel2_data(ROI, start, end, apply_mask=not local).map(indicesanddate)
+
+    bands = INDICES if aggregate else export_bands()
+    extract_parcels('sentinel_2', build_collection, bands, parcels, start_date, end_date, GROUP_NAME,
+                    "Sentinel-2", "COPERNICUS/S2_SR_HARMONIZED", mode=mode,
+                    use_erosion=use_erosion and aggregate, cloud_thresh=config.CLOUD_THRESH,
+                    cloud_mask='local' if local else config.CLOUD_MASK_RULES)
@@ -2,9 +2,14 @@ import ee
 import os
 import json
 import config
-import requests
 from utils import create_conn_ee, generate_metadata
 from modules.satellites_data_extraction import get_srtm_data
+from modules.downloader import download_file
+from modules.export_cache import cache_key, fetch_cached_export, store_export
+from modules.tracing import span, attach_trace
+
+# Columns of the CSV export
+SELECTORS = ['elevation', 'slope', 'aspect', '.geo']
 
 def get_srtm(ROI=config.ROI_TEST, ROI_NAME="ROI_TEST"):
     """
@@ -17,48 +22,53 @@ def get_srtm(ROI=config.ROI_TEST, ROI_NAME="ROI_TEST"):
     Returns:
         None (saves data to files)
     """
-    create_conn_ee()
-    srtm = get_srtm_data(ROI)
+    selectors = SELECTORS
+    output_file = f'raw_data/{ROI_NAME}/srtm/srtm_data.csv'
 
-    # Compute terrain derivatives
-    elevation = srtm.select('elevation')
-    slope = ee.Terrain.slope(elevation).rename('slope')
-    aspect = ee.Terrain.aspect(elevation).rename('aspect')
+    # Terrain never changes: a cached export for the same ROI is reused without expiry
+    export_key = cache_key('srtm', ROI, 'static', 'static', selectors, scale=config.SAMPLING_SCALE)
+    cached = fetch_cached_export(export_key, output_file)
+    if cached is not None:
+        print(f"Served from export cache: {output_file}")
+        return
 
-    # Combine all bands
-    terrain = elevation.addBands([slope, aspect])
+    create_conn_ee()
+    with span('ee_graph_build'):
+        srtm = get_srtm_data(ROI)
 
-    # Sample pixels from the terrain image
-    roi_geometry = ee.Geometry.Polygon(ROI) if isinstance(ROI, list) else ROI
+        # Compute terrain derivatives
+        elevation = srtm.select('elevation')
+        slope = ee.Terrain.slope(elevation).rename('slope')
+        aspect = ee.Terrain.aspect(elevation).rename('aspect')
 
-    sampled = terrain.sample(
-        region=roi_geometry,
-        scale=config.SAMPLING_SCALE,
-        geometries=True
-    )
+        # Combine all bands
+        terrain = elevation.addBands([slope, aspect])
 
-    try:
-        # Define columns to export
-        selectors = ['elevation', 'slope', 'aspect', '.geo']
+        # Sample pixels from the terrain image
+        roi_geometry = ee.Geometry.Polygon(ROI) if isinstance(ROI, list) else ROI
 
-        url = sampled.getDownloadURL(
-            filetype='CSV',
-            selectors=selectors,
-            filename='srtm_data'
+        sampled = terrain.sample(
+            region=roi_geometry,
+            scale=config.SAMPLING_SCALE,
+            geometries=True
         )
 
-        print(f"Downloading SRTM data for {ROI_NAME}...")
-        response = requests.get(url)
-
-        # Create directory if it doesn't exist
-        output_dir = f'raw_data/{ROI_NAME}/srtm'
-        os.makedirs(output_dir, exist_ok=True)
+    status = 'failed'
+    download = None
+    try:
+        with span('export_url', ee_calls=1):
+            url = sampled.getDownloadURL(
+                filetype='CSV',
+                selectors=selectors,
+                filename='srtm_data'
+            )
 
-        output_file = f'{output_dir}/srtm_data.csv'
-        with open(output_file, 'wb') as f:
-            f.write(response.content)
+        print(f"Downloading SRTM data for {ROI_NAME}...")
+        download = download_file(url, output_file)
+        store_export(export_key, output_file)
 
         print(f"Saved to {output_file}")
+        status = 'success'
 
     except Exception as e:
         print(f"Error generating URL or downloading: {e}")
@@ -72,9 +82,13 @@ def get_srtm(ROI=config.ROI_TEST, ROI_NAME="ROI_TEST"):
         "static",
         selectors,
         ROI,
-        config.runid
+        config.runid,
+        status
     )
 
+    metadata['download'] = download
+    metadata['cache_key'] = export_key
+    attach_trace(metadata)
     metadata_dir = f'metadata/{ROI_NAME}/srtm'
     os.makedirs(metadata_dir, exist_ok=True)
     metadata_filename = f'{config.runid}.json'
@@ -1,8 +1,17 @@
 import os
 import ee
 import glob
+import json
+import math
+import re
+import shutil
 import config
+import threading
 import pandas as pd
+import pyarrow as pa
+import pyarrow.dataset as ds
+import pyarrow.parquet as pq
+import google.auth.transport.requests
 
 from functools import reduce
 from pathlib import Path
@@ -10,17 +19,48 @@ from datetime import datetime
 from google.oauth2 import service_account
 from dateutil.relativedelta import relativedelta
 
-def create_conn_ee():
-    cred = 'google_cred.json'
-    if os.path.exists(cred):
-        print(f"Connecting to Earth Engine using service account: {cred}")
-        credentials = service_account.Credentials.from_service_account_file(cred, scopes=["https://www.googleapis.com/auth/drive",
-                                                                                          "https://www.googleapis.com/auth/earthengine"])
-        ee.Initialize(credentials=credentials)
-    else:
-        print("Service account file not found. Falling back to browser-based authentication.")
-        ee.Authenticate()
-        ee.Initialize()
+# Process-wide Earth Engine session, created on the first create_conn_ee call
+_ee_session = {'initialized': False, 'credentials': None}
+_ee_lock = threading.Lock()
+
+def create_conn_ee(force=False):
+    """
+    Initializes Earth Engine once per process and reuses the session afterwards.
+
+    Every extractor calls this on entry; only the first call (or force=True) reads
+    google_cred.json and runs ee.Initialize, later calls just make sure the cached
+    service account token is still valid. Safe to call from the download worker threads.
+
+    Args:
+        force (bool): Re-read the credentials and re-initialize even if already connected.
+    """
+    with _ee_lock:
+        if _ee_session['initialized'] and not force:
+            refresh_ee_credentials()
+            return
+
+        cred = 'google_cred.json'
+        if config.EE_BACKEND == 'fake':
+            print("Using the offline fake Earth Engine backend (modules/fake_ee.py)")
+            ee.Initialize()
+        elif os.path.exists(cred):
+            print(f"Connecting to Earth Engine using service account: {cred}")
+            credentials = service_account.Credentials.from_service_account_file(cred, scopes=["https://www.googleapis.com/auth/drive",
+                                                                                              "https://www.googleapis.com/auth/earthengine"])
+            ee.Initialize(credentials=credentials)
+            _ee_session['credentials'] = credentials
+        else:
+            print("Service account file not found. Falling back to browser-based authentication.")
+            ee.Authenticate()
+            ee.Initialize()
+
+        _ee_session['initialized'] = True
+
+def refresh_ee_credentials():
+    """Refreshes the cached service account token when it is missing or expired (single place for token refresh)."""
+    credentials = _ee_session['credentials']
+    if credentials is not None and not credentials.valid:
+        credentials.refresh(google.auth.transport.requests.Request())
 
 def retrieve_sensor_data(sensor_name, roi, start_date, end_date, **kwargs):
     """
@@ -137,6 +177,9 @@ def get_missing_partitions(start_date, end_date, base_dir):
     Returns a list of dates (partitions) that are MISSING data.
     Matches format: .../year=YYYY/month=M (no zero padding for single digit months)
     Do not allow dates bigger than current month.
+
+    If the dataset has a manifest (modules/manifest.py) the answer comes from that single
+    file; the partition folders are only scanned for datasets written before it existed.
     """
     # 1. Standardize inputs
     fmt = "%Y-%m-%d"
@@ -147,6 +190,7 @@ def get_missing_partitions(start_date, end_date, base_dir):
 
     base_path = Path(base_dir)
     missing_dates = []
+    manifest = load_manifest(base_dir)
     
     # Initialize iteration at the first of the start month
     current_date = start_date.replace(day=1)
@@ -162,6 +206,13 @@ def get_missing_partitions(start_date, end_date, base_dir):
             break
         # --------------------------------------------------------------------
 
+        if manifest is not None:
+            entry = manifest['partitions'].get(partition_key(current_date.year, current_date.month))
+            if not entry or entry['rows'] == 0:
+                missing_dates.append(current_date)
+            current_date += relativedelta(months=1)
+            continue
+
         # 2. Construct path EXACTLY as shown in your example
         year_part = f"year={current_date.year}"
         month_part = f"month={current_date.month}" 
@@ -235,8 +286,8 @@ def ndmi(image):
 
 # Calculates MNDWI for Sentinel-2 Harmonized as (Green – SWIR) / (Green + SWIR)
 def mndwi(image):
-    ndre = image.normalizedDifference(['B3', 'B11']).rename('NDRE')
-    return image.addBands(ndre)
+    mndwi = image.normalizedDifference(['B3', 'B11']).rename('MNDWI')
+    return image.addBands(mndwi)
 
 # Calculates NDRE for Sentinel-2 Harmonized as (NIR - RE) / (NIR + RE)
 def ndre(image):
@@ -295,8 +346,6 @@ def rariovhvv(image):
     return image.addBands(rariovhvv)
 
 def indicesst1(image):
-    img = vv(image)
-    img = vh(image)
     img = rariovhvv(image)
     date_band = ee.Image.constant(image.get('system:time_start')).rename('date').toDouble()
 
@@ -339,12 +388,28 @@ def process_era5(image):
 # b5 = image.select('B5').resample('bicubic').reproject(crs=b4_proj, scale=10)
 # b11 = image.select('B11').resample('bicubic').reproject(crs=b4_proj, scale=10) # SWIR for NDMI
 
-def generate_metadata(source, collection, image_count, start_date, end_date, bands, roi, runid):
+def fetch_info(values):
+    """
+    Fetches several server-side values in a single getInfo() round-trip.
+
+    Each getInfo() costs 1-3 s of latency, so extractors gather every scalar they need
+    client-side into one ee.Dictionary instead of calling getInfo() on each.
+
+    Args:
+        values (dict): {name: ee.ComputedObject or plain value}
+
+    Returns:
+        dict: {name: client-side value}
+    """
+    with span('get_info', ee_calls=1):
+        return ee.Dictionary(values).getInfo()
+
+def generate_metadata(source, collection, image_count, start_date, end_date, bands, roi, runid, status=''):
 
     metadata = {
         'run_id': runid,
         'created_at': str(datetime.now()),
-        'status': '',
+        'status': status,
         'source': source,
         'provider': collection,
         'image_count': image_count,
@@ -355,91 +420,995 @@ def generate_metadata(source, collection, image_count, start_date, end_date, ban
 
     return metadata
 
+def save_metadata(metadata, roi_name, sensor_dir, start_date, end_date):
+    """
+    Writes the metadata JSON of a sensor-month as metadata/<ROI>/<sensor_dir>/<runid>_<start>_<end>.json.
+
+    When called inside a trace (modules/tracing.py, one per scheduler job) its per-stage
+    summary and spans are stored under 'timing' and 'spans'.
+    """
+    attach_trace(metadata)
+    metadata_filename = f'{roi_name}/{sensor_dir}/{config.runid}_{start_date.date()}_{end_date.date()}.json'
+    metadata_path = Path(f"{config.metadata_path}{metadata_filename}")
+    metadata_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(metadata_path, 'w') as f:
+        json.dump(metadata, f, indent=4)
+
+def save_run_metadata(run_summary, roi_name):
+    """Writes the run-level summary of a pipeline run as metadata/<ROI>/<runid>_run.json."""
+    metadata_path = Path(f"{config.metadata_path}{roi_name}/{config.runid}_run.json")
+    metadata_path.parent.mkdir(parents=True, exist_ok=True)
+
+    with open(metadata_path, 'w') as f:
+        json.dump(run_summary, f, indent=4, default=str)
+    return metadata_path
+
+# --- Gap detection at (sensor, month) granularity ---
+
+def month_starts(start_date, end_date):
+    """First day (datetime) of every month from start_date to end_date, stopping at the current month."""
+    fmt = "%Y-%m-%d"
+    if isinstance(start_date, str):
+        start_date = datetime.strptime(start_date, fmt)
+    if isinstance(end_date, str):
+        end_date = datetime.strptime(end_date, fmt)
+
+    months = []
+    current_date = datetime(start_date.year, start_date.month, 1)
+    now = datetime.now()
+
+    while current_date <= end_date and current_date <= now:
+        months.append(current_date)
+        current_date += relativedelta(months=1)
+
+    return months
+
+def month_window(month_start):
+    """(start, end) download window of a month; the current month ends today."""
+    today = datetime.combine(datetime.now().date(), datetime.min.time())
+    if (month_start.year, month_start.month) == (today.year, today.month):
+        return month_start, today
+    return month_start, month_start + relativedelta(months=1, days=-1)
+
+def is_valid_raw_csv(file):
+    """True if file is a non-empty CSV export with a header (EE error pages are not)."""
+    if not file.exists() or file.stat().st_size == 0:
+        return False
+
+    with open(file, 'r', errors='ignore') as f:
+        header = f.readline()
+    # Pixel exports carry a geometry, aggregate exports a parcel id
+    return '.geo' in header or 'parcel_id' in header
+
+def sensor_month_status(roi_name, sensor, month_start, raw_path='raw_data', metadata_path=None):
+    """
+    Status of one sensor-month from the raw CSVs and the metadata JSONs of previous runs.
+
+    Only exports of the whole month count: the current month is downloaded up to today
+    (month_window), and such a partial export must not mark the month as done once it
+    is over.
+
+    Returns:
+        str: 'complete' (a valid raw CSV of the whole month exists), 'empty' (last run of
+            the whole month found no images, nothing to download) or 'missing'.
+    """
+    raw_dir, metadata_dir = config.SENSOR_FOLDERS[sensor]
+    metadata_path = metadata_path or config.metadata_path
+    month_end = month_start + relativedelta(months=1, days=-1)
+    month_window_name = f"{month_start.date()}_{month_end.date()}"
+
+    raw_folder = Path(raw_path) / roi_name / raw_dir
+    if raw_folder.exists():
+        if is_valid_raw_csv(raw_folder / f"{month_window_name}.csv"):
+            return 'complete'
+        # Array exports are written atomically, an existing file is complete
+        if (raw_folder / f"{month_window_name}{ARRAY_SUFFIX}").exists():
+            return 'complete'
+
+    metadata_folder = Path(f"{metadata_path}{roi_name}/{metadata_dir}")
+    metadata_files = sorted(metadata_folder.glob(f"*_{month_window_name}.json"), key=os.path.getmtime) if metadata_folder.exists() else []
+    if metadata_files:
+        with open(metadata_files[-1], 'r') as f:
+            metadata = json.load(f)
+        if metadata.get('status') == 'empty' or metadata.get('image_count') == 0:
+            return 'empty'
+
+    return 'missing'
+
+# Raw time-series exports are named <start>_<end> after their download window
+RAW_EXPORT_PATTERN = re.compile(r'^(\d{4}-\d{2}-\d{2})_(\d{4}-\d{2}-\d{2})(\.csv|\.npz)$')
+
+def prune_superseded_exports(input_path):
+    """
+    Deletes the raw exports replaced by a longer download of the same month.
+
+    The current month is re-downloaded up to today on every run, so a folder holds
+    <month>_<day>.csv files of growing windows; only the latest one is kept, and the
+    partial ones are deleted once the whole month has been written. Older files are only
+    deleted when the latest one is valid.
+
+    Returns:
+        list: Deleted files.
+    """
+    latest = {}
+    exports = []
+    for file in Path(input_path).rglob('*'):
+        match = RAW_EXPORT_PATTERN.match(file.name)
+        if match is None or not file.is_file():
+            continue
+        start, end, suffix = match.groups()
+        exports.append((file, start, end))
+        key = (file.parent, start)
+        if end > latest.get(key, ''):
+            if suffix == ARRAY_SUFFIX or is_valid_raw_csv(file):
+                latest[key] = end
+
+    deleted = []
+    for file, start, end in exports:
+        if end < latest.get((file.parent, start), ''):
+            file.unlink()
+            deleted.append(file)
+
+    if deleted:
+        print(f"Removed {len(deleted)} raw exports superseded by a longer download of the same month")
+    return deleted
+
+def get_missing_sensor_months(start_date, end_date, roi_name, sensors=None, raw_path='raw_data',
+                              metadata_path=None, refresh_current_month=True):
+    """
+    Returns the (sensor, month) pairs that still have to be requested from Earth Engine.
+
+    Unlike get_missing_partitions, a month is checked for every sensor independently, so a
+    failed Landsat export is retried on its own and a missing partition does not re-fetch
+    sensors whose raw CSVs already exist.
+
+    Args:
+        start_date, end_date (str/datetime): Range to check (YYYY-MM-DD).
+        roi_name (str): ROI folder name under raw_path and metadata_path.
+        sensors (list): Keys of config.SENSOR_FOLDERS, defaults to all of them.
+        refresh_current_month (bool): Always re-download the current, still-changing month.
+
+    Returns:
+        dict: {month_start (datetime): [sensor, ...]} with only the months that have gaps.
+    """
+    sensors = sensors or list(config.SENSOR_FOLDERS)
+    now = datetime.now()
+    missing = {}
+
+    for month_start in month_starts(start_date, end_date):
+        is_current = (month_start.year, month_start.month) == (now.year, now.month)
+        for sensor in sensors:
+            if (is_current and refresh_current_month) or \
+                    sensor_month_status(roi_name, sensor, month_start, raw_path, metadata_path) == 'missing':
+                missing.setdefault(month_start, []).append(sensor)
+
+    return missing
+
 import pandas as pd
 import os
 import glob
 from functools import reduce
+from modules.pixel_grid import master_grid, snap_to_grid, save_grid, load_grid
+from modules.manifest import load_manifest, save_manifest, update_partition_entry, remove_partition_entry, manifest_files
+from modules.pixel_arrays import ARRAY_SUFFIX, load_array_stack, read_array_frame
+from modules.tracing import span, attach_trace
+from modules.spectral_indices import required_bands, add_indices
+from modules.cloud_mask import QA_BANDS, mask_frame
+from modules.speckle import POLARIZATIONS, RATIO_BAND, process_frame
+
+# Bookkeeping file for incremental rebuilds. The leading underscore keeps it
+# out of pyarrow's Hive dataset discovery.
+INGEST_STATE_FILE = '_ingest_state.json'
+
+# Per-pixel static attributes (e.g. SRTM elevation/slope/aspect) are stored once per
+# dataset under this folder, one Parquet table per source, keyed by pixel_id.
+STATIC_DIR = '_static'
+
+# Bump whenever the layout of the written partitions changes: a state file with a
+# different version forces a full rebuild so old and new partitions never mix.
+# Version 4: NDRE of legacy Sentinel-2 exports moved to MNDWI (correct_legacy_ndre)
+DATASET_SCHEMA_VERSION = 4
+
+# Columns identifying a pixel-date row: samples are snapped to the S2 master grid
+# (see modules/pixel_grid.py) and joined on its int64 pixel id
+JOIN_KEYS = ['date', 'pixel_id']
+
+# Per-pixel labels tagging time-series exports (multi-parcel batch mode). They do not
+# change over time and are stored once in a static table, so the time series drop them.
+LABEL_COLUMNS = ['parcel_id']
+
+# Aggregate exports (extraction mode 'aggregate') are stored apart from the pixel
+# partitions, as a single table with one row per (date, parcel_id)
+PARCEL_STATS_TABLE = '_parcel_stats.parquet'
+PARCEL_STATS_KEYS = ['date', 'parcel_id']
+
+# Extracts the [lon, lat] pair from a GeoJSON Point string as exported by EE, e.g.
+# {"geodesic":false,"type":"Point","coordinates":[12.8326,46.1266]}
+GEO_COORDS_PATTERN = r'"coordinates":\s*\[\s*([^,\]\s]+)\s*,\s*([^,\]\s]+)\s*\]'
+
+def parse_geo_column(df):
+    """
+    Replaces the GeoJSON Point strings in '.geo' with float64 'lon'/'lat' columns.
+
+    The parsing is a single vectorized regex extraction over the column, much cheaper
+    than json.loads per row. Rows whose geometry cannot be parsed get NaN coordinates.
+    """
+    coords = df['.geo'].astype(str).str.extract(GEO_COORDS_PATTERN)
+    df['lon'] = pd.to_numeric(coords[0], errors='coerce').astype('float64')
+    df['lat'] = pd.to_numeric(coords[1], errors='coerce').astype('float64')
+    return df.drop(columns=['.geo'])
+
+def assign_pixel_ids(df, grid):
+    """
+    Snaps the lon/lat columns to the master grid, storing the int64 'pixel_id' instead.
+
+    Rows without a valid geometry are dropped.
+    """
+    df['pixel_id'] = snap_to_grid(df['lon'].to_numpy(), df['lat'].to_numpy(), grid)
+    df = df.drop(columns=['lon', 'lat'])
+    return df[df['pixel_id'] >= 0]
+
+def grid_from_csv_files(files, sample_rows=1000):
+    """Master grid for the first time-series file in files, used when none is given or stored."""
+    for file in files:
+        if file.endswith(ARRAY_SUFFIX):
+            return load_array_stack(file)['grid']
+
+        sample = pd.read_csv(file, nrows=sample_rows)
+        sample.columns = sample.columns.str.strip()
+        if 'date' not in sample.columns or '.geo' not in sample.columns or sample.empty:
+            continue
+
+        coords = parse_geo_column(sample)[['lon', 'lat']].dropna()
+        if not coords.empty:
+            return master_grid(lon=coords['lon'].mean(), lat=coords['lat'].mean())
+    return None
+
+def correct_legacy_ndre(df):
+    """
+    Renames the NDRE columns (NDRE, NDRE_<stat>) of a Sentinel-2 export made before MNDWI
+    got its own band to MNDWI.
+
+    utils.mndwi used to name its band NDRE, so the exported NDRE held MNDWI values and the
+    real NDRE was not exported. Such exports are told apart by their missing MNDWI column;
+    their NDRE is NaN once ingested (recompute it with backfill_indices where the
+    reflectance bands were exported, or re-export the months).
+    """
+    if any(column == 'MNDWI' or column.startswith('MNDWI_') for column in df.columns):
+        return df
+    return df.rename(columns=lambda column: 'MNDWI' + column[4:]
+                     if column == 'NDRE' or column.startswith('NDRE_') else column)
+
+def read_sensor_csv(file, grid):
+    """
+    Reads a raw sensor CSV, parses its date column and snaps '.geo' to grid pixel ids.
+    Array exports (.npz, EXTRACTION_MODE = 'array') are read with read_array_frame.
+
+    Returns:
+        pd.DataFrame or None: None for static files (no 'date'/'.geo' columns, e.g. SRTM).
+    """
+    with span('parse', file=os.path.basename(file), bytes=os.path.getsize(file)) as s:
+        if str(file).endswith(ARRAY_SUFFIX):
+            df = read_array_frame(file, grid)
+        else:
+            df = pd.read_csv(file)
+            df.columns = df.columns.str.strip()
+
+            if 'date' not in df.columns or '.geo' not in df.columns:
+                return None
+
+            df['date'] = pd.to_datetime(df['date'])
+            df = assign_pixel_ids(parse_geo_column(df.drop(columns=LABEL_COLUMNS, errors='ignore')), grid)
+
+        s['rows'] = len(df)
+        return correct_legacy_ndre(df)
+
+def read_static_csv(file, grid):
+    """
+    Reads a raw static CSV (pixels without 'date', e.g. SRTM) and snaps it to grid pixel ids.
+
+    Returns:
+        pd.DataFrame or None: None if the file has no '.geo' column.
+    """
+    df = pd.read_csv(file)
+    df.columns = df.columns.str.strip()
+
+    if 'date' in df.columns or '.geo' not in df.columns:
+        return None
+
+    return assign_pixel_ids(parse_geo_column(df), grid)
+
+def write_static_table(files, output_path, source, grid):
+    """
+    Writes the static dimension table of one source as STATIC_DIR/<source>.parquet.
+
+    Samples falling in the same 10 m cell come from the same 30 m SRTM pixel, so the
+    first one is kept (averaging would also break circular values such as aspect).
+    The table is removed when no file is left for the source.
+    """
+    target_file = Path(output_path) / STATIC_DIR / f"{source}.parquet"
+    dfs = [df for df in (read_static_csv(file, grid) for file in files) if df is not None]
+
+    if not dfs:
+        if target_file.exists():
+            target_file.unlink()
+        return
+
+    static_df = pd.concat(dfs, ignore_index=True) \
+        .groupby('pixel_id', as_index=False, sort=True).first()
+
+    target_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = target_file.with_name(f".{target_file.name}.tmp")
+    static_df.to_parquet(tmp_file, engine='pyarrow', compression='snappy', index=False)
+    os.replace(tmp_file, target_file)
+    print(f"Static table for {source}: {len(static_df)} pixels")
+
+def partition_dataset(output_path, files=None):
+    """
+    pyarrow dataset over the partition files (all parquet files under output_path when
+    files is None), with the year/month Hive keys.
+
+    Partitions are built from the sensors present in their month, so their columns
+    differ: the schema is unified over every file, not inferred from the first one,
+    and columns missing from a partition read as nulls.
+    """
+    if files is None:
+        files = ds.dataset(output_path, format='parquet', partitioning='hive').files
+
+    discovered = ds.dataset(files, format='parquet', partitioning='hive', partition_base_dir=str(output_path))
+    schema = pa.unify_schemas([*(pq.read_schema(file) for file in files), discovered.schema],
+                              promote_options='permissive')
+    return ds.dataset(files, schema=schema, format='parquet', partitioning='hive',
+                      partition_base_dir=str(output_path))
+
+def read_dataset(output_path, columns=None, filters=None, with_static=True):
+    """
+    Reads the Hive-partitioned dataset, attaching the static per-pixel tables on demand.
+
+    Partition files are taken from the manifest when present, so no directory walk is
+    needed. Static tables hold one row per pixel (a few thousand rows per ROI), so they
+    are broadcast-joined on pixel_id after the time series has been filtered.
+
+    Args:
+        output_path (str): Root of the dataset written by create_partitioned_dataset.
+        columns (list): Time-series columns to read (pixel_id is always added).
+        filters (list): pyarrow filters, e.g. [('year', '=', 2024), ('month', 'in', [6, 7])].
+        with_static (bool/list): True for all static sources, a list of source names
+            (e.g. ['srtm']) for a subset, False for none.
+
+    Returns:
+        pd.DataFrame
+    """
+    if columns is not None and 'pixel_id' not in columns:
+        columns = list(columns) + ['pixel_id']
+
+    manifest = load_manifest(output_path)
+    files = manifest_files(output_path, manifest) if manifest is not None else None
+    if files == []:
+        # No partition written yet: an empty frame with the requested columns
+        df = pd.DataFrame({column: pd.Series(dtype='int64' if column == 'pixel_id' else 'float64')
+                           for column in (columns if columns is not None else JOIN_KEYS)})
+        if 'date' in df.columns:
+            df['date'] = df['date'].astype('datetime64[ns]')
+    else:
+        dataset = partition_dataset(output_path, files)
+        expression = pq.filters_to_expression(filters) if filters else None
+        df = dataset.to_table(columns=columns, filter=expression).to_pandas()
+
+    static_dir = Path(output_path) / STATIC_DIR
+    if not with_static or not static_dir.exists():
+        return df
+
+    for static_file in sorted(static_dir.glob('*.parquet')):
+        if with_static is True or static_file.stem in with_static:
+            df = df.merge(pd.read_parquet(static_file), on='pixel_id', how='left')
+
+    return df
 
-def create_partitioned_dataset(input_path, output_path="dataset"):
+def write_parcel_stats(input_path, output_path):
+    """
+    Writes the aggregate exports under input_path as output_path/PARCEL_STATS_TABLE.
+
+    Exports of one sensor are stacked and the sensors outer-joined on PARCEL_STATS_KEYS.
+    Same-day acquisitions of a sensor (overlapping tiles) are averaged, as in join_sources.
+    The table holds a row per parcel and date, so it is rebuilt from all raw files each
+    time; it is removed when no file is left.
+    """
+    target_file = Path(output_path) / PARCEL_STATS_TABLE
+    files_by_source = {}
+
+    for file in sorted(glob.glob(os.path.join(input_path, "**/*.csv"), recursive=True)):
+        with span('parse', file=os.path.basename(file), bytes=os.path.getsize(file)) as s:
+            df = pd.read_csv(file, dtype={'parcel_id': str})
+            df.columns = df.columns.str.strip()
+            if not set(PARCEL_STATS_KEYS).issubset(df.columns):
+                print(f"Skipping {file}: not an aggregate export")
+                continue
+
+            df['date'] = pd.to_datetime(df['date'])
+            s['rows'] = len(df)
+        files_by_source.setdefault(os.path.basename(os.path.dirname(file)), []).append(correct_legacy_ndre(df))
+
+    if not files_by_source:
+        if target_file.exists():
+            target_file.unlink()
+        print("No parcel aggregates found.")
+        return
+
+    with span('merge') as s:
+        dfs = [
+            pd.concat(dfs, ignore_index=True).groupby(PARCEL_STATS_KEYS, as_index=False, sort=False).mean(numeric_only=True)
+            for dfs in files_by_source.values()
+        ]
+        stats_df = reduce(lambda left, right: pd.merge(left, right, on=PARCEL_STATS_KEYS, how='outer'), dfs)
+        s['rows'] = len(stats_df)
+
+    target_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = target_file.with_name(f".{target_file.name}.tmp")
+    with span('parquet_write', rows=len(stats_df)) as s:
+        stats_df.sort_values(PARCEL_STATS_KEYS).to_parquet(tmp_file, engine='pyarrow', compression='snappy', index=False)
+        s['bytes'] = os.path.getsize(tmp_file)
+        os.replace(tmp_file, target_file)
+    print(f"Parcel aggregates: {len(stats_df)} rows written to {target_file}")
+
+def read_parcel_stats(output_path, columns=None, parcels=None, filters=None):
+    """
+    Reads the parcel aggregates written by write_parcel_stats.
+
+    Args:
+        output_path (str): Dataset root, e.g. database/<ROI>.
+        columns (list): Statistic columns to read (the keys are always added).
+        parcels (list): Parcel ids to keep, all when None.
+        filters (list): Further pyarrow filters, e.g. [('date', '>=', pd.Timestamp('2024-06-01'))].
+
+    Returns:
+        pd.DataFrame
+    """
+    if columns is not None:
+        columns = PARCEL_STATS_KEYS + [c for c in columns if c not in PARCEL_STATS_KEYS]
+
+    filters = list(filters or [])
+    if parcels is not None:
+        filters.append(('parcel_id', 'in', [str(p) for p in parcels]))
+
+    return pd.read_parquet(Path(output_path) / PARCEL_STATS_TABLE, engine='pyarrow', columns=columns,
+                           filters=filters or None)
+
+def partition_key(year, month):
+    """Key used to identify a year=/month= partition (no zero padding, as on disk)."""
+    return f"{int(year)}-{int(month)}"
+
+def existing_partition_keys(output_path):
+    """Keys of the partitions of a dataset, from its manifest and its year=/month= folders."""
+    manifest = load_manifest(output_path) or {'partitions': {}}
+    keys = set(manifest['partitions'])
+    for month_dir in Path(output_path).glob('year=*/month=*'):
+        keys.add(partition_key(month_dir.parent.name.split('=')[1], month_dir.name.split('=')[1]))
+    return keys
+
+def ingest_settings():
+    """Config the partitions are computed with locally; a change rebuilds them all."""
+    return {'cloud_mask_rules': config.CLOUD_MASK_RULES, 'shadow_mask_rules': config.SHADOW_MASK_RULES,
+            's1_speckle_filter': config.S1_SPECKLE_FILTER, 'local_indices': list(config.LOCAL_INDICES)}
+
+def load_ingest_state(output_path):
+    """
+    Loads the record of raw CSVs already ingested into output_path.
+
+    Returns:
+        dict: {csv_path: {'mtime': float, 'size': int, 'partitions': [key, ...]}}
+    """
+    state_file = Path(output_path) / INGEST_STATE_FILE
+    if not state_file.exists():
+        return {}
+
+    with open(state_file, 'r') as f:
+        state = json.load(f)
+
+    if state.get('schema_version') != DATASET_SCHEMA_VERSION:
+        print("Dataset schema changed since last run, rebuilding all partitions.")
+        return {}
+    if state.get('settings') != ingest_settings():
+        print("Ingestion settings changed since last run, rebuilding all partitions.")
+        return {}
+    return state['files']
+
+def save_ingest_state(output_path, state):
+    """Writes the ingest state through a temp file so a crash never leaves it half written."""
+    state_file = Path(output_path) / INGEST_STATE_FILE
+    state_file.parent.mkdir(parents=True, exist_ok=True)
+    tmp_file = state_file.with_name(f".{state_file.name}.tmp")
+
+    with open(tmp_file, 'w') as f:
+        json.dump({'schema_version': DATASET_SCHEMA_VERSION, 'settings': ingest_settings(), 'files': state}, f, indent=4)
+    os.replace(tmp_file, state_file)
+
+def file_signature(file):
+    """(mtime, size) pair used to detect new or modified raw CSVs."""
+    stat = os.stat(file)
+    return {'mtime': stat.st_mtime, 'size': stat.st_size}
+
+def join_sources(dfs):
+    """
+    Outer-joins per-source DataFrames on JOIN_KEYS.
+
+    Several samples of one source can fall in the same 10 m cell (e.g. Landsat or SRTM
+    sampled off the S2 grid), they are averaged first so the join stays one row per key.
+    Rows are sorted by all columns before averaging, so the result does not depend on the
+    order the raw files were read in (incremental runs read changed files first).
+    """
+    dfs = [
+        df.sort_values(JOIN_KEYS + [c for c in df.columns if c not in JOIN_KEYS], kind='mergesort')
+        .groupby(JOIN_KEYS, as_index=False, sort=False).mean(numeric_only=True)
+        for df in dfs
+    ]
+    return reduce(
+        lambda left, right: pd.merge(
+            left,
+            right,
+            on=JOIN_KEYS,
+            how='outer'
+        ),
+        dfs
+    )
+
+def apply_local_cloud_mask(df):
+    """
+    Masks the frame of a source exported unmasked with the Sentinel-2 QA bands
+    (config.S2_CLOUD_MASK = 'local'), see modules/cloud_mask.py; other frames are
+    returned unchanged. The frame must hold whole dates.
+    """
+    if set(QA_BANDS).issubset(df.columns):
+        return mask_frame(df)
+    return df
+
+def apply_local_s1_processing(df):
+    """
+    Despeckles the frame of a source exported unfiltered (config.S1_DESPECKLE = 'local',
+    VV/VH without RATIOVHVV) and derives RATIOVHVV, see modules/speckle.py; other frames
+    are returned unchanged. The frame must hold whole dates.
+    """
+    if set(POLARIZATIONS).issubset(df.columns) and RATIO_BAND not in df.columns:
+        return process_frame(df)
+    return df
+
+def apply_local_processing(df):
+    """Local per-source stages run before the join (Sentinel-1 filtering, Sentinel-2 mask)."""
+    return apply_local_cloud_mask(apply_local_s1_processing(df))
+
+def apply_local_indices(df, indices=None):
+    """
+    Recomputes indices (config.LOCAL_INDICES by default) from the reflectance band columns
+    of a merged frame, replacing the exported values (modules/spectral_indices.py).
+    Frames without the bands are returned unchanged.
+    """
+    indices = config.LOCAL_INDICES if indices is None else indices
+    if indices and set(required_bands(indices)).issubset(df.columns):
+        add_indices(df, indices)
+    return df
+
+def merge_sources(files_by_source):
+    """
+    Stacks the DataFrames of each source vertically, then outer-joins sources on JOIN_KEYS.
+
+    Args:
+        files_by_source (dict): {source_folder: [df, ...]}
+
+    Returns:
+        pd.DataFrame or None
+    """
+    # Stacking per source first prevents the "Duplicate Columns" error. Sources are joined
+    # in name order, so the column order does not depend on which files changed
+    consolidated_dfs = []
+
+    for source, df_list in sorted(files_by_source.items()):
+        print(f"Stacking {len(df_list)} files for source: {source}")
+        consolidated_dfs.append(apply_local_processing(pd.concat(df_list, ignore_index=True)))
+
+    if not consolidated_dfs:
+        return None
+
+    print("Merging different sources (Outer Join)...")
+    with span('merge') as s:
+        merged = apply_local_indices(join_sources(consolidated_dfs))
+        s['rows'] = len(merged)
+    return merged
+
+def swap_partition_file(target_dir, tmp_file):
+    """
+    Moves a fully written temp file over the partition's 'part-0.parquet' and removes
+    any other data file left over from previous writes.
+    """
+    target_file = Path(target_dir) / 'part-0.parquet'
+    os.replace(tmp_file, target_file)
+
+    for f in Path(target_dir).iterdir():
+        if f.is_file() and f != target_file and not f.name.startswith('.'):
+            f.unlink()
+
+def replace_partition(df, output_path, year, month):
+    """
+    Atomically replaces the content of a single year=/month= partition.
+
+    The new data is written to a hidden temp file inside the partition folder and
+    moved over 'part-0.parquet' with os.replace, so readers see either the old or
+    the new partition, never a half-written one. An empty df removes the partition.
+    """
+    target_dir = Path(output_path) / f"year={int(year)}" / f"month={int(month)}"
+
+    if df is None or df.empty:
+        if target_dir.exists():
+            shutil.rmtree(target_dir)
+        return
+
+    target_dir.mkdir(parents=True, exist_ok=True)
+    tmp_file = target_dir / ".part-0.parquet.tmp"
+
+    with span('parquet_write', partition=partition_key(year, month), rows=len(df)) as s:
+        df.drop(columns=['year', 'month'], errors='ignore').sort_values(JOIN_KEYS).to_parquet(
+            tmp_file,
+            engine='pyarrow',
+            compression='snappy',
+            index=False
+        )
+        s['bytes'] = os.path.getsize(tmp_file)
+        swap_partition_file(target_dir, tmp_file)
+
+def backfill_indices(output_path, indices):
+    """
+    Recomputes indices in every partition of a dataset that holds the reflectance bands
+    (config.S2_EXPORT_BANDS), locally and without re-exporting, e.g.
+    backfill_indices('database/ROI_TEST', ['MNDWI', 'NDRE']).
+
+    Partitions are replaced atomically and their manifest entries refreshed. Partitions
+    rebuilt later by ingestion get the exported values back unless the indices are in
+    config.LOCAL_INDICES.
+
+    Returns:
+        list: Keys of the rewritten partitions.
+    """
+    needed = required_bands(indices)
+    manifest = load_manifest(output_path) or {'partitions': {}}
+    rewritten = []
+
+    for part_file in sorted(Path(output_path).glob('year=*/month=*/part-0.parquet')):
+        if not set(needed).issubset(pq.read_schema(part_file).names):
+            continue
+
+        year = part_file.parent.parent.name.split('=', 1)[1]
+        month = part_file.parent.name.split('=', 1)[1]
+        key = partition_key(year, month)
+        replace_partition(add_indices(pd.read_parquet(part_file), indices), output_path, year, month)
+        sensors = manifest['partitions'].get(key, {}).get('sensors', [])
+        update_partition_entry(manifest, key, output_path, part_file, sensors, config.runid)
+        rewritten.append(key)
+
+    if rewritten:
+        save_manifest(output_path, manifest)
+    print(f"Recomputed {indices} in {len(rewritten)} partitions of {output_path}")
+    return rewritten
+
+# --- Streaming ingestion (bounded memory) ---
+
+# Rough in-memory size of a pandas frame relative to its snappy Parquet file
+PARQUET_EXPANSION = 6
+
+def memory_budget_bytes(memory_limit_mb):
+    """Bytes a single DataFrame may take; pandas parsing/merging needs ~4x headroom."""
+    return memory_limit_mb * 1024 ** 2 / 4
+
+def estimate_chunk_rows(file, memory_limit_mb, sample_rows=1000):
+    """Number of CSV rows per chunk that keeps one parsed chunk within the memory budget."""
+    sample = pd.read_csv(file, nrows=sample_rows)
+    if sample.empty:
+        return sample_rows
+
+    row_bytes = sample.memory_usage(deep=True).sum() / len(sample)
+    return max(sample_rows, int(memory_budget_bytes(memory_limit_mb) // row_bytes))
+
+def stage_sensor_csv(file, staging_dir, writers, memory_limit_mb, grid):
+    """
+    Streams a raw sensor CSV in chunks into per-(source, partition) Parquet staging files.
+
+    Sensor columns are cast to float64 so every chunk shares the same schema. Array
+    exports (.npz) hold one compact sensor-month and are staged as a single chunk.
+
+    Args:
+        file (str): Raw CSV path.
+        staging_dir (Path): Folder holding the staging files.
+        writers (dict): Open pq.ParquetWriter objects keyed by (source, partition_key), shared across files.
+        memory_limit_mb (int): Memory ceiling used to size the chunks.
+        grid (dict): Master grid definition used to compute pixel ids.
+
+    Returns:
+        list or None: Partition keys found in the file, None for static files.
+    """
+    with span('parse', file=os.path.basename(file), bytes=os.path.getsize(file)) as s:
+        source = os.path.basename(os.path.dirname(file))
+        partitions = set()
+
+        if file.endswith(ARRAY_SUFFIX):
+            chunks = [read_array_frame(file, grid)]
+        else:
+            chunks = pd.read_csv(file, chunksize=estimate_chunk_rows(file, memory_limit_mb))
+
+        for chunk in chunks:
+            chunk.columns = chunk.columns.str.strip()
+            if 'date' not in chunk.columns or ('pixel_id' not in chunk.columns and '.geo' not in chunk.columns):
+                return None
+            s['rows'] += len(chunk)
+            chunk = correct_legacy_ndre(chunk)
+
+            chunk['date'] = pd.to_datetime(chunk['date'])
+            chunk = chunk.drop(columns=LABEL_COLUMNS, errors='ignore')
+            if 'pixel_id' not in chunk.columns:
+                chunk = assign_pixel_ids(parse_geo_column(chunk), grid)
+            for col in chunk.columns:
+                if col not in JOIN_KEYS:
+                    chunk[col] = pd.to_numeric(chunk[col], errors='coerce').astype('float64')
+
+            for (year, month), group in chunk.groupby([chunk['date'].dt.year, chunk['date'].dt.month]):
+                key = partition_key(year, month)
+                table = pa.Table.from_pandas(group, preserve_index=False)
+
+                if (source, key) not in writers:
+                    writers[(source, key)] = pq.ParquetWriter(
+                        Path(staging_dir) / f"{source}__{key}.parquet", table.schema, compression='snappy'
+                    )
+                writer = writers[(source, key)]
+                writer.write_table(table.select(writer.schema.names).cast(writer.schema))
+                partitions.add(key)
+
+        return sorted(partitions)
+
+def write_partition_streaming(staged_files, output_path, year, month, memory_limit_mb):
+    """
+    Merges the staged sources of one partition and writes it as a sequence of row groups.
+
+    When the staged data would not fit the memory budget, the month is split into
+    date windows; since 'date' is part of the join key each window is merged on its own.
+    The file is written to a hidden temp path and swapped in atomically.
+
+    Args:
+        staged_files (dict): {source: staging parquet path} for this partition.
+    """
+    target_dir = Path(output_path) / f"year={int(year)}" / f"month={int(month)}"
+    tmp_file = target_dir / ".part-0.parquet.tmp"
+
+    month_start = pd.Timestamp(year=int(year), month=int(month), day=1)
+    month_end = month_start + pd.offsets.MonthBegin(1)
+    staged_bytes = sum(os.path.getsize(p) for p in staged_files.values())
+    n_windows = math.ceil(staged_bytes * PARQUET_EXPANSION / memory_budget_bytes(memory_limit_mb))
+    n_windows = min(max(n_windows, 1), month_start.days_in_month)
+    edges = pd.date_range(month_start, month_end, periods=n_windows + 1)
+
+    partition = partition_key(year, month)
+    writer = None
+    for lo, hi in zip(edges[:-1], edges[1:]):
+        window_filter = [('date', '>=', lo), ('date', '<', hi)]
+        with span('merge', partition=partition) as s:
+            dfs = [apply_local_processing(pq.read_table(path, filters=window_filter).to_pandas())
+                   for path in staged_files.values()]
+            merged = apply_local_indices(join_sources(dfs))
+            s['rows'] = len(merged)
+        if merged.empty:
+            continue
+
+        # Windows are in date order, so sorting each one keeps the whole file sorted
+        with span('parquet_write', partition=partition, rows=len(merged)):
+            merged = merged.sort_values(JOIN_KEYS)
+            table = pa.Table.from_pandas(merged, preserve_index=False)
+            if writer is None:
+                target_dir.mkdir(parents=True, exist_ok=True)
+                writer = pq.ParquetWriter(tmp_file, table.schema, compression='snappy')
+            writer.write_table(table.select(writer.schema.names).cast(writer.schema))
+
+    if writer is None:
+        replace_partition(None, output_path, year, month)
+        return
+
+    with span('parquet_write', partition=partition) as s:
+        writer.close()
+        s['bytes'] = os.path.getsize(tmp_file)
+        swap_partition_file(target_dir, tmp_file)
+
+def create_partitioned_dataset(input_path, output_path="dataset", incremental=False, streaming=False,
+                               memory_limit_mb=config.INGEST_MEMORY_LIMIT_MB, grid=None):
     """
     1. Groups files by their parent folder (e.g., sentinel_1, sentinel_2).
     2. Concatenates (stacks) files within the same folder vertically.
     3. Merges the resulting DataFrames from different folders horizontally.
-    4. Writes the result to a Hive-partitioned dataset.
+    4. Writes the result to a Hive-partitioned dataset, one atomic replace per partition.
+
+    Args:
+        input_path (str): Folder containing the raw CSVs (searched recursively).
+        output_path (str): Root of the Hive dataset.
+        incremental (bool): If True, only the year=/month= partitions touched by new,
+            modified or deleted raw CSVs since the last run are re-read and rewritten.
+            Changes are detected from file mtime/size recorded in INGEST_STATE_FILE.
+        streaming (bool): If True, CSVs are read in chunks and staged to Parquet, then
+            each partition is merged and written in row groups, keeping peak memory
+            around memory_limit_mb instead of several times the raw archive size.
+        memory_limit_mb (int): Memory ceiling for the streaming path.
+        grid (dict): Master grid (modules.pixel_grid.master_grid) samples are snapped to.
+            Defaults to the grid stored with the dataset, else one derived from the data.
     """
-    # 1. Find all CSV files
-    all_files = glob.glob(os.path.join(input_path, "**/*.csv"), recursive=True)
-    
+    # 1. Find all raw files (CSV exports and .npz array exports)
+    all_files = sorted(
+        glob.glob(os.path.join(input_path, "**/*.csv"), recursive=True)
+        + glob.glob(os.path.join(input_path, f"**/*{ARRAY_SUFFIX}"), recursive=True)
+    )
+
     if not all_files:
-        print("No CSV files found.")
+        print("No raw files found.")
+        return
+
+    stored_grid = load_grid(output_path)
+    grid = grid or stored_grid or grid_from_csv_files(all_files)
+    if grid is None:
+        print("No valid time-series data found.")
         return
 
+    previous_state = load_ingest_state(output_path) if incremental else {}
+    if previous_state and stored_grid != grid:
+        print("Master grid changed since last run, rebuilding all partitions.")
+        previous_state = {}
+    signatures = {file: file_signature(file) for file in all_files}
+
+    if incremental:
+        changed_files = [
+            file for file in all_files
+            if file not in previous_state
+            or {k: previous_state[file].get(k) for k in ('mtime', 'size')} != signatures[file]
+        ]
+        deleted_files = [file for file in previous_state if file not in signatures]
+
+        if not changed_files and not deleted_files:
+            print("No raw files changed since last run. Dataset is up to date.")
+            return
+        print(f"{len(changed_files)} new/modified and {len(deleted_files)} deleted raw files")
+    else:
+        changed_files = all_files
+        deleted_files = []
+
+    state = {file: dict(previous_state[file]) for file in all_files if file in previous_state}
+
     # Dictionary to hold lists of DataFrames by their folder name
     # structure: { 'sentinel_1': [df1, df2], 'sentinel_2': [df3, df4] }
     files_by_source = {}
+    affected_partitions = set()
+    affected_static_sources = set()
+    # structure: { '2024-6': {'sentinel_1', 'sentinel_2'} }
+    partition_sources = {}
+
+    # Streaming path: chunks go to staging Parquet files instead of files_by_source
+    staging_dir = Path(output_path) / '.staging'
+    staging_writers = {}
+    if streaming:
+        if staging_dir.exists():
+            shutil.rmtree(staging_dir)
+        staging_dir.mkdir(parents=True)
+
+    def ingest(file):
+        """Reads/stages one file, returns its partition keys (None for static files)."""
+        parent_folder = os.path.basename(os.path.dirname(file))
+
+        if streaming:
+            partitions = stage_sensor_csv(file, staging_dir, staging_writers, memory_limit_mb, grid)
+        else:
+            df = read_sensor_csv(file, grid)
+            if df is None:
+                return None
+
+            files_by_source.setdefault(parent_folder, []).append(df)
+            months = df['date'].dt.to_period('M').unique()
+            partitions = sorted({partition_key(m.year, m.month) for m in months})
+
+        for key in partitions or []:
+            partition_sources.setdefault(key, set()).add(parent_folder)
+        return partitions
 
     print("Reading and grouping files...")
-    
-    for file in all_files:
-        # Get the parent folder name to use as the "Source ID"
-        parent_folder = os.path.basename(os.path.dirname(file))
-        
+
+    # 2. Read changed files and find which partitions they touch
+    for file in changed_files:
         try:
-            df = pd.read_csv(file)
-            df.columns = df.columns.str.strip()
-            
-            # Only process if it has a date (ignore SRTM/static files)
-            if 'date' in df.columns and '.geo' in df.columns:
-                df['date'] = pd.to_datetime(df['date'])
-                
-                if parent_folder not in files_by_source:
-                    files_by_source[parent_folder] = []
-                files_by_source[parent_folder].append(df)
-            else:
-                print(f"Skipping static file: {os.path.basename(file)}")
-                
+            partitions = ingest(file)
         except Exception as e:
             print(f"Error reading {file}: {e}")
-
-    # 2. Concatenate files from the SAME source (Vertical Stack)
-    # This prevents the "Duplicate Columns" error
-    consolidated_dfs = []
-    
-    for source, df_list in files_by_source.items():
-        print(f"Stacking {len(df_list)} files for source: {source}")
-        # Stack rows (e.g. Jan + Dec)
-        stacked_df = pd.concat(df_list, ignore_index=True)
-        consolidated_dfs.append(stacked_df)
-
-    # 3. Merge different sources (Horizontal Join)
-    if consolidated_dfs:
-        print("Merging different sources (Outer Join)...")
-        final_df = reduce(
-            lambda left, right: pd.merge(
-                left, 
-                right, 
-                on=['date', '.geo'], 
-                how='outer'
-            ), 
-            consolidated_dfs
-        )
-    else:
+            continue
+
+        if partitions is None:
+            state[file] = {**signatures[file], 'partitions': [], 'static': True}
+            affected_static_sources.add(os.path.basename(os.path.dirname(file)))
+            continue
+
+        state[file] = {**signatures[file], 'partitions': partitions}
+        affected_partitions.update(partitions)
+
+    for file in deleted_files:
+        affected_partitions.update(previous_state[file].get('partitions', []))
+        if previous_state[file].get('static'):
+            affected_static_sources.add(os.path.basename(os.path.dirname(file)))
+
+    # 3. Unchanged files sharing a partition with a changed one must be re-read too
+    if incremental:
+        for file in all_files:
+            if file in changed_files or file not in state:
+                continue
+            if affected_partitions.intersection(state[file].get('partitions', [])):
+                try:
+                    ingest(file)
+                except Exception as e:
+                    print(f"Error reading {file}: {e}")
+
+    # 4. Static files are written once as per-pixel dimension tables
+    for source in sorted(affected_static_sources):
+        static_files = [
+            file for file in all_files
+            if state.get(file, {}).get('static') and os.path.basename(os.path.dirname(file)) == source
+        ]
+        write_static_table(static_files, output_path, source, grid)
+
+    # A full rebuild has no record of the deleted raw files, so partitions and static
+    # tables left without any source file are found from the existing dataset
+    if not previous_state:
+        affected_partitions.update(existing_partition_keys(output_path))
+        for static_file in (Path(output_path) / STATIC_DIR).glob('*.parquet'):
+            if static_file.stem not in affected_static_sources:
+                static_file.unlink()
+
+    if not affected_partitions and not affected_static_sources:
         print("No valid time-series data found.")
+        if streaming:
+            shutil.rmtree(staging_dir)
         return
 
-    # 4. Create Partitions and Write
-    print("Generating partitions and writing to disk...")
-    final_df['year'] = final_df['date'].dt.year
-    final_df['month'] = final_df['date'].dt.month
-
-    final_df.to_parquet(
-        output_path,
-        partition_cols=['year', 'month'],
-        engine='pyarrow',
-        compression='snappy',
-        index=False
-    )
+    # 5. Merge different sources (Horizontal Join), create Partitions and Write
+    print(f"Rewriting {len(affected_partitions)} partitions...")
+    if streaming:
+        for writer in staging_writers.values():
+            writer.close()
+
+        for key in sorted(affected_partitions):
+            year, month = key.split('-')
+            staged_files = {
+                source: staging_dir / f"{source}__{key}.parquet"
+                for (source, staged_key) in sorted(staging_writers) if staged_key == key
+            }
+            if staged_files:
+                write_partition_streaming(staged_files, output_path, year, month, memory_limit_mb)
+            else:
+                replace_partition(None, output_path, year, month)
+
+        shutil.rmtree(staging_dir)
+    else:
+        final_df = merge_sources(files_by_source)
+        groups = {}
+        if final_df is not None:
+            final_df['year'] = final_df['date'].dt.year
+            final_df['month'] = final_df['date'].dt.month
+            groups = {partition_key(y, m): g for (y, m), g in final_df.groupby(['year', 'month'])}
+
+        for key in sorted(affected_partitions):
+            year, month = key.split('-')
+            replace_partition(groups.get(key), output_path, year, month)
+
+    # 6. Record the rewritten partitions in the manifest
+    manifest = load_manifest(output_path) or {'partitions': {}}
+    for key in sorted(affected_partitions):
+        year, month = key.split('-')
+        part_file = Path(output_path) / f"year={year}" / f"month={month}" / 'part-0.parquet'
+        if part_file.exists():
+            update_partition_entry(manifest, key, output_path, part_file, partition_sources.get(key, []), config.runid)
+        else:
+            remove_partition_entry(manifest, key)
+
+    save_manifest(output_path, manifest)
+    save_grid(output_path, grid)
+    save_ingest_state(output_path, state)
     print(f"Success! Data written to: {output_path}")
 
 # --- Usage ---
-# create_partitioned_dataset_grouped("raw_data/ROI_TEST")
\ No newline at end of file
+# create_partitioned_dataset_grouped("raw_data/ROI_TEST")